@@ -1,8 +1,50 @@
-from flask import Flask, render_template, request, jsonify
-from langchain_email_generator import run_email_generation_pipeline
+import json
+import os
+import tempfile
+import uuid
 
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+from bulk_generator import iter_bulk_records, read_analysis_ids, resolve_concurrency, run_output_path
+from config import config
+import diagnostics
+from langchain_email_generator import run_email_generation_pipeline, iter_email_generation_events, pipeline_flight, extraction_flight, resolve_mode, resolve_deadline_ms, DeadlineExceeded, regenerate_emails, StageResultsNotFound
+from hedging import hedger
+from inital_analysis_data_extractor import connection_pool_stats, extractor_cache_stats, AnalysisNotReady, AnalysisFailed
+from jobs import job_manager, JobQueueFull
+from llm_cache import cache
+from llm_client import json_mode_stats, llm_flight, runtime_stats, warm_up
+from prompt_budget import prompt_stats
+from readiness import readiness_watcher, resolve_max_wait_ms
+from rate_limiter import limiter
+from scheduler import scheduler, resolve_priority, SchedulerQueueFull
+from stage_store import stage_store
+from structured_output import parse_stats
+from telemetry import configure_logging, registry
+
+configure_logging()
+# Before any request, loop or extractor thread exists.
+diagnostics.limit_malloc_arenas()
 app = Flask(__name__)
 
+def runtime_diagnostics():
+    return {
+        "llm": runtime_stats(),
+        "extractor_pools": connection_pool_stats(),
+        "jobs": job_manager.stats(),
+        "readiness": readiness_watcher.stats(),
+        "scheduler": scheduler.stats(),
+    }
+
+# DIAGNOSTICS_ENABLED=true traces allocations from here on and serves
+# /debug/diagnostics (also dumped to the log on SIGUSR1).
+if config.diagnostics_enabled:
+    diagnostics.enable(extra=runtime_diagnostics)
+
+# LLM modules load lazily; WARM_UP=true loads them and connects to the
+# provider now instead of during the first request.
+if config.warm_up:
+    warm_up()
+
 @app.route('/')
 def home():
     return render_template('index.html')
@@ -16,13 +58,241 @@ def generate_email():
     if not analysis_id:
         return jsonify({"error": "analysis_id is required"}), 400
     
+    # "fresh": true bypasses the LLM response cache for this generation.
+    fresh = bool(data.get("fresh", False))
     try:
-        result = run_email_generation_pipeline(analysis_id)
+        mode = resolve_mode(data.get("mode"))
+        # "deadline_ms" caps the whole generation; emails not done by then are
+        # reported in "items" as timed out instead of failing the request.
+        deadline_ms = resolve_deadline_ms(data.get("deadline_ms"))
+        # Scripted callers should send "priority": "batch" so they do not
+        # compete with reps clicking in the UI; "tenant" groups their calls
+        # for fair sharing (default: the analysis_id).
+        priority = resolve_priority(data.get("priority"), "interactive")
+        # "max_wait_ms": how long to wait for an initial analysis that is
+        # still running (0: fail right away with 409).
+        max_wait_ms = resolve_max_wait_ms(data.get("max_wait_ms"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        result = run_email_generation_pipeline(analysis_id, fresh=fresh, mode=mode, deadline_ms=deadline_ms, priority=priority, tenant=data.get("tenant"),
+                                               max_wait_ms=max_wait_ms)
         return jsonify(result)
 
+    except AnalysisNotReady as e:
+        return jsonify({"error": str(e)}), 409
+    except AnalysisFailed as e:
+        return jsonify({"error": str(e)}), 422
+    except DeadlineExceeded as e:
+        return jsonify({"error": str(e)}), 504
+    except SchedulerQueueFull as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+
+@app.route("/generate-email/regenerate", methods=['POST'])
+def regenerate_email():
+    # Redoes only the chosen emails of the last generation for analysis_id:
+    # {"index": 2}, {"indices": [0, 3]} or {"failed_only": true}.
+    data = request.json
+    analysis_id = data.get("analysis_id")
+
+    if not analysis_id:
+        return jsonify({"error": "analysis_id is required"}), 400
+
+    failed_only = bool(data.get("failed_only", False))
+    indices = data.get("indices")
+    if indices is None and data.get("index") is not None:
+        indices = [data.get("index")]
+    if not failed_only and not indices:
+        return jsonify({"error": "index, indices or failed_only is required"}), 400
+
+    try:
+        priority = resolve_priority(data.get("priority"), "interactive")
+        return jsonify(regenerate_emails(analysis_id, indices=indices, failed_only=failed_only, priority=priority, tenant=data.get("tenant")))
+    except StageResultsNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except SchedulerQueueFull as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/generate-email/stream", methods=['POST'])
+def generate_email_stream():
+    data = request.json
+    analysis_id = data.get("analysis_id")
+
+    if not analysis_id:
+        return jsonify({"error": "analysis_id is required"}), 400
+
+    fresh = bool(data.get("fresh", False))
+    try:
+        mode = resolve_mode(data.get("mode"))
+        deadline_ms = resolve_deadline_ms(data.get("deadline_ms"))
+        priority = resolve_priority(data.get("priority"), "interactive")
+        max_wait_ms = resolve_max_wait_ms(data.get("max_wait_ms"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Server-Sent Events: one "event:/data:" frame per pipeline stage so the
+    # UI can render each email the moment it is ready.
+    def sse():
+        for event in iter_email_generation_events(analysis_id, fresh=fresh, mode=mode, deadline_ms=deadline_ms, priority=priority, tenant=data.get("tenant"),
+                                                  max_wait_ms=max_wait_ms):
+            yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+    return Response(
+        stream_with_context(sse()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.route("/jobs", methods=['POST'])
+def create_job():
+    data = request.json
+    analysis_id = data.get("analysis_id")
+
+    if not analysis_id:
+        return jsonify({"error": "analysis_id is required"}), 400
+
+    try:
+        mode = resolve_mode(data.get("mode"))
+        deadline_ms = resolve_deadline_ms(data.get("deadline_ms"))
+        # The UI generates through /jobs, so jobs default to interactive.
+        priority = resolve_priority(data.get("priority"), "interactive")
+        # A job for an analysis that is still running waits for it (stage
+        # "waiting_for_analysis") and then generates on its own.
+        max_wait_ms = resolve_max_wait_ms(data.get("max_wait_ms"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        job = job_manager.submit(analysis_id, fresh=bool(data.get("fresh", False)), mode=mode, deadline_ms=deadline_ms,
+                                 priority=priority, tenant=data.get("tenant"), max_wait_ms=max_wait_ms)
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503
+
+    return jsonify(job), 202
+
+
+@app.route("/jobs/<job_id>", methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job)
+
+
+@app.route("/bulk-generate", methods=['POST'])
+def bulk_generate():
+    # Accepts {"analysis_ids": [...]} as JSON or an uploaded CSV/JSONL "file".
+    # Results stream back as NDJSON; re-posting with the same run_id resumes
+    # from the run's checkpoint instead of regenerating finished companies.
+    if "file" in request.files:
+        upload = request.files["file"]
+        suffix = os.path.splitext(upload.filename or "")[1] or ".jsonl"
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+            upload.save(f)
+        try:
+            analysis_ids = read_analysis_ids(f.name)
+        finally:
+            os.unlink(f.name)
+        options = request.form
+    else:
+        options = request.json or {}
+        analysis_ids = list(dict.fromkeys(str(i) for i in options.get("analysis_ids", []) if i))
+
+    if not analysis_ids:
+        return jsonify({"error": "analysis_ids are required"}), 400
+
+    run_id = options.get("run_id") or uuid.uuid4().hex
+    try:
+        run_output_path(run_id)
+        concurrency = resolve_concurrency(options.get("concurrency"))
+        mode = resolve_mode(options.get("mode"))
+        deadline_ms = resolve_deadline_ms(options.get("deadline_ms"))
+        priority = resolve_priority(options.get("priority"), "batch")
+        max_wait_ms = resolve_max_wait_ms(options.get("max_wait_ms"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    fresh = str(options.get("fresh", "")).lower() in ("1", "true", "yes")
+    # Without a tenant the run is its own (bulk:<run_id>), as on the CLI.
+    tenant = options.get("tenant")
+
+    def ndjson():
+        for record in iter_bulk_records(analysis_ids, run_id, concurrency, fresh, mode, deadline_ms, priority, tenant, max_wait_ms):
+            yield json.dumps(record) + "\n"
+
+    return Response(
+        stream_with_context(ndjson()),
+        mimetype="application/x-ndjson",
+        headers={"X-Bulk-Run-Id": run_id, "X-Accel-Buffering": "no"}
+    )
+
+
+@app.route("/stats", methods=['GET'])
+def stats():
+    return jsonify({
+        "rate_limiter": limiter.stats(),
+        "scheduler": scheduler.stats(),
+        "llm_cache": cache.stats(),
+        "extractor_cache": extractor_cache_stats(),
+        "readiness": readiness_watcher.stats(),
+        "jobs": job_manager.stats(),
+        "hedging": hedger.stats(),
+        "stage_store": stage_store.stats(),
+        "prompts": prompt_stats.stats(),
+        "parsing": parse_stats.stats(),
+        "json_mode": json_mode_stats(),
+        "singleflight": {
+            "pipeline": pipeline_flight.stats(),
+            "extraction": extraction_flight.stats(),
+            "llm": llm_flight.stats()
+        }
+    })
+
+
+@app.route("/debug/diagnostics", methods=['GET'])
+def debug_diagnostics():
+    # Memory and resource snapshot: tracemalloc top allocations (and growth
+    # since the previous call), live clients/loops/sessions, open sockets and
+    # GC stats. ?gc=1 runs a full collection first; ?top=N sizes the lists.
+    if not config.diagnostics_enabled:
+        return jsonify({"error": "diagnostics are disabled (set DIAGNOSTICS_ENABLED=true)"}), 404
+    try:
+        top = int(request.args.get("top", 20))
+    except ValueError:
+        return jsonify({"error": "top must be an integer"}), 400
+    collect = request.args.get("gc", "").lower() in ("1", "true", "yes")
+    return jsonify(diagnostics.snapshot(top=top, collect=collect, extra=runtime_diagnostics()))
+
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    # Prometheus text format: stage/LLM histograms and counters, plus the
+    # /stats snapshots as gauges.
+    body = registry.render(gauges={
+        "rate_limiter": limiter.stats(),
+        "scheduler": scheduler.stats(),
+        "llm_cache": cache.stats(),
+        "extractor_cache": extractor_cache_stats(),
+        "readiness": readiness_watcher.stats(),
+        "jobs": job_manager.stats(),
+        "hedging": hedger.stats(),
+        "stage_store": stage_store.stats(),
+        "parsing": parse_stats.stats(),
+        "singleflight_pipeline": pipeline_flight.stats(),
+        "singleflight_extraction": extraction_flight.stats(),
+        "singleflight_llm": llm_flight.stats()
+    })
+    return Response(body, mimetype="text/plain; version=0.0.4")
     
 if __name__ == '__main__':
     # app.run(debug=True)
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000)
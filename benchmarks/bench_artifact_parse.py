@@ -0,0 +1,131 @@
+"""Peak RSS and parse time: full json decode vs streaming field selection.
+
+    python -m benchmarks.bench_artifact_parse --sizes-mb 1 5 20
+
+Builds synthetic initial-analysis artifacts padded with bulky sections the
+extractor never reads, then parses each one in a fresh subprocess both the
+old way (read the whole body, json.loads it) and through
+json_stream.select_fields over 64 KiB chunks, checking that both produce
+the same json_output.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from inital_analysis_data_extractor import ARTIFACT_CHUNK_SIZE, ARTIFACT_FIELDS, extract_json_output
+from json_stream import select_fields
+
+
+def build_artifact(size_mb, seed=7):
+    rng = random.Random(seed)
+    words = ["pipeline", "analysis", "customer", "workflow", "automation", "invoice", "support", "forecast"]
+
+    def sentence(n):
+        return " ".join(rng.choice(words) for _ in range(n))
+
+    artifact = {
+        "company": {"name": "Synthetic Corp", "domain": "synthetic.example"},
+        "raw_pages": [],
+        "more_info": {"summary": sentence(80), "industry": "Manufacturing"},
+        "ai_opportunity_hypotheses": [{"hypothesis": sentence(12), "why": sentence(30)} for _ in range(8)],
+        "value_prop_angles": [{"angle": sentence(10)} for _ in range(5)],
+        "pain_points_and_goals": [{"item": sentence(8), "why": sentence(20)} for _ in range(6)],
+        "icps_to_contact": [{"role": "COO", "messaging_hook": sentence(15)} for _ in range(4)],
+        "signals": [],
+    }
+    target = size_mb * 1024 * 1024
+    page = {"url": "https://synthetic.example/page", "html": sentence(400), "links": [sentence(3) for _ in range(20)]}
+    page_size = len(json.dumps(page))
+    artifact["raw_pages"] = [dict(page, id=i) for i in range(target // 2 // page_size)]
+    artifact["signals"] = [{"id": i, "text": sentence(40), "score": rng.random()} for i in range(target // 2 // 350)]
+    return artifact
+
+
+def parse(path, mode):
+    if mode == "full":
+        with open(path, "rb") as f:
+            data = json.loads(f.read())
+    else:
+        def chunks():
+            with open(path, "rb") as f:
+                while True:
+                    chunk = f.read(ARTIFACT_CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+        data = select_fields(chunks(), ARTIFACT_FIELDS)
+    return extract_json_output(data)
+
+
+def peak_rss_kb():
+    # VmHWM starts fresh after exec; ru_maxrss can carry the parent's peak over.
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child(path, mode):
+    baseline_kb = peak_rss_kb()
+    start = time.perf_counter()
+    output = parse(path, mode)
+    elapsed = time.perf_counter() - start
+    peak_kb = peak_rss_kb()
+    print(json.dumps({
+        "parse_ms": round(elapsed * 1000, 1),
+        "peak_rss_mb": round(peak_kb / 1024, 1),
+        "rss_growth_mb": round((peak_kb - baseline_kb) / 1024, 1),
+        "output": output,
+    }))
+
+
+def run_child(path, mode):
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_artifact_parse", "--child", mode, path],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[1], args.child[0])
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size_mb in args.sizes_mb:
+            path = os.path.join(tmp, f"artifact_{size_mb}mb.json")
+            with open(path, "w") as f:
+                json.dump(build_artifact(size_mb), f)
+
+            full = run_child(path, "full")
+            stream = run_child(path, "stream")
+            if full.pop("output") != stream.pop("output"):
+                raise SystemExit(f"json_output mismatch for {size_mb} MB artifact")
+
+            results.append({
+                "artifact_mb": round(os.path.getsize(path) / 1024 / 1024, 1),
+                "full": full,
+                "stream": stream,
+            })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Before/after latency for the shared LLM client + event loop.
+
+    python -m benchmarks.bench_client_reuse --requests 20 --opportunities 6
+
+"before" rebuilds ChatOpenAI and runs asyncio.run once per stage, the way
+both LLM modules used to; "after" goes through llm_client.get_llm/run_async.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from langchain.schema import HumanMessage, SystemMessage
+
+from benchmarks.stub_openrouter import StubOpenRouter
+
+
+def messages(i):
+    return [SystemMessage(content="system"), HumanMessage(content=f"opportunity {i}")]
+
+
+async def stage(llm, opportunities):
+    await asyncio.gather(*[llm.ainvoke(messages(i)) for i in range(opportunities)])
+
+
+def before(opportunities):
+    from langchain_openai import ChatOpenAI
+
+    def fresh_llm():
+        return ChatOpenAI(
+            model=os.environ["OPENROUTER_MODEL"],
+            base_url=os.environ["OPENROUTER_BASE_URL"],
+            api_key=os.environ["OPENROUTER_API_KEY"],
+            temperature=0.4,
+        )
+
+    asyncio.run(stage(fresh_llm(), opportunities))
+    asyncio.run(stage(fresh_llm(), opportunities))
+
+
+def after(opportunities):
+    from llm_client import get_llm, run_async
+
+    run_async(stage(get_llm(), opportunities))
+    run_async(stage(get_llm(), opportunities))
+
+
+def measure(name, fn, stub, args):
+    connections = stub.connections
+    latencies = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        fn(args.opportunities)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "mode": name,
+        "requests": args.requests,
+        "mean_ms": round(statistics.mean(latencies), 1),
+        "p50_ms": round(statistics.median(latencies), 1),
+        "max_ms": round(max(latencies), 1),
+        "new_connections": stub.connections - connections,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--opportunities", type=int, default=6)
+    parser.add_argument("--latency-ms", type=float, nargs=2, default=(50, 150))
+    parser.add_argument("--connect-delay-ms", type=float, default=30)
+    args = parser.parse_args()
+
+    stub = StubOpenRouter(latency_ms=args.latency_ms, connect_delay_ms=args.connect_delay_ms).start()
+    os.environ["OPENROUTER_BASE_URL"] = stub.base_url
+    os.environ["OPENROUTER_API_KEY"] = "stub"
+    os.environ["OPENROUTER_MODEL"] = "stub-model"
+
+    try:
+        results = [measure("before", before, stub, args), measure("after", after, stub, args)]
+    finally:
+        stub.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
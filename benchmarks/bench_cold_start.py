@@ -0,0 +1,152 @@
+"""Cold-start cost of app.py: import time and time to the first served email.
+
+    python -m benchmarks.bench_cold_start --runs 5 --baseline-ref HEAD~1 --output cold.json
+
+For each tree measured (the working tree, plus --baseline-ref checked out
+into a temporary git worktree), reports:
+
+- import_s: `import app` in a fresh interpreter, median and max of --runs;
+- top_imports: the modules with the largest cumulative -X importtime cost;
+- ready_s / first_email_s: app.py started in a subprocess against the local
+  biz-api and OpenRouter stubs, time until it answers /stats and until its
+  first /generate-email returns, with first_request_s the latter's own
+  latency. With --warm-up the working tree is also run with WARM_UP=true.
+
+The "gain" section is the baseline minus the working tree for each number.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import requests
+
+from benchmarks.bench_load import ROOT, free_port, git_commit, start_app
+from benchmarks.stub_biz_api import StubBizApi
+from benchmarks.stub_openrouter import StubOpenRouter
+
+IMPORT_SNIPPET = "import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)"
+
+
+def measure_imports(tree, env, runs):
+    durations = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=tree, env=env, capture_output=True, text=True, check=True)
+        durations.append(float(result.stdout.strip().splitlines()[-1]))
+    return {"median": round(statistics.median(durations), 3), "max": round(max(durations), 3)}
+
+
+def top_imports(tree, env, count):
+    # -X importtime lines: "import time: self [us] | cumulative | module".
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=tree, env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        module = parts[2].strip()
+        # Only top-level packages, so the list is not one package's submodules.
+        if "." not in module:
+            rows.append((int(parts[1]) / 1e6, module))
+    rows.sort(reverse=True)
+    return [{"module": module, "cumulative_s": round(seconds, 3)} for seconds, module in rows[:count]]
+
+
+def measure_first_email(tree, env, run_tag):
+    start = time.perf_counter()
+    process, base_url = start_app(env, free_port(), cwd=tree)
+    ready = time.perf_counter() - start
+    try:
+        request_start = time.perf_counter()
+        response = requests.post(f"{base_url}/generate-email", json={"analysis_id": f"cold-{run_tag}"}, timeout=120)
+        response.raise_for_status()
+        done = time.perf_counter()
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    return {
+        "ready_s": round(ready, 3),
+        "first_email_s": round(done - start, 3),
+        "first_request_s": round(done - request_start, 3),
+    }
+
+
+def measure_tree(tree, env, args, warm_up=False):
+    env = dict(env, WARM_UP="true" if warm_up else "false")
+    starts = [measure_first_email(tree, env, uuid.uuid4().hex[:8]) for _ in range(args.runs)]
+    return {
+        "import_s": measure_imports(tree, env, args.runs),
+        "top_imports": top_imports(tree, env, args.top),
+        # Medians over --runs cold starts.
+        **{key: round(statistics.median(run[key] for run in starts), 3) for key in starts[0]},
+    }
+
+
+def gain(baseline, current):
+    return {
+        "import_s": round(baseline["import_s"]["median"] - current["import_s"]["median"], 3),
+        **{key: round(baseline[key] - current[key], 3) for key in ("ready_s", "first_email_s", "first_request_s")},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per measurement")
+    parser.add_argument("--top", type=int, default=8, help="heaviest top-level imports to list")
+    parser.add_argument("--baseline-ref", help="git ref to compare against (checked out into a temporary worktree)")
+    parser.add_argument("--warm-up", action="store_true", help="also measure the working tree with WARM_UP=true")
+    parser.add_argument("--llm-latency", default="fixed:200")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    biz_api = StubBizApi(latency_ms="fixed:5", artifact_latency_ms="fixed:20", padding_kb=16).start()
+    openrouter = StubOpenRouter(latency_ms=args.llm_latency).start()
+    scratch = tempfile.mkdtemp(prefix="bench-cold-")
+    env = dict(os.environ)
+    env.update({
+        "API_BASE_URL": biz_api.base_url,
+        "API_BEARER_TOKEN": "bench",
+        "OPENROUTER_BASE_URL": openrouter.base_url,
+        "OPENROUTER_API_KEY": "bench",
+        "OPENROUTER_MODEL": "bench-model",
+        "LLM_CACHE_ENABLED": "false",
+        "LLM_CACHE_PATH": os.path.join(scratch, "llm_cache.sqlite3"),
+        "STAGE_STORE_PATH": os.path.join(scratch, "stage_results.sqlite3"),
+        "LOG_LEVEL": "WARNING",
+    })
+
+    report = {"commit": git_commit(), "timestamp": round(time.time()), "config": vars(args)}
+    worktree = None
+    try:
+        report["current"] = measure_tree(ROOT, env, args)
+        if args.warm_up:
+            report["current_warm_up"] = measure_tree(ROOT, env, args, warm_up=True)
+        if args.baseline_ref:
+            worktree = os.path.join(scratch, "baseline")
+            subprocess.run(["git", "worktree", "add", "--detach", worktree, args.baseline_ref],
+                           cwd=ROOT, capture_output=True, check=True)
+            report["baseline"] = measure_tree(worktree, env, args)
+            report["baseline"]["ref"] = args.baseline_ref
+            report["gain"] = gain(report["baseline"], report["current"])
+    finally:
+        if worktree:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=ROOT, capture_output=True)
+        biz_api.stop()
+        openrouter.stop()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Opportunity dedup against labelled pairs: reworded duplicates vs distinct ideas.
+
+    python -m benchmarks.bench_dedup --threshold 0.5
+
+Scores each labelled pair of hypotheses with dedup.similarity, inside an
+analysis made of the pair plus the stub's other workflows (IDF is per
+analysis, so a pair scored on its own would read differently). Duplicates
+are one idea worded two ways, e.g. "Automated invoice processing" and
+"AI-powered invoice data extraction"; distinct pairs include near-identical
+templates ("accounts payable" / "accounts receivable", "workflow 1" /
+"workflow 2"), related but different ideas and every pair of stub workflows.
+
+Prints each score, the gap between the lowest duplicate and the highest
+distinct pair, and exits with status 1 unless the threshold sits in it.
+DEDUP_THRESHOLD's default is the middle of that gap.
+"""
+import argparse
+import itertools
+import json
+
+from benchmarks.stub_biz_api import WORKFLOWS
+from dedup import DEDUP_THRESHOLD, collapse_duplicates, opportunity_vectors, similarity
+
+DUPLICATES = [
+    (("Automated invoice processing", "Finance staff key supplier invoices into the ERP by hand"),
+     ("AI-powered invoice data extraction", "The AP team manually types invoice details into the accounting system")),
+    (("Chatbot for customer support", "Agents answer the same order-status questions all day"),
+     ("Conversational AI assistant for customer service enquiries", "Support staff spend hours on repetitive order status queries")),
+    (("Predictive maintenance for forklift fleets", "Breakdowns are found only when a truck stops"),
+     ("Forklift failure prediction from sensor data", "Trucks break down without warning")),
+    (("Automated customs document checks", "Brokers rekey data between declaration forms"),
+     ("AI validation of customs declarations", "Brokers manually re-enter declaration data")),
+    (("Demand forecasting for warehouse staffing", "Shift managers guess labour needs from last year's rota"),
+     ("AI workforce planning based on predicted warehouse demand", "Managers set shift sizes by gut feel")),
+    (("Lead scoring with machine learning", "Sales reps work leads in the order they arrive"),
+     ("Predictive prioritisation of sales leads", "Reps waste time on prospects that never convert")),
+    (("Automated expense report auditing", "Finance checks every receipt by hand"),
+     ("AI review of employee expense claims", "Controllers manually verify receipts against policy")),
+]
+
+DISTINCT = [
+    (("Automate invoice processing for accounts payable", "Supplier invoices are keyed in by hand"),
+     ("Automate invoice processing for accounts receivable", "Customer invoices are chased by hand")),
+    (("Automate data entry for workflow 1", "Staff rekey orders"),
+     ("Automate data entry for workflow 2", "Staff rekey orders")),
+    (("Automated invoice processing", "Finance staff key supplier invoices into the ERP by hand"),
+     ("Invoice matching for carrier bills", "Accounts payable reconciles freight bills by hand")),
+    (("Chatbot for customer support", "Agents answer the same order-status questions all day"),
+     ("Customer email triage for the support desk", "Agents sort hundreds of tracking queries a day")),
+    (("Lead scoring with machine learning", "Sales reps work leads in the order they arrive"),
+     ("Sales email personalisation", "Reps write every outreach email from scratch")),
+    (("Automated expense report auditing", "Finance checks every receipt by hand"),
+     ("Automated invoice processing", "Finance staff key supplier invoices into the ERP by hand")),
+    (("Predictive maintenance for forklift fleets", "Breakdowns are found only when a truck stops"),
+     ("Demand forecasting for warehouse staffing", "Shift managers guess labour needs from last year's rota")),
+] + list(itertools.combinations(WORKFLOWS, 2))
+
+
+def opportunity(pair):
+    solution, why = pair
+    return {"solution": solution, "why": why}
+
+
+def score(a, b):
+    # The pair's similarity inside an analysis padded with the stub's other
+    # workflows.
+    context = [opportunity(workflow) for workflow in WORKFLOWS if workflow not in (a, b)]
+    opportunities = [opportunity(a), opportunity(b)] + context
+    vectors = opportunity_vectors(opportunities)
+    return similarity(opportunities[0], opportunities[1], vectors[0], vectors[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threshold", type=float, default=DEDUP_THRESHOLD, help="default: DEDUP_THRESHOLD")
+    args = parser.parse_args()
+
+    duplicates = [(round(score(a, b), 3), a[0], b[0]) for a, b in DUPLICATES]
+    distinct = sorted(((round(score(a, b), 3), a[0], b[0]) for a, b in DISTINCT), reverse=True)
+    lowest_duplicate = min(value for value, _, _ in duplicates)
+    highest_distinct = distinct[0][0]
+    failures = []
+    if not highest_distinct < args.threshold <= lowest_duplicate:
+        failures.append(f"threshold {args.threshold} is outside ({highest_distinct}, {lowest_duplicate}]")
+
+    # The same check through the collapse itself, for the reviewer's pair.
+    representatives, collapsed = collapse_duplicates([opportunity(a) for a in DUPLICATES[0]], args.threshold)
+    if len(representatives) != 1:
+        failures.append("the reworded invoice pair was not collapsed")
+
+    print(json.dumps({
+        "threshold": args.threshold,
+        "lowest_duplicate": lowest_duplicate,
+        "highest_distinct": highest_distinct,
+        "suggested_threshold": round((lowest_duplicate + highest_distinct) / 2, 2),
+        "duplicates": duplicates,
+        "closest_distinct": distinct[:8],
+        "passed": not failures,
+        "failures": failures,
+    }, indent=2))
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
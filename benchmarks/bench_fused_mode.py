@@ -0,0 +1,93 @@
+"""Two-stage vs fused generation against the local stub LLM.
+
+    python -m benchmarks.bench_fused_mode --companies 10 --opportunities 6
+
+Runs the per-opportunity work of the pipeline for synthetic companies in
+both modes and reports wall-clock latency per company, LLM round trips and
+prompt/completion tokens (chars/4, as counted by the stub). The response
+cache is disabled so every call reaches the stub.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from benchmarks.stub_openrouter import StubOpenRouter
+
+
+def company(i, opportunities):
+    return {
+        "company": f"Benchmark Co {i}",
+        "ai_opportunities": [
+            {"solution": f"Automate workflow {j} for company {i}", "why": f"Team {j} spends hours on manual steps"}
+            for j in range(opportunities)
+        ],
+    }
+
+
+async def run_company(data, mode):
+    from langchain_email_generator import generate_for_gap, generate_fused
+    from langchain_gap_analyser import process_opportunity
+    from llm_client import get_llm
+
+    llm = get_llm()
+    name = data["company"]
+
+    async def one(opp):
+        if mode == "fused":
+            return await generate_fused(llm, name, opp)
+        gap_item = await process_opportunity(llm, name, opp)
+        return gap_item, await generate_for_gap(llm, name, gap_item)
+
+    return await asyncio.gather(*[one(opp) for opp in data["ai_opportunities"]])
+
+
+def measure(mode, stub, args):
+    from llm_client import run_async
+
+    before = (stub.requests, stub.prompt_tokens, stub.completion_tokens)
+    latencies = []
+    for i in range(args.companies):
+        data = company(f"{mode}-{i}", args.opportunities)
+        start = time.perf_counter()
+        run_async(run_company(data, mode))
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    requests = stub.requests - before[0]
+    return {
+        "mode": mode,
+        "companies": args.companies,
+        "opportunities_per_company": args.opportunities,
+        "mean_ms": round(statistics.mean(latencies), 1),
+        "p50_ms": round(statistics.median(latencies), 1),
+        "llm_calls": requests,
+        "prompt_tokens": stub.prompt_tokens - before[1],
+        "completion_tokens": stub.completion_tokens - before[2],
+        "prompt_tokens_per_opportunity": round((stub.prompt_tokens - before[1]) / (args.companies * args.opportunities)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--companies", type=int, default=10)
+    parser.add_argument("--opportunities", type=int, default=6)
+    parser.add_argument("--latency-ms", type=float, nargs=2, default=(300, 900))
+    args = parser.parse_args()
+
+    stub = StubOpenRouter(latency_ms=args.latency_ms).start()
+    os.environ["OPENROUTER_BASE_URL"] = stub.base_url
+    os.environ["OPENROUTER_API_KEY"] = "stub"
+    os.environ["OPENROUTER_MODEL"] = "stub-model"
+    os.environ["LLM_CACHE_ENABLED"] = "false"
+
+    try:
+        results = [measure("two_stage", stub, args), measure("fused", stub, args)]
+    finally:
+        stub.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""Offline load test of app.py against local stand-ins for the biz-api and OpenRouter.
+
+    python -m benchmarks.bench_load --concurrency 1 4 16 --requests 40 \\
+        --llm-latency lognormal:400:0.6 --llm-429-rate 0.02 --llm-malformed-rate 0.05 \\
+        --output bench.json --baseline previous.json
+
+Starts both stubs in this process and app.py in a subprocess pointed at them
+(API_BASE_URL / OPENROUTER_BASE_URL, LLM cache off), then POSTs
+/generate-email at each concurrency level with analysis IDs never seen
+before, so every request pays for extraction and all LLM calls. Each level
+reports throughput, p50/p95/p99 latency, the LLM fallback rate (from
+/metrics) and the app's peak RSS, and the run is written as JSON tagged with
+the git commit. With --baseline, each level also gets its change against the
+same level of an earlier run.
+
+Latency specs are fixed:MS, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.stub_biz_api import StubBizApi
+from benchmarks.stub_openrouter import StubOpenRouter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METRIC_LINE = re.compile(r"^([a-z_]+)(\{[^}]*\})? (\S+)$")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return round(ordered[index], 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_memory(pid):
+    # Current and peak resident set size of the app process, in MB.
+    memory = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                key, value = line.split(":")
+                memory[key] = int(value.split()[0]) / 1024
+    return memory
+
+
+def reset_peak_memory(pid):
+    # Writing 5 to clear_refs resets VmHWM, so each level reports its own peak.
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def scrape_metrics(base_url):
+    # {(name, labels): value} for the counters we diff between levels.
+    samples = {}
+    for line in requests.get(f"{base_url}/metrics", timeout=10).text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match and match.group(1) in ("llm_parse_events_total", "llm_requests_total", "generations_total"):
+            samples[(match.group(1), match.group(2) or "")] = float(match.group(3))
+    return samples
+
+
+def metric_delta(before, after, name, label_filter=""):
+    return sum(
+        value - before.get(key, 0.0)
+        for key, value in after.items()
+        if key[0] == name and label_filter in key[1]
+    )
+
+
+def start_app(env, port, cwd=ROOT, log_file=None):
+    # Without log_file the app's stderr is a pipe nobody reads after startup,
+    # which is fine for short runs; long ones must pass a file, or the app
+    # blocks once the pipe buffer fills with log lines.
+    command = [sys.executable, "-c", f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    process = subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL,
+                               stderr=log_file or subprocess.PIPE, text=True)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            output = process.stderr.read() if log_file is None else f"(see {log_file.name})"
+            raise RuntimeError(f"app.py exited during startup:\n{output}")
+        try:
+            requests.get(f"{base_url}/stats", timeout=1)
+            return process, base_url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("app.py did not start within 60 s")
+
+
+def generate(session, base_url, analysis_id, args):
+    body = {"analysis_id": analysis_id}
+    if args.mode:
+        body["mode"] = args.mode
+    if args.deadline_ms:
+        body["deadline_ms"] = args.deadline_ms
+
+    start = time.perf_counter()
+    try:
+        response = session.post(f"{base_url}/generate-email", json=body, timeout=args.timeout)
+        status = response.status_code
+        partial = status == 200 and response.json().get("deadline_exceeded", False)
+    except requests.RequestException:
+        status, partial = None, False
+    return (time.perf_counter() - start) * 1000, status, partial
+
+
+def run_level(base_url, pid, concurrency, run_tag, args):
+    before = scrape_metrics(base_url)
+    peak_reset = reset_peak_memory(pid)
+    ids = [f"bench-{run_tag}-c{concurrency}-{i}" for i in range(args.requests)]
+
+    with requests.Session() as session:
+        session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda analysis_id: generate(session, base_url, analysis_id, args), ids))
+        elapsed = time.perf_counter() - start
+
+    after = scrape_metrics(base_url)
+    memory = read_memory(pid)
+    latencies = [latency for latency, status, _ in results if status == 200]
+    parsed = metric_delta(before, after, "llm_parse_events_total")
+    fallbacks = metric_delta(before, after, "llm_parse_events_total", 'outcome="fallback"') \
+        + metric_delta(before, after, "llm_parse_events_total", 'outcome="missing"')
+
+    return {
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "ok": len(latencies),
+        "partial": sum(1 for _, _, partial in results if partial),
+        "errors": sum(1 for _, status, _ in results if status != 200),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": round(max(latencies), 1) if latencies else None,
+        "llm_calls": int(metric_delta(before, after, "llm_requests_total", 'source="provider"')),
+        "fallback_rate": round(fallbacks / parsed, 4) if parsed else 0.0,
+        # Without a clear_refs reset this is the peak since app start.
+        "peak_rss_mb": round(memory.get("VmHWM", 0.0), 1),
+        "peak_rss_is_per_level": peak_reset,
+        "rss_mb": round(memory.get("VmRSS", 0.0), 1),
+    }
+
+
+def compare(levels, baseline_path):
+    # Relative change of the headline numbers against the same concurrency
+    # level of an earlier report (+0.10 = 10% higher).
+    with open(baseline_path) as f:
+        baseline = {level["concurrency"]: level for level in json.load(f)["levels"]}
+    for level in levels:
+        previous = baseline.get(level["concurrency"])
+        if previous is None:
+            continue
+        level["vs_baseline"] = {
+            key: round((level[key] - previous[key]) / previous[key], 4)
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "fallback_rate", "peak_rss_mb")
+            if level.get(key) is not None and previous.get(key)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="concurrent clients per level")
+    parser.add_argument("--requests", type=int, default=40, help="requests per level")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured requests before the first level")
+    parser.add_argument("--mode", help="generation mode sent with each request (default: server's)")
+    parser.add_argument("--deadline-ms", type=int, help="deadline_ms sent with each request")
+    parser.add_argument("--timeout", type=float, default=300, help="client-side timeout per request, seconds")
+    parser.add_argument("--opportunities", type=int, default=6, help="opportunities per synthetic artifact")
+    parser.add_argument("--padding-kb", type=int, default=256, help="ignored filler per artifact, in KB")
+    parser.add_argument("--llm-latency", default="lognormal:400:0.5")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of LLM calls answered with 500")
+    parser.add_argument("--llm-429-rate", type=float, default=0.0, help="share of LLM calls answered with 429")
+    parser.add_argument("--llm-malformed-rate", type=float, default=0.0, help="share of LLM replies that are not valid JSON")
+    parser.add_argument("--api-latency", default="uniform:5:20", help="biz-api status check latency")
+    parser.add_argument("--artifact-latency", default="uniform:20:60", help="artifact download latency")
+    parser.add_argument("--api-error-rate", type=float, default=0.0, help="share of status checks answered with 500")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    parser.add_argument("--baseline", help="earlier report to compare each level against")
+    args = parser.parse_args()
+
+    biz_api = StubBizApi(
+        latency_ms=args.api_latency, artifact_latency_ms=args.artifact_latency, error_rate=args.api_error_rate,
+        opportunities=args.opportunities, padding_kb=args.padding_kb,
+    ).start()
+    openrouter = StubOpenRouter(
+        latency_ms=args.llm_latency, error_rate=args.llm_error_rate,
+        rate_limit_rate=args.llm_429_rate, malformed_rate=args.llm_malformed_rate,
+    ).start()
+
+    # The app's SQLite files (and their WAL side files) go to a scratch
+    # directory, not the working tree it runs in.
+    scratch = tempfile.mkdtemp(prefix="bench-load-")
+    env = dict(os.environ)
+    env.update({
+        "API_BASE_URL": biz_api.base_url,
+        "API_BEARER_TOKEN": "bench",
+        "OPENROUTER_BASE_URL": openrouter.base_url,
+        "OPENROUTER_API_KEY": "bench",
+        "OPENROUTER_MODEL": "bench-model",
+        "LLM_CACHE_ENABLED": "false",
+        "LLM_CACHE_PATH": os.path.join(scratch, "llm_cache.sqlite3"),
+        "STAGE_STORE_PATH": os.path.join(scratch, "stage_results.sqlite3"),
+    })
+    # Every opportunity should cost its LLM calls, whatever the dedup settings.
+    env.setdefault("DEDUP_ENABLED", "false")
+    # The stub has no provider quota; keep the limiter from being the bottleneck
+    # unless the caller set limits explicitly.
+    env.setdefault("LLM_REQUESTS_PER_MINUTE", "1000000")
+    env.setdefault("LLM_TOKENS_PER_MINUTE", "1000000000")
+    env.setdefault("LOG_LEVEL", "WARNING")
+
+    process, base_url = start_app(env, free_port())
+    run_tag = uuid.uuid4().hex[:8]
+    try:
+        with requests.Session() as session:
+            for i in range(args.warmup):
+                generate(session, base_url, f"bench-{run_tag}-warmup-{i}", args)
+        levels = [run_level(base_url, process.pid, concurrency, run_tag, args) for concurrency in args.concurrency]
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        biz_api.stop()
+        openrouter.stop()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if args.baseline:
+        compare(levels, args.baseline)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": round(time.time()),
+        "config": vars(args),
+        "levels": levels,
+        "stubs": {"biz_api": biz_api.stats(), "openrouter": openrouter.stats()},
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Soak test: thousands of generations against the local stubs, failing on memory growth.
+
+    python -m benchmarks.bench_soak --requests 12000 --concurrency 8 \\
+        --max-kb-per-request 2 --output soak.json
+
+Starts both stubs in this process and app.py in a subprocess (with
+DIAGNOSTICS_ENABLED=true) and POSTs /generate-email with never-seen analysis
+IDs. The app's RSS is sampled every --sample-every requests. After the first
+--warmup requests (caches filling, lazy imports, allocator arenas growing and
+the first diagnostics snapshot), a least-squares line is fitted through the
+samples; its slope is the memory retained per request. The run exits with status 1 if the slope exceeds
+--max-kb-per-request or if requests failed.
+
+The app runs as in production: it caps glibc's malloc arenas itself at
+startup (MALLOC_ARENA_MAX, see diagnostics.py; the snapshots report the cap
+in effect) and tracemalloc is off. Tracing every allocation makes the app
+several times slower and adds its own memory per live block, so the bounded
+caches would still be filling when a traced run ends. When the test fails,
+rerun it with --tracemalloc-frames 1 to get the allocation sites.
+
+The report also carries /debug/diagnostics snapshots taken halfway through
+the warm-up and at the end. The second one lists the allocation sites that grew in
+between ("top_growth"), with the client, loop and socket counts, which is
+where to start when the test fails.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.bench_load import free_port, git_commit, read_memory, start_app
+from benchmarks.stub_biz_api import StubBizApi
+from benchmarks.stub_openrouter import StubOpenRouter
+
+
+def slope(points):
+    # Least-squares slope of (x, y) points.
+    n = len(points)
+    if n < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if not variance:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+def diagnostics(base_url, top):
+    response = requests.get(f"{base_url}/debug/diagnostics", params={"gc": 1, "top": top}, timeout=60)
+    response.raise_for_status()
+    snapshot = response.json()
+    # Keep the report readable: the bits that point at a leak.
+    return {
+        "process": snapshot["process"],
+        "objects": {key: value for key, value in snapshot["objects"].items() if key != "top_types"},
+        "top_types": snapshot["objects"]["top_types"],
+        "uncollectable": snapshot["gc"]["uncollectable"],
+        "tracemalloc": snapshot["tracemalloc"],
+        "llm": snapshot.get("llm"),
+        "extractor_pools": snapshot.get("extractor_pools"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=12000, help="generations to run in total")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    # The in-process caches (ready statuses, scheduler tenants) hold up to
+    # 1024 entries and fill with never-seen analysis IDs until then; RSS
+    # levels off a few thousand requests later.
+    parser.add_argument("--warmup", type=int, default=3000, help="requests before memory growth is measured")
+    parser.add_argument("--sample-every", type=int, default=250, help="requests between RSS samples")
+    parser.add_argument("--max-kb-per-request", type=float, default=2.0, help="fail above this RSS growth per request")
+    parser.add_argument("--mode", help="generation mode sent with each request (default: server's)")
+    parser.add_argument("--opportunities", type=int, default=6, help="opportunities per synthetic artifact")
+    parser.add_argument("--padding-kb", type=int, default=64, help="ignored filler per artifact, in KB")
+    parser.add_argument("--llm-latency", default="uniform:5:20")
+    parser.add_argument("--llm-malformed-rate", type=float, default=0.02, help="share of LLM replies that are not valid JSON")
+    parser.add_argument("--tracemalloc-frames", type=int, default=0, help="DIAGNOSTICS_TRACEMALLOC_FRAMES for the app (default 0: off)")
+    parser.add_argument("--top", type=int, default=15, help="entries per list in the diagnostics snapshots")
+    parser.add_argument("--timeout", type=float, default=120, help="client-side timeout per request, seconds")
+    parser.add_argument("--app-log", help="keep the app's log here (default: a temporary file, removed afterwards)")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    biz_api = StubBizApi(latency_ms="fixed:2", artifact_latency_ms="fixed:5",
+                         opportunities=args.opportunities, padding_kb=args.padding_kb).start()
+    openrouter = StubOpenRouter(latency_ms=args.llm_latency, malformed_rate=args.llm_malformed_rate).start()
+    scratch = tempfile.mkdtemp(prefix="bench-soak-")
+    env = dict(os.environ)
+    env.update({
+        "API_BASE_URL": biz_api.base_url,
+        "API_BEARER_TOKEN": "bench",
+        "OPENROUTER_BASE_URL": openrouter.base_url,
+        "OPENROUTER_API_KEY": "bench",
+        "OPENROUTER_MODEL": "bench-model",
+        "LLM_CACHE_ENABLED": "false",
+        "LLM_CACHE_PATH": os.path.join(scratch, "llm_cache.sqlite3"),
+        "STAGE_STORE_PATH": os.path.join(scratch, "stage_results.sqlite3"),
+        "DIAGNOSTICS_ENABLED": "true",
+        "DIAGNOSTICS_TRACEMALLOC_FRAMES": str(args.tracemalloc_frames),
+    })
+    # Every opportunity should cost its LLM calls, whatever the dedup settings.
+    env.setdefault("DEDUP_ENABLED", "false")
+    env.setdefault("LLM_REQUESTS_PER_MINUTE", "1000000")
+    env.setdefault("LLM_TOKENS_PER_MINUTE", "1000000000")
+    env.setdefault("LOG_LEVEL", "WARNING")
+
+    run_tag = uuid.uuid4().hex[:8]
+    body = {"mode": args.mode} if args.mode else {}
+    samples = []
+    errors = 0
+    report = {"commit": git_commit(), "timestamp": round(time.time()), "config": vars(args)}
+
+    app_log = open(args.app_log or os.path.join(scratch, "app.log"), "w")
+    process, base_url = start_app(env, free_port(), log_file=app_log)
+    try:
+        with requests.Session() as session:
+            session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+
+            def generate(index):
+                try:
+                    response = session.post(f"{base_url}/generate-email", json={**body, "analysis_id": f"soak-{run_tag}-{index}"},
+                                            timeout=args.timeout)
+                    return response.status_code == 200
+                except requests.RequestException:
+                    return False
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                for done in range(0, args.requests, args.sample_every):
+                    batch = range(done, min(done + args.sample_every, args.requests))
+                    errors += sum(1 for ok in pool.map(generate, batch) if not ok)
+                    completed = batch.stop
+                    if done < args.warmup // 2 <= completed:
+                        # Halfway through the warm-up: with tracemalloc on,
+                        # the snapshot briefly needs memory for every live
+                        # allocation, and the allocator takes a few hundred
+                        # requests to settle after that spike. Neither may
+                        # count as growth.
+                        report["diagnostics_after_warmup"] = diagnostics(base_url, args.top)
+                    rss = read_memory(process.pid).get("VmRSS", 0.0)
+                    samples.append({"requests": completed, "rss_mb": round(rss, 2), "elapsed_s": round(time.perf_counter() - start, 1)})
+                    print(f"{completed}/{args.requests} requests, rss {rss:.1f} MB, {errors} errors", file=sys.stderr)
+        report["diagnostics_end"] = diagnostics(base_url, args.top)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        app_log.close()
+        biz_api.stop()
+        openrouter.stop()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    measured = [(sample["requests"], sample["rss_mb"] * 1024) for sample in samples if sample["requests"] >= args.warmup]
+    kb_per_request = slope(measured)
+    failures = []
+    if len(measured) < 2:
+        failures.append("not enough samples after the warm-up; raise --requests or lower --warmup/--sample-every")
+    if kb_per_request > args.max_kb_per_request:
+        failures.append(f"RSS grows {kb_per_request:.2f} KB per request (limit {args.max_kb_per_request} KB)")
+    if errors:
+        failures.append(f"{errors} of {args.requests} requests failed")
+
+    report.update({
+        "requests": args.requests,
+        "errors": errors,
+        "throughput_rps": round(args.requests / samples[-1]["elapsed_s"], 2) if samples and samples[-1]["elapsed_s"] else None,
+        "rss_start_mb": samples[0]["rss_mb"] if samples else None,
+        "rss_end_mb": samples[-1]["rss_mb"] if samples else None,
+        "kb_per_request": round(kb_per_request, 3),
+        "samples": samples,
+        "passed": not failures,
+        "failures": failures,
+        "stubs": {"biz_api": biz_api.stats(), "openrouter": openrouter.stats()},
+    })
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    sys.exit(0 if not failures else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from benchmarks.stub_openrouter import latency_sampler
+
+# Local stand-in for the biz-api endpoints main_extractor calls:
+#
+#   GET {base_url}/{analysis_id}/files/initial_analysis   status + presigned_url
+#   GET /artifacts/{analysis_id}.json                     the analysis artifact
+#
+# Artifacts are synthetic but shaped like the real ones, padded with fields
+# the extractor skips so parsing cost is realistic. They are stable per
+# analysis_id and served with an ETag, so conditional GETs get 304s. With
+# ready_after_s, each analysis reports "running" for that long after its first
+# status check, like one whose initial analysis was only just started.
+
+
+# Distinct hypotheses, so opportunity dedup leaves all of them to the LLM.
+WORKFLOWS = [
+    ("Route optimisation for regional deliveries", "Dispatchers plan routes in spreadsheets every morning"),
+    ("Invoice matching for carrier bills", "Accounts payable reconciles freight bills by hand"),
+    ("Demand forecasting for warehouse staffing", "Shift managers guess labour needs from last year's rota"),
+    ("Customer email triage for the support desk", "Agents sort hundreds of tracking queries a day"),
+    ("Damage detection from dock camera photos", "Inspectors review every pallet photo manually"),
+    ("Contract clause extraction for shipper agreements", "Legal reads each renewal end to end"),
+    ("Predictive maintenance for forklift fleets", "Breakdowns are found only when a truck stops"),
+    ("Automated customs document checks", "Brokers rekey data between declaration forms"),
+]
+
+
+def make_artifact(analysis_id, opportunities=6, padding_kb=256):
+    return {
+        "company": {"name": f"Benchmark Co {analysis_id}", "domain": f"{analysis_id}.example.com"},
+        "more_info": {
+            "industry": "Logistics",
+            "summary": f"Benchmark Co {analysis_id} runs regional freight and warehousing.",
+        },
+        "ai_opportunity_hypotheses": [
+            {"hypothesis": f"{WORKFLOWS[i % len(WORKFLOWS)][0]} at {analysis_id}" + (f" (site {i})" if i >= len(WORKFLOWS) else ""),
+             "why": WORKFLOWS[i % len(WORKFLOWS)][1]}
+            for i in range(opportunities)
+        ],
+        "value_prop_angles": [{"angle": "Faster turnaround"}, {"angle": "Fewer handoff errors"}],
+        "pain_points_and_goals": [{"item": "Manual scheduling", "why": "Cut planning time"}],
+        "icps_to_contact": [{"messaging_hook": "Your planners deserve better tools"}],
+        "raw_sources": [{"url": f"https://example.com/{i}", "text": "x" * 1000} for i in range(padding_kb)],
+    }
+
+
+class StubBizApi:
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=(5, 20), artifact_latency_ms=(20, 60),
+                 error_rate=0.0, opportunities=6, padding_kb=256, ready_after_s=0.0):
+        self._status_latency = latency_sampler(latency_ms)
+        self._artifact_latency = latency_sampler(artifact_latency_ms)
+        # Share of status checks answered with a 500.
+        self.error_rate = error_rate
+        self.opportunities = opportunities
+        self.padding_kb = padding_kb
+        self.ready_after_s = ready_after_s
+        self._first_seen = {}
+        self.status_requests = 0
+        self.artifact_requests = 0
+        self.not_modified = 0
+        self.errors = 0
+        self._artifacts = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def root_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self):
+        # Value for API_BASE_URL.
+        return f"{self.root_url}/api/v1/analyze"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "status_requests": self.status_requests,
+                "artifact_requests": self.artifact_requests,
+                "not_modified": self.not_modified,
+                "errors": self.errors,
+            }
+
+    def artifact(self, analysis_id):
+        with self._lock:
+            cached = self._artifacts.get(analysis_id)
+        if cached is None:
+            payload = json.dumps(make_artifact(analysis_id, self.opportunities, self.padding_kb)).encode()
+            cached = (payload, '"' + hashlib.sha1(payload).hexdigest()[:16] + '"')
+            with self._lock:
+                self._artifacts[analysis_id] = cached
+        return cached
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                status_match = re.fullmatch(r"/api/v1/analyze/([^/]+)/files/initial_analysis", self.path)
+                artifact_match = re.fullmatch(r"/artifacts/([^/]+)\.json", self.path)
+                if status_match:
+                    self.status(status_match.group(1))
+                elif artifact_match:
+                    self.artifact(artifact_match.group(1))
+                else:
+                    self.send_json(404, {"detail": "Not found"})
+
+            def status(self, analysis_id):
+                with stub._lock:
+                    stub.status_requests += 1
+                time.sleep(stub._status_latency() / 1000)
+                if random.random() < stub.error_rate:
+                    with stub._lock:
+                        stub.errors += 1
+                    self.send_json(500, {"detail": "Internal error"})
+                    return
+                with stub._lock:
+                    first_seen = stub._first_seen.setdefault(analysis_id, time.monotonic())
+                if time.monotonic() - first_seen < stub.ready_after_s:
+                    self.send_json(200, {"analysis_id": analysis_id, "status": "running", "overall_status": "initial_running"})
+                    return
+                _, etag = stub.artifact(analysis_id)
+                self.send_json(200, {
+                    "analysis_id": analysis_id,
+                    "status": "completed",
+                    "overall_status": "initial_complete",
+                    "etag": etag,
+                    "presigned_url": f"{stub.root_url}/artifacts/{analysis_id}.json",
+                })
+
+            def artifact(self, analysis_id):
+                with stub._lock:
+                    stub.artifact_requests += 1
+                time.sleep(stub._artifact_latency() / 1000)
+                payload, etag = stub.artifact(analysis_id)
+                if self.headers.get("If-None-Match") == etag:
+                    with stub._lock:
+                        stub.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def send_json(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
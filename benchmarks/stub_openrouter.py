@@ -0,0 +1,204 @@
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Minimal OpenAI-compatible chat endpoint for local benchmarks. Every reply is
+# a JSON object carrying the keys both pipeline stages expect, so gap analysis
+# and email generation parse it without hitting their fallback paths - unless
+# a malformed_rate is set, which makes that share of replies invalid JSON.
+# fenced_rate wraps that share of replies in a markdown fence with a line of
+# chatter around it, as chat models often do - except for requests sent with
+# response_format, which always get bare JSON.
+
+REPLY = {
+    "ai solution": "Stub solution",
+    "gap_analysis": "Manual processes slow the team down.",
+    "pain_points": ["Slow turnaround", "Error-prone handoffs"],
+    "subject_line": "A faster path for your team",
+    "email_body": "Hi there,\nshort stub email body."
+}
+
+
+def latency_sampler(spec):
+    # Returns a function giving one latency in ms. `spec` is a (low, high)
+    # pair for a uniform distribution, or a string:
+    #   "fixed:300"            always 300 ms
+    #   "uniform:200:900"      uniform between 200 and 900 ms
+    #   "lognormal:400:0.6"    log-normal with median 400 ms and sigma 0.6,
+    #                          i.e. mostly fast with a long slow tail
+    if callable(spec):
+        return spec
+    if not isinstance(spec, str):
+        low, high = spec
+        return lambda: random.uniform(low, high)
+
+    kind, *args = spec.split(":")
+    args = [float(arg) for arg in args]
+    if kind == "fixed" and len(args) == 1:
+        return lambda: args[0]
+    if kind == "uniform" and len(args) == 2:
+        return lambda: random.uniform(args[0], args[1])
+    if kind == "lognormal" and len(args) == 2:
+        return lambda: random.lognormvariate(math.log(args[0]), args[1])
+    raise ValueError(f"Unknown latency spec {spec!r}; use fixed:MS, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA")
+
+
+class StubOpenRouter:
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=(50, 150), connect_delay_ms=0,
+                 error_rate=0.0, rate_limit_rate=0.0, malformed_rate=0.0, fenced_rate=0.0):
+        self.latency_ms = latency_ms
+        self._latency = latency_sampler(latency_ms)
+        # Share of requests answered with a 500, a 429 (with Retry-After) or
+        # a 200 whose content is not valid JSON.
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.fenced_rate = fenced_rate
+        # Sleeps once per new TCP connection, standing in for the TLS
+        # handshake a real HTTPS endpoint would charge.
+        self.connect_delay_ms = connect_delay_ms
+        self.connections = 0
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.malformed = 0
+        self.fenced = 0
+        self.json_mode_requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "connections": self.connections,
+                "requests": self.requests,
+                "errors": self.errors,
+                "rate_limited": self.rate_limited,
+                "malformed": self.malformed,
+                "fenced": self.fenced,
+                "json_mode_requests": self.json_mode_requests,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+            }
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+                if stub.connect_delay_ms:
+                    time.sleep(stub.connect_delay_ms / 1000)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+
+                roll = random.random()
+                if roll < stub.rate_limit_rate:
+                    with stub._lock:
+                        stub.rate_limited += 1
+                    self.send_error_json(429, "Rate limit exceeded", {"Retry-After": "1"})
+                    return
+                if roll < stub.rate_limit_rate + stub.error_rate:
+                    with stub._lock:
+                        stub.errors += 1
+                    time.sleep(stub._latency() / 1000)
+                    self.send_error_json(500, "Upstream error")
+                    return
+
+                # Vary the reply per prompt so downstream prompts differ too and
+                # are not coalesced or cached into one another.
+                digest = hashlib.sha1(json.dumps(body.get("messages")).encode()).hexdigest()[:8]
+                reply = dict(REPLY, gap_analysis=f"{REPLY['gap_analysis']} ({digest})")
+                # Batched prompts list their items as "### Item <n>".
+                items = re.findall(r"### Item (\d+)", body["messages"][-1].get("content") or "")
+                if items:
+                    content = json.dumps({"items": [dict(reply, index=int(i)) for i in items]})
+                else:
+                    content = json.dumps(reply)
+                if random.random() < stub.malformed_rate:
+                    # Truncated mid-object, like a reply cut off by max_tokens.
+                    content = content[:len(content) // 2]
+                    with stub._lock:
+                        stub.malformed += 1
+                elif "response_format" in body:
+                    with stub._lock:
+                        stub.json_mode_requests += 1
+                elif random.random() < stub.fenced_rate:
+                    content = f"Here is the JSON you asked for:\n```json\n{content}\n```\nLet me know if you need changes."
+                    with stub._lock:
+                        stub.fenced += 1
+                # chars/4 stand-in for a tokenizer, same on both sides of a comparison.
+                prompt_tokens = sum(len(m.get("content") or "") for m in body.get("messages", [])) // 4
+                completion_tokens = len(content) // 4
+                with stub._lock:
+                    stub.requests += 1
+                    stub.prompt_tokens += prompt_tokens
+                    stub.completion_tokens += completion_tokens
+                time.sleep(stub._latency() / 1000)
+
+                payload = json.dumps({
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens
+                    }
+                }).encode()
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def send_error_json(self, status, message, headers=None):
+                payload = json.dumps({"error": {"message": message, "code": status}}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
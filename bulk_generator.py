@@ -0,0 +1,233 @@
+# Bulk generation for campaign runs over many analysis IDs.
+#
+#   python -m bulk_generator ids.csv --output results.jsonl --concurrency 4
+#
+# Input is a CSV with an "analysis_id" column (or one ID per row) or a JSONL
+# file of {"analysis_id": ...} objects / bare strings. Each company's result
+# is appended to the output JSONL as soon as it finishes, and that file is
+# also the checkpoint: re-running with the same output skips every ID that
+# already has a "completed" record, so an interrupted run resumes without
+# re-calling the LLM for finished companies.
+import argparse
+import asyncio
+import csv
+import json
+import os
+import queue
+import re
+import time
+
+from config import config
+from langchain_email_generator import GENERATION_MODES, run_email_generation_pipeline_async
+from llm_client import run_async, submit_async
+from readiness import readiness_watcher, resolve_max_wait_ms
+from scheduler import PRIORITIES
+from telemetry import configure_logging
+
+BULK_CONCURRENCY = config.bulk_concurrency
+BULK_OUTPUT_DIR = config.bulk_output_dir
+
+
+def read_analysis_ids(path):
+    ids = []
+    with open(path, newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.reader(f))
+            if rows and "analysis_id" in rows[0]:
+                column = rows[0].index("analysis_id")
+                rows = rows[1:]
+            else:
+                column = 0
+            ids = [row[column].strip() for row in rows if len(row) > column and row[column].strip()]
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    item = line
+                analysis_id = item.get("analysis_id") if isinstance(item, dict) else item
+                if analysis_id:
+                    ids.append(str(analysis_id))
+
+    # Keep the first occurrence of each ID, in input order.
+    return list(dict.fromkeys(ids))
+
+
+def load_completed(output_path):
+    completed = {}
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Partially written last line from an interrupted run.
+                continue
+            if record.get("status") == "completed":
+                completed[record["analysis_id"]] = record
+    return completed
+
+
+def resolve_concurrency(concurrency):
+    if concurrency is None:
+        return BULK_CONCURRENCY
+    try:
+        concurrency = int(concurrency)
+    except (TypeError, ValueError):
+        raise ValueError("concurrency must be a positive integer")
+    if concurrency < 1:
+        raise ValueError("concurrency must be a positive integer")
+    return concurrency
+
+
+def positive_int(value):
+    # argparse type for --concurrency.
+    try:
+        return resolve_concurrency(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def default_tenant(run_id):
+    # One tenant per run, so concurrent campaigns split the batch capacity
+    # evenly however many companies each one has in flight.
+    return f"bulk:{run_id}"
+
+
+def run_output_path(run_id):
+    if not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", run_id):
+        raise ValueError("run_id may only contain letters, digits, '-' and '_'")
+    return os.path.join(BULK_OUTPUT_DIR, f"{run_id}.jsonl")
+
+
+async def run_bulk_async(analysis_ids, on_record, concurrency=BULK_CONCURRENCY, fresh=False, mode=None, deadline_ms=None, priority="batch", tenant=None, max_wait_ms=None):
+    # Bulk runs default to the batch priority class, so interactive
+    # generations overtake them for provider slots.
+    semaphore = asyncio.Semaphore(resolve_concurrency(concurrency))
+    # on_record writes to disk: it runs in a worker thread, one record at a
+    # time, so the shared loop keeps serving other requests meanwhile.
+    write_lock = asyncio.Lock()
+    max_wait_ms = resolve_max_wait_ms(max_wait_ms)
+    counts = {"completed": 0, "partial": 0, "failed": 0}
+    start = time.perf_counter()
+
+    async def generate(analysis_id):
+        started = time.perf_counter()
+        try:
+            # Companies whose initial analysis is still running wait outside
+            # the semaphore, so they do not hold up the ones that are ready.
+            # The completed status is reused by the pipeline's own check.
+            await readiness_watcher.wait_ready(analysis_id, max_wait=max_wait_ms / 1000)
+            async with semaphore:
+                result = await run_email_generation_pipeline_async(
+                    analysis_id, fresh=fresh, mode=mode, deadline_ms=deadline_ms, priority=priority, tenant=tenant,
+                    max_wait_ms=max_wait_ms, wait_in_deadline=False
+                )
+            # Partial results (deadline hit) are kept but not checkpointed
+            # as done, so a resumed run retries those companies, as it does
+            # ones whose analysis was not ready in time.
+            status = "partial" if result.get("deadline_exceeded") else "completed"
+            record = {"analysis_id": analysis_id, "status": status, "result": result}
+        except Exception as e:
+            record = {"analysis_id": analysis_id, "status": "failed", "error": str(e)}
+        record["elapsed_ms"] = round((time.perf_counter() - started) * 1000)
+        counts[record["status"]] += 1
+        async with write_lock:
+            await asyncio.to_thread(on_record, record)
+
+    await asyncio.gather(*[generate(analysis_id) for analysis_id in analysis_ids])
+
+    elapsed = time.perf_counter() - start
+    return {
+        **counts,
+        "elapsed_s": round(elapsed, 1),
+        "companies_per_minute": round(counts["completed"] * 60 / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def run_bulk(analysis_ids, output_path, concurrency=BULK_CONCURRENCY, fresh=False, mode=None, deadline_ms=None, priority="batch", tenant=None, max_wait_ms=None):
+    # The output file names the run, so a resumed run keeps its tenant.
+    tenant = tenant or default_tenant(os.path.splitext(os.path.basename(output_path))[0])
+    completed = load_completed(output_path)
+    pending = [analysis_id for analysis_id in analysis_ids if analysis_id not in completed]
+
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(output_path, "a") as output:
+        def write_record(record):
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+
+        summary = run_async(run_bulk_async(pending, write_record, concurrency, fresh, mode, deadline_ms, priority, tenant, max_wait_ms))
+
+    summary["skipped"] = len(analysis_ids) - len(pending)
+    summary["total"] = len(analysis_ids)
+    return summary
+
+
+def iter_bulk_records(analysis_ids, run_id, concurrency=BULK_CONCURRENCY, fresh=False, mode=None, deadline_ms=None, priority="batch", tenant=None, max_wait_ms=None):
+    # Streaming variant for the HTTP endpoint: yields records already in the
+    # run's checkpoint first, then new ones as they finish, then a summary.
+    output_path = run_output_path(run_id)
+    tenant = tenant or default_tenant(run_id)
+    completed = load_completed(output_path)
+    pending = [analysis_id for analysis_id in analysis_ids if analysis_id not in completed]
+
+    for analysis_id in analysis_ids:
+        if analysis_id in completed:
+            yield {**completed[analysis_id], "resumed": True}
+
+    os.makedirs(BULK_OUTPUT_DIR, exist_ok=True)
+    records = queue.Queue()
+
+    with open(output_path, "a") as output:
+        def write_record(record):
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            records.put(record)
+
+        future = submit_async(run_bulk_async(pending, write_record, concurrency, fresh, mode, deadline_ms, priority, tenant, max_wait_ms))
+        future.add_done_callback(lambda f: records.put(None))
+
+        try:
+            while True:
+                record = records.get()
+                if record is None:
+                    break
+                yield record
+        finally:
+            future.cancel()
+
+    summary = future.result()
+    summary["skipped"] = len(analysis_ids) - len(pending)
+    summary["total"] = len(analysis_ids)
+    yield {"summary": summary}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate emails for many analysis IDs with resumable checkpoints.")
+    parser.add_argument("input", help="CSV (analysis_id column) or JSONL file of analysis IDs")
+    parser.add_argument("--output", required=True, help="JSONL results file; also used as the resume checkpoint")
+    parser.add_argument("--concurrency", type=positive_int, default=BULK_CONCURRENCY, help="companies generated in parallel")
+    parser.add_argument("--fresh", action="store_true", help="bypass the LLM response cache")
+    parser.add_argument("--mode", choices=GENERATION_MODES, help="generation mode (default: GENERATION_MODE)")
+    parser.add_argument("--deadline-ms", type=int, help="per-company deadline (default: REQUEST_DEADLINE_MS)")
+    parser.add_argument("--priority", choices=PRIORITIES, default="batch", help="LLM scheduling class (default: batch)")
+    parser.add_argument("--tenant", help="share LLM capacity fairly as this tenant (default: bulk:<output file name>)")
+    parser.add_argument("--max-wait-ms", type=int, help="wait this long for still-running initial analyses (default: READINESS_MAX_WAIT_SECONDS)")
+    args = parser.parse_args()
+    configure_logging()
+
+    analysis_ids = read_analysis_ids(args.input)
+    summary = run_bulk(analysis_ids, args.output, args.concurrency, args.fresh, args.mode, args.deadline_ms, args.priority, args.tenant, args.max_wait_ms)
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import os
+
+from dotenv import load_dotenv
+
+
+def _flag(value):
+    return str(value).lower() in ("1", "true", "yes")
+
+
+class Config:
+    # Every setting the service reads from the environment (and .env), read
+    # once at import. Modules take their values from the shared `config`
+    # instead of calling os.getenv themselves, so nothing is re-read per call.
+    def __init__(self, environ=None):
+        env = os.environ if environ is None else environ
+        get = env.get
+
+        # OpenRouter / LLM client
+        self.openrouter_api_key = get("OPENROUTER_API_KEY")
+        self.openrouter_model = get("OPENROUTER_MODEL", "x-ai/grok-4-fast")
+        self.openrouter_base_url = get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").strip()
+        self.llm_timeout_seconds = float(get("LLM_TIMEOUT_SECONDS", "60"))
+        self.llm_expected_completion_tokens = int(get("LLM_EXPECTED_COMPLETION_TOKENS", "400"))
+        # Build the LLM client and open its provider connection at startup
+        # instead of on the first request (see llm_client.warm_up).
+        self.warm_up = _flag(get("WARM_UP", "false"))
+
+        # Structured output
+        self.llm_json_mode = _flag(get("LLM_JSON_MODE", "true"))
+        self.llm_parse_retries = int(get("LLM_PARSE_RETRIES", "1"))
+        self.llm_parse_retry_ratio = float(get("LLM_PARSE_RETRY_RATIO", "0.1"))
+        self.llm_parse_retry_burst = int(get("LLM_PARSE_RETRY_BURST", "10"))
+
+        # Rate limiting and scheduling
+        self.llm_max_concurrency = int(get("LLM_MAX_CONCURRENCY", "16"))
+        self.llm_requests_per_minute = float(get("LLM_REQUESTS_PER_MINUTE", "300"))
+        self.llm_tokens_per_minute = float(get("LLM_TOKENS_PER_MINUTE", "400000"))
+        self.llm_max_retries = int(get("LLM_MAX_RETRIES", "4"))
+        self.scheduler_default_priority = get("SCHEDULER_DEFAULT_PRIORITY", "interactive")
+        self.scheduler_max_queue = int(get("SCHEDULER_MAX_QUEUE", "1000"))
+        self.scheduler_tenant_weights = get("SCHEDULER_TENANT_WEIGHTS")
+
+        # Hedging
+        self.hedge_enabled = _flag(get("HEDGE_ENABLED", "false"))
+        self.hedge_percentile = float(get("HEDGE_PERCENTILE", "95"))
+        self.hedge_min_samples = int(get("HEDGE_MIN_SAMPLES", "20"))
+        self.hedge_min_delay_s = float(get("HEDGE_MIN_DELAY_MS", "1000")) / 1000
+        self.hedge_window = int(get("HEDGE_WINDOW", "500"))
+        self.hedge_fallback_model = get("HEDGE_FALLBACK_MODEL") or None
+
+        # LLM response cache
+        self.llm_cache_enabled = _flag(get("LLM_CACHE_ENABLED", "true"))
+        self.llm_cache_path = get("LLM_CACHE_PATH", "llm_cache.sqlite3")
+        self.llm_cache_ttl_seconds = float(get("LLM_CACHE_TTL_SECONDS", "86400"))
+        self.llm_cache_memory_entries = int(get("LLM_CACHE_MEMORY_ENTRIES", "1024"))
+        self.llm_cache_disk_entries = int(get("LLM_CACHE_DISK_ENTRIES", "20000"))
+
+        # Prompts
+        self.prompt_token_budget = int(get("PROMPT_TOKEN_BUDGET", "1500"))
+        self.prompt_batch_item_tokens = int(get("PROMPT_BATCH_ITEM_TOKENS", "250"))
+        self.prompt_min_field_tokens = int(get("PROMPT_MIN_FIELD_TOKENS", "32"))
+        self.prompt_tokenizer = get("PROMPT_TOKENIZER", "o200k_base")
+
+        # biz-api extractor
+        self.api_base_url = get("API_BASE_URL", "https://biz-api.log1.com/api/v1/analyze")
+        self.api_bearer_token = get("API_BEARER_TOKEN")
+        self.extractor_pool_size = int(get("EXTRACTOR_POOL_SIZE", "20"))
+        self.extractor_connect_timeout = float(get("EXTRACTOR_CONNECT_TIMEOUT", "5"))
+        self.extractor_read_timeout = float(get("EXTRACTOR_READ_TIMEOUT", "30"))
+        self.extractor_cache_entries = int(get("EXTRACTOR_CACHE_ENTRIES", "256"))
+
+        # Waiting for initial analyses that are still running
+        self.readiness_max_wait_seconds = float(get("READINESS_MAX_WAIT_SECONDS", "300"))
+        self.readiness_poll_base_seconds = float(get("READINESS_POLL_BASE_SECONDS", "1"))
+        self.readiness_poll_max_seconds = float(get("READINESS_POLL_MAX_SECONDS", "30"))
+        self.readiness_poll_concurrency = int(get("READINESS_POLL_CONCURRENCY", "4"))
+
+        # Generation
+        self.generation_mode = get("GENERATION_MODE", "two_stage")
+        self.generation_batch_size = int(get("GENERATION_BATCH_SIZE", "3"))
+        self.request_deadline_ms = int(get("REQUEST_DEADLINE_MS", "90000"))
+        self.deadline_extraction_share = float(get("DEADLINE_EXTRACTION_SHARE", "0.25"))
+        self.deadline_gap_share = float(get("DEADLINE_GAP_SHARE", "0.35"))
+        self.dedup_enabled = _flag(get("DEDUP_ENABLED", "true"))
+        self.dedup_threshold = float(get("DEDUP_THRESHOLD", "0.4"))
+
+        # Stage results, jobs and bulk runs
+        self.stage_store_enabled = _flag(get("STAGE_STORE_ENABLED", "true"))
+        self.stage_store_path = get("STAGE_STORE_PATH", "stage_results.sqlite3")
+        self.stage_store_ttl_seconds = float(get("STAGE_STORE_TTL_SECONDS", str(7 * 86400)))
+        # Generation jobs running at once (JOB_WORKERS is the old name). Jobs
+        # are loop tasks, not threads, so this can be sized for interactive
+        # traffic; LLM_MAX_CONCURRENCY still bounds the calls they make.
+        self.job_concurrency = int(get("JOB_CONCURRENCY", get("JOB_WORKERS", "32")))
+        self.job_max_pending = int(get("JOB_MAX_PENDING", "100"))
+        self.job_retention_seconds = float(get("JOB_RETENTION_SECONDS", "3600"))
+        self.bulk_concurrency = int(get("BULK_CONCURRENCY", "4"))
+        self.bulk_output_dir = get("BULK_OUTPUT_DIR", "bulk_runs")
+
+        # Logging
+        self.log_level = get("LOG_LEVEL", "INFO")
+        self.log_format = get("LOG_FORMAT", "text")
+
+        # Diagnostics
+        self.diagnostics_enabled = _flag(get("DIAGNOSTICS_ENABLED", "false"))
+        self.diagnostics_tracemalloc_frames = int(get("DIAGNOSTICS_TRACEMALLOC_FRAMES", "1"))
+        # glibc malloc arenas, applied at startup (see diagnostics.py).
+        self.malloc_arena_max = int(get("MALLOC_ARENA_MAX", "2"))
+
+
+load_dotenv()
+config = Config()
@@ -0,0 +1,178 @@
+import math
+import re
+
+from config import config
+
+# Opportunities whose similarity to an earlier one reaches DEDUP_THRESHOLD are
+# collapsed into it before any LLM call. Hypotheses come from a model, so one
+# idea turns up worded two ways - "Automated invoice processing" next to
+# "AI-powered invoice data extraction" - and word overlap alone misses it.
+# Each hypothesis is scored as TF-IDF cosine over normalised terms:
+#   * stopwords and generic words ("ai", "powered", "solution") are dropped,
+#     common automation vocabulary is mapped to one concept (processing and
+#     extraction, "by hand" and "manually") and the rest is cut to a 5-char
+#     stem;
+#   * IDF comes from the analysis' own hypotheses, so a term only two of them
+#     share ("invoice") counts for more than one most of them use ("data");
+#   * the solution weighs SOLUTION_WEIGHT, the "why" the rest.
+# Variants of one template are not duplicates: solutions that differ in a
+# number ("workflow 1" / "workflow 2") or carry opposite terms ("accounts
+# payable" / "accounts receivable") are never merged. The default threshold
+# comes from the labelled pairs in benchmarks/bench_dedup.py.
+DEDUP_ENABLED = config.dedup_enabled
+DEDUP_THRESHOLD = config.dedup_threshold
+
+# Words every hypothesis shares; they would make unrelated ones look alike.
+STOPWORDS = {
+    "a", "an", "and", "the", "of", "for", "to", "in", "on", "with", "by", "from", "into", "via", "at", "or",
+    "is", "are", "be", "it", "that", "this", "than", "all", "every", "each", "same", "day", "days",
+    "they", "them", "when", "only", "without", "against", "between", "up", "down", "out", "just",
+    "their", "its", "our", "your", "using", "use", "based", "driven", "powered", "enabled", "leverage",
+    "ai", "ml", "llm", "genai", "machine", "learning", "solution", "solutions", "tool", "tools", "system", "platform",
+}
+
+# Words that name the same idea in these hypotheses, keyed by the concept
+# they count as. An entry matches a whole word or a 5-char stem, so "autom"
+# covers "automate", "automated" and "automation"; ambiguous stems are
+# spelled out as whole words instead ("conversational", not "conve").
+CONCEPTS = {
+    "automate": ["autom", "robot", "rpa"],
+    "capture": ["proce", "extra", "captu", "inges", "ocr", "parse", "parsing", "scan", "scanning"],
+    "manual": ["manua", "hand", "key", "keyed", "keys", "rekey", "retype", "type", "types", "typed", "typing", "re", "paper"],
+    "ledger": ["erp", "accou", "ledge", "bookkeeping"],
+    "staff": ["staff", "team", "teams", "emplo", "clerk", "clerks", "agent", "agents"],
+    "chatbot": ["chatb", "bot", "bots", "conversational", "assistant", "assistants", "virtual"],
+    "support": ["suppo", "service", "helpdesk"],
+    "query": ["question", "questions", "query", "queries", "enqui", "inqui", "ticke", "request", "requests"],
+    "predict": ["predi", "forec", "anticipate"],
+    "failure": ["maint", "failu", "break", "breakdown", "breakdowns", "broke", "broken", "downtime", "fault", "faults", "outag"],
+    "check": ["check", "valid", "verif", "audit", "revie", "inspe"],
+    "workforce": ["staffing", "workf", "labou", "labor", "shift", "shifts", "rota", "rotas", "headc"],
+    "lead": ["lead", "prosp"],
+    "prioritise": ["prior", "score", "scori", "rank", "ranki", "triag"],
+}
+CONCEPT_OF = {stem: concept for concept, stems in CONCEPTS.items() for stem in stems}
+
+# Pairs of terms that make otherwise identical solutions different work.
+CONTRASTS = [
+    ("payable", "receivable"), ("inbound", "outbound"), ("import", "export"), ("imports", "exports"),
+    ("purchase", "sales"), ("buy", "sell"), ("supplier", "customer"), ("suppliers", "customers"),
+    ("internal", "external"), ("b2b", "b2c"),
+]
+
+SOLUTION_WEIGHT = 0.7
+# Compared separately: sharing a rationale does not make two solutions the
+# same, nor does a similar title with a different reason.
+FIELDS = ("solution", "why")
+WEIGHTS = {"solution": SOLUTION_WEIGHT, "why": 1 - SOLUTION_WEIGHT}
+STEM_LENGTH = 5
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def words(text):
+    return _WORD.findall((text or "").lower())
+
+
+def terms(text):
+    # Normalised content terms, repeats kept for the term frequency. A
+    # trailing "s" goes first: the stem alone keeps "lead" and "leads" apart.
+    found = []
+    for word in words(text):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        stem = word[:STEM_LENGTH]
+        found.append(CONCEPT_OF.get(word, CONCEPT_OF.get(stem, stem)))
+    return found
+
+
+def tfidf_vectors(documents):
+    # One {term: weight} vector per document, each scaled to unit length.
+    # Smoothed IDF, as a term in every document still says something.
+    document_frequency = {}
+    for document in documents:
+        for term in set(document):
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+    count = len(documents)
+    vectors = []
+    for document in documents:
+        vector = {}
+        for term in document:
+            idf = math.log((1 + count) / (1 + document_frequency[term])) + 1
+            vector[term] = vector.get(term, 0.0) + idf
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        vectors.append({term: weight / norm for term, weight in vector.items()} if norm else {})
+    return vectors
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(term, 0.0) for term, weight in a.items())
+
+
+def variants(a, b):
+    # True when two solutions are one template filled in differently: a
+    # different number, or opposite terms on either side.
+    a, b = set(words(a)), set(words(b))
+    numbers_a = {word for word in a if word.isdigit()}
+    numbers_b = {word for word in b if word.isdigit()}
+    if numbers_a != numbers_b:
+        return True
+    return any((x in a and y in b) or (y in a and x in b) for x, y in CONTRASTS)
+
+
+def opportunity_vectors(opportunities):
+    # Per opportunity, {field: vector} for the fields it has text in.
+    per_field = {}
+    for field in FIELDS:
+        per_field[field] = tfidf_vectors([terms(opp.get(field)) for opp in opportunities])
+    return [{field: per_field[field][index] for field in FIELDS if per_field[field][index]}
+            for index in range(len(opportunities))]
+
+
+def similarity(a, b, vector_a, vector_b):
+    # Weighted cosine over the fields both opportunities have; 0.0 for
+    # variants of one template or when they share no field.
+    if variants(a.get("solution"), b.get("solution")):
+        return 0.0
+    shared = [field for field in FIELDS if field in vector_a and field in vector_b]
+    total = sum(WEIGHTS[field] for field in shared)
+    if not total:
+        return 0.0
+    return sum(WEIGHTS[field] * cosine(vector_a[field], vector_b[field]) for field in shared) / total
+
+
+def collapse_duplicates(opportunities, threshold=DEDUP_THRESHOLD):
+    # Greedy single pass in input order: each opportunity either joins the
+    # most similar representative kept so far (if at or above `threshold`) or
+    # becomes a representative itself. Pairwise scoring is fine at the
+    # handful of hypotheses an analysis carries. Returns (representatives,
+    # collapsed), where each collapsed entry says which representative (by
+    # index into `representatives`) it was folded into.
+    vectors = opportunity_vectors(opportunities)
+    representatives = []
+    kept = []
+    collapsed = []
+
+    for original_index, opp in enumerate(opportunities):
+        best_index, best_similarity = None, 0.0
+        for index, kept_index in enumerate(kept):
+            score = similarity(opp, opportunities[kept_index], vectors[original_index], vectors[kept_index])
+            if score > best_similarity:
+                best_index, best_similarity = index, score
+
+        if best_index is not None and best_similarity >= threshold:
+            collapsed.append({
+                "original_index": original_index,
+                "duplicate_of": best_index,
+                "similarity": round(best_similarity, 3),
+                "opportunity": opp,
+            })
+        else:
+            representatives.append(opp)
+            kept.append(original_index)
+
+    return representatives, collapsed
@@ -0,0 +1,211 @@
+import asyncio
+import ctypes
+import gc
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from config import config
+
+log = logging.getLogger(__name__)
+
+# Opt-in runtime diagnostics for tracking down memory growth: with
+# DIAGNOSTICS_ENABLED, tracemalloc runs from startup (keeping
+# DIAGNOSTICS_TRACEMALLOC_FRAMES frames per allocation; 0 leaves it off),
+# GET /debug/diagnostics returns snapshot() and SIGUSR1 logs it. Taking a
+# tracemalloc snapshot briefly needs memory in proportion to every live
+# allocation, which the allocator tends to keep: expect RSS to step up after
+# the first one.
+DIAGNOSTICS_ENABLED = config.diagnostics_enabled
+DIAGNOSTICS_TRACEMALLOC_FRAMES = config.diagnostics_tracemalloc_frames
+
+# glibc gives every thread that finds the heap busy an arena of its own, up to
+# 8 per core, and each arena keeps its own free memory instead of handing it
+# back. Under load the app's request, extractor and loop threads otherwise end
+# up with 8 heaps even on one core. The service caps the arenas itself
+# (MALLOC_ARENA_MAX, 0 keeps glibc's default) so the setting ships with it
+# rather than depending on how it was launched.
+MALLOC_ARENA_MAX = config.malloc_arena_max
+# mallopt() parameter number, from glibc's malloc.h.
+M_ARENA_MAX = -8
+
+# Instances counted in every snapshot: (module, class) by name, so nothing is
+# imported just to count it. A few of each per process are expected; a count
+# that grows with traffic is a leak.
+WATCHED_CLASSES = {
+    "llm_clients": ("langchain_openai", "ChatOpenAI"),
+    "httpx_clients": ("httpx", "Client"),
+    "httpx_async_clients": ("httpx", "AsyncClient"),
+    "requests_sessions": ("requests", "Session"),
+    "event_loops": ("asyncio", "AbstractEventLoop"),
+}
+
+_previous = None
+_extra = None
+_malloc_arena_max = None
+_lock = threading.Lock()
+
+
+def enable(frames=DIAGNOSTICS_TRACEMALLOC_FRAMES, extra=None):
+    # `extra` returns the caller's own stats (pools, loops) for snapshots
+    # taken on SIGUSR1.
+    global _extra
+    _extra = extra
+    if frames and not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, _log_snapshot)
+    else:
+        log.warning("Diagnostics signal handler not installed outside the main thread")
+
+
+def limit_malloc_arenas(arenas=MALLOC_ARENA_MAX):
+    # Call before the process starts threads: arenas that exist already stay.
+    # Returns whether the limit was applied (not on musl, macOS or Windows).
+    global _malloc_arena_max
+    if not arenas:
+        return False
+    try:
+        applied = ctypes.CDLL("libc.so.6").mallopt(M_ARENA_MAX, arenas) == 1
+    except (OSError, AttributeError):
+        applied = False
+    if applied:
+        _malloc_arena_max = arenas
+    else:
+        log.info("Could not limit malloc arenas; the platform allocator keeps its defaults")
+    return applied
+
+
+def _log_snapshot(signum, frame):
+    # The snapshot walks every object; do it off the signal handler's frame.
+    def dump():
+        log.warning("Diagnostics snapshot\n%s", json.dumps(snapshot(extra=_extra() if _extra else None), indent=2, default=str))
+
+    threading.Thread(target=dump, name="diagnostics", daemon=True).start()
+
+
+def process_stats():
+    stats = {"pid": os.getpid(), "threads": threading.active_count(), "malloc_arena_max": _malloc_arena_max}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(":")
+                    stats["rss_mb" if key == "VmRSS" else "peak_rss_mb"] = round(int(value.split()[0]) / 1024, 1)
+        fds = os.listdir("/proc/self/fd")
+        stats["open_fds"] = len(fds)
+        stats["sockets"] = sum(1 for fd in fds if _readlink(f"/proc/self/fd/{fd}").startswith("socket:"))
+    except OSError:
+        # Not Linux: resource only has the peak.
+        import resource
+        stats["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return stats
+
+
+def _readlink(path):
+    try:
+        return os.readlink(path)
+    except OSError:
+        return ""
+
+
+def object_stats(top):
+    classes = {}
+    for name, (module, attr) in WATCHED_CLASSES.items():
+        cls = getattr(sys.modules.get(module), attr, None)
+        if cls is not None:
+            classes[name] = cls
+    counts = dict.fromkeys(WATCHED_CLASSES, 0)
+    types = Counter()
+    loops = []
+    objects = gc.get_objects()
+    for obj in objects:
+        types[type(obj).__qualname__] += 1
+        for name, cls in classes.items():
+            if isinstance(obj, cls):
+                counts[name] += 1
+                if cls is asyncio.AbstractEventLoop:
+                    loops.append(obj)
+    return {
+        **counts,
+        "open_event_loops": sum(1 for loop in loops if not loop.is_closed()),
+        "running_event_loops": sum(1 for loop in loops if loop.is_running()),
+        "tracked_objects": len(objects),
+        "top_types": [{"type": name, "count": count} for name, count in types.most_common(top)],
+    }
+
+
+def gc_stats():
+    return {
+        "counts": list(gc.get_count()),
+        "thresholds": list(gc.get_threshold()),
+        "generations": gc.get_stats(),
+        "uncollectable": len(gc.garbage),
+    }
+
+
+def tracemalloc_stats(top):
+    # Largest allocation sites now, and the sites that grew most since the
+    # previous snapshot (the first one compares against nothing). Only the
+    # per-line totals are kept between calls: a whole tracemalloc snapshot
+    # holds every live trace and would itself be the biggest "leak".
+    global _previous
+    if not tracemalloc.is_tracing():
+        return {"tracing": False}
+    current, peak = tracemalloc.get_traced_memory()
+    snap = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    lines = {str(stat.traceback[0]): (stat.size, stat.count) for stat in snap.statistics("lineno")}
+    del snap
+    with _lock:
+        previous, _previous = _previous, lines
+
+    largest = sorted(lines.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    stats = {
+        "tracing": True,
+        "traced_mb": round(current / 2**20, 2),
+        "peak_traced_mb": round(peak / 2**20, 2),
+        "top": [_line(where, size, count) for where, (size, count) in largest],
+    }
+    if previous is not None:
+        growth = []
+        for where, (size, count) in lines.items():
+            old_size, old_count = previous.get(where, (0, 0))
+            if size > old_size:
+                growth.append((size - old_size, where, size, count, count - old_count))
+        growth.sort(reverse=True)
+        stats["top_growth"] = [
+            dict(_line(where, size, count), size_diff_kb=round(size_diff / 1024, 1), count_diff=count_diff)
+            for size_diff, where, size, count, count_diff in growth[:top]
+        ]
+    return stats
+
+
+def _line(where, size, count):
+    return {"where": where, "size_kb": round(size / 1024, 1), "count": count}
+
+
+def snapshot(top=20, collect=False, extra=None):
+    # Everything above in one dict; `extra` is merged in (the app adds its
+    # own pool and loop stats). collect=True runs a full collection first, so
+    # only memory that is really still referenced shows up.
+    start = time.perf_counter()
+    collected = gc.collect() if collect else None
+    result = {
+        "process": process_stats(),
+        "objects": object_stats(top),
+        "gc": dict(gc_stats(), collected=collected),
+        "tracemalloc": tracemalloc_stats(top),
+        **(extra or {}),
+    }
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
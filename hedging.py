@@ -0,0 +1,74 @@
+import threading
+from collections import deque
+
+from config import config
+
+
+class Hedger:
+    # Tracks recent LLM latencies per model and decides when a call is slow
+    # enough to fire a duplicate ("hedge"). The hedge deadline is the
+    # `percentile` of the last `window` successful latencies, never below
+    # `min_delay_s`, and hedging only starts once `min_samples` are known.
+    def __init__(self, enabled=False, percentile=95, min_samples=20, min_delay_s=1.0, window=500, fallback_model=None):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay_s = min_delay_s
+        self.window = window
+        # Optional secondary model for the hedge; None re-sends to the same model.
+        self.fallback_model = fallback_model
+
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.latency_saved_s = 0.0
+
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, latency_s):
+        with self._lock:
+            samples = self._latencies.setdefault(model, deque(maxlen=self.window))
+            samples.append(latency_s)
+
+    def deadline(self, model):
+        if not self.enabled:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies.get(model, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return max(self.min_delay_s, samples[index])
+
+    def record_hedge_win(self, model, deadline_s, elapsed_s):
+        # Estimated saving: how long calls that overran the deadline took on
+        # average (from the tracked tail), minus what the hedge delivered.
+        with self._lock:
+            tail = [s for s in self._latencies.get(model, ()) if s > deadline_s]
+        expected = sum(tail) / len(tail) if tail else 2 * deadline_s
+        self.hedge_wins += 1
+        self.latency_saved_s += max(0.0, expected - elapsed_s)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "fallback_model": self.fallback_model,
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_rate": round(self.hedged / self.calls, 3) if self.calls else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "primary_wins": self.primary_wins,
+            "estimated_latency_saved_ms": round(self.latency_saved_s * 1000),
+        }
+
+
+hedger = Hedger(
+    enabled=config.hedge_enabled,
+    percentile=config.hedge_percentile,
+    min_samples=config.hedge_min_samples,
+    min_delay_s=config.hedge_min_delay_s,
+    window=config.hedge_window,
+    fallback_model=config.hedge_fallback_model,
+)
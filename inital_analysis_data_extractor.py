@@ -1,56 +1,201 @@
 import requests
 import time
 import json
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
-
-def main_extractor(analysis_id):
-    base_url = os.getenv("API_BASE_URL", "https://biz-api.log1.com/api/v1/analyze")
-    bearer_token = os.getenv("API_BEARER_TOKEN")
+import copy
+import logging
+import threading
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from config import config
+from json_stream import select_fields
+from telemetry import span
+
+log = logging.getLogger(__name__)
+
+# One pooled session for the biz-api and the presigned artifact host, so
+# repeat generations reuse connections instead of opening new ones per call.
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=config.extractor_pool_size)
+session.mount("https://", _adapter)
+session.mount("http://", _adapter)
+
+# (connect, read) timeouts in seconds for every extractor request.
+TIMEOUT = (
+    config.extractor_connect_timeout,
+    config.extractor_read_timeout
+)
+
+def bounded_timeout(seconds):
+    # TIMEOUT capped at what is left of a request's deadline budget.
+    if seconds is None:
+        return TIMEOUT
+    seconds = max(0.001, seconds)
+    return (min(TIMEOUT[0], seconds), min(TIMEOUT[1], seconds))
+
+# Status payload fields that identify a specific version of the artifact.
+# When any of them are present and unchanged, the cached output is reused
+# without touching the artifact at all.
+VERSION_KEYS = ("etag", "version", "updated_at", "last_modified", "completed_at", "file_updated_at")
+
+# Top-level artifact keys used by extract_json_output; everything else in the
+# artifact is skipped while streaming.
+ARTIFACT_FIELDS = ("company", "more_info", "ai_opportunity_hypotheses", "value_prop_angles", "pain_points_and_goals", "icps_to_contact")
+ARTIFACT_CHUNK_SIZE = 64 * 1024
+
+# analysis_id -> {"version", "etag", "last_modified", "output"}, least recently used first
+_output_cache = OrderedDict()
+_output_cache_lock = threading.Lock()
+_output_cache_size = config.extractor_cache_entries
+_cache_stats = {"version_hits": 0, "not_modified": 0, "downloads": 0}
+
+# Values of "status"/"overall_status" meaning the analysis is done, or will
+# never be.
+COMPLETE_STATUSES = ("initial_complete", "completed")
+FAILED_STATUSES = ("failed", "error")
+
+class AnalysisNotReady(Exception):
+    pass
+
+class AnalysisFailed(Exception):
+    pass
+
+def status_request(analysis_id):
+    bearer_token = config.api_bearer_token
 
     if not bearer_token:
         raise ValueError("API_BEARER_TOKEN is not set in environment variables")
-    
+
     headers = {
             'Authorization': f'Bearer {bearer_token}',
             'Content-Type': 'application/json'
         }
-    inital_analysis_url = f"{base_url}/{analysis_id}/files/initial_analysis"
-
-    result, data = get_inital_analysis_status(inital_analysis_url, headers)
-    output = get_inital_analysis_data(data)
-    return output
-
-def get_inital_analysis_status(status_url, headers): 
+    return f"{config.api_base_url}/{analysis_id}/files/initial_analysis", headers
+
+def check_inital_analysis_status(analysis_id, timeout=TIMEOUT):
+    # One status round trip: (ready, status_data).
+    inital_analysis_url, headers = status_request(analysis_id)
+    with span("status_check"):
+        return get_inital_analysis_status(inital_analysis_url, headers, timeout)
+
+def main_extractor(analysis_id, timeout=TIMEOUT, status_data=None):
+    # `status_data` is a completed status the caller already fetched (see
+    # readiness.py); without it the status is checked here, once.
+    if status_data is None:
+        ready, status_data = check_inital_analysis_status(analysis_id, timeout)
+        if not ready:
+            raise AnalysisNotReady(f"Initial analysis for {analysis_id} is not completed yet ({status_data.get('overall_status')})")
+    data = status_data
+
+    cached = get_cached_output(analysis_id)
+    version = get_status_version(data)
+    if cached and version is not None and cached["version"] == version:
+        _cache_stats["version_hits"] += 1
+        return copy.deepcopy(cached["output"])
+
+    with span("artifact_download") as fields:
+        inital_analysis_data, validators = download_inital_analysis(data.get('presigned_url'), cached, timeout)
+        fields["not_modified"] = inital_analysis_data is None
+    if inital_analysis_data is None:
+        # 304 Not Modified: the artifact is the one we already parsed.
+        _cache_stats["not_modified"] += 1
+        output = cached["output"]
+    else:
+        _cache_stats["downloads"] += 1
+        with span("json_extraction"):
+            output = extract_json_output(inital_analysis_data)
+
+    store_cached_output(analysis_id, version, validators, output)
+    return copy.deepcopy(output)
+
+def get_inital_analysis_status(status_url, headers, timeout=TIMEOUT): 
+    # (True, status_data) once the analysis is complete, (False, status_data)
+    # while it is still running. HTTP and connection errors are raised, as is
+    # AnalysisFailed for an analysis that will never complete.
     try: 
-        status_response = requests.get(status_url, headers=headers)
-        if status_response.status_code == 200:
-            status_data = status_response.json()
-            if status_data["overall_status"] == 'initial_complete' or status_data["status"] == 'completed' or status_data["overall_status"] == 'completed':
-                FLAG = 1
-            else: 
-                FLAG = 0
-        else: 
-            print(f"Error: Received status code {status_response.status_code}")
-            return False 
-              
+        status_response = session.get(status_url, headers=headers, timeout=timeout)
+        if status_response.status_code != 200:
+            log.error("Status check returned HTTP %s", status_response.status_code)
+        status_response.raise_for_status()
+        status_data = status_response.json()
     except requests.exceptions.RequestException as e:
-            print(f"Error during status check: {e}")
-            print(e)
-    
-    if FLAG != 1:
-        print("NOT COMPLETED .. CAN'T GENERATE THE INFORMATION")
-        return False
-    else: 
-        print("INITAL ANALYSIS IS COMPLETED")
+        log.error("Error during status check: %s", e)
+        raise
+
+    statuses = (status_data.get("overall_status"), status_data.get("status"))
+    if any(status in COMPLETE_STATUSES for status in statuses):
+        log.debug("Initial analysis is completed")
         return True, status_data
+    if any(status in FAILED_STATUSES for status in statuses):
+        raise AnalysisFailed(f"Initial analysis failed ({status_data.get('overall_status') or status_data.get('status')})")
+    log.debug("Initial analysis not completed yet", extra={"overall_status": statuses[0]})
+    return False, status_data
+
+def get_status_version(status_data):
+    version = tuple((key, status_data[key]) for key in VERSION_KEYS if status_data.get(key))
+    return version or None
+
+def get_cached_output(analysis_id):
+    with _output_cache_lock:
+        cached = _output_cache.get(analysis_id)
+        if cached is not None:
+            _output_cache.move_to_end(analysis_id)
+        return cached
+
+def store_cached_output(analysis_id, version, validators, output):
+    with _output_cache_lock:
+        _output_cache[analysis_id] = {"version": version, "output": output, **validators}
+        _output_cache.move_to_end(analysis_id)
+        while len(_output_cache) > _output_cache_size:
+            _output_cache.popitem(last=False)
+
+def extractor_cache_stats():
+    return {**_cache_stats, "entries": len(_output_cache)}
+
+def connection_pool_stats():
+    # The shared session's urllib3 pools, one per host: connections opened
+    # over the pool's life and the ones idle in it now.
+    pools = _adapter.poolmanager.pools
+    stats = {}
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is not None:
+            stats[f"{key.key_host}:{key.key_port}"] = {
+                "opened": pool.num_connections,
+                "idle": pool.pool.qsize() if pool.pool is not None else 0,
+            }
+    return stats
+
+def download_inital_analysis(inital_analysis_url, cached=None, timeout=TIMEOUT):
+    # Conditional GET against the presigned artifact; returns (None, validators)
+    # when the server answers 304 for the copy we already hold.
+    request_headers = {}
+    if cached:
+        if cached.get("etag"):
+            request_headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            request_headers["If-Modified-Since"] = cached["last_modified"]
+
+    with session.get(inital_analysis_url, headers=request_headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304 and cached:
+            return None, {"etag": cached.get("etag"), "last_modified": cached.get("last_modified")}
+
+        response.raise_for_status()
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")
+        }
+        # Artifacts can be several MB; parse the body as it streams in and keep
+        # only the top-level fields extract_json_output reads.
+        inital_analysis_data = select_fields(response.iter_content(chunk_size=ARTIFACT_CHUNK_SIZE), ARTIFACT_FIELDS)
+    return inital_analysis_data, validators
 
 def get_inital_analysis_data(file_data): 
 
     inital_analysis_url = file_data.get('presigned_url')
-    inital_analysis_data = requests.get(inital_analysis_url).json()
+    inital_analysis_data, _ = download_inital_analysis(inital_analysis_url)
+    return extract_json_output(inital_analysis_data)
+
+def extract_json_output(inital_analysis_data):
 
     company_name = inital_analysis_data.get("company",{}).get("name", "")
     about_company = inital_analysis_data.get("more_info", {})
@@ -99,4 +244,4 @@ def get_inital_analysis_data(file_data):
         "hooks": hook_message
     }
 
-    return json_output
\ No newline at end of file
+    return json_output
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+
+from config import config
+from langchain_email_generator import run_email_generation_pipeline_async
+from llm_client import submit_async
+
+log = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobManager:
+    # Runs generations as tasks on the shared LLM event loop so the web worker
+    # that accepted the request is free again immediately. A job only waits on
+    # I/O, so no thread is tied up per job; at most `concurrency` run at once
+    # (the rest stay "queued") and the LLM calls themselves are still bounded
+    # by the scheduler. Jobs are kept in memory and dropped
+    # `retention_seconds` after they finish.
+    def __init__(self, concurrency=32, max_pending=100, retention_seconds=3600):
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # Created on the loop that runs the jobs, and again if that loop is
+        # replaced (e.g. after a fork).
+        self._semaphore = None
+        self._semaphore_loop = None
+
+    def submit(self, analysis_id, fresh=False, mode=None, deadline_ms=None, priority=None, tenant=None, max_wait_ms=None):
+        with self._lock:
+            self._purge_expired()
+            pending = sum(1 for job in self._jobs.values() if job["status"] in ("queued", "running"))
+            if pending >= self.max_pending:
+                raise JobQueueFull(f"Too many pending jobs ({pending}), try again later")
+
+            job = {
+                "job_id": uuid.uuid4().hex,
+                "analysis_id": analysis_id,
+                "status": "queued",
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "progress": {"stage": "queued", "total": None, "gap_analyses_done": 0, "emails_done": 0},
+                "emails": [],
+                "result": None,
+                "error": None,
+            }
+            self._jobs[job["job_id"]] = job
+
+        submit_async(self._run(job, fresh, mode, deadline_ms, priority, tenant, max_wait_ms))
+        return self.get(job["job_id"])
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge_expired()
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {
+                **job,
+                "progress": dict(job["progress"]),
+                "emails": list(job["emails"]),
+            }
+
+    def _slots(self):
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def _run(self, job, fresh, mode, deadline_ms, priority, tenant, max_wait_ms):
+        async with self._slots():
+            await self._execute(job, fresh, mode, deadline_ms, priority, tenant, max_wait_ms)
+
+    async def _execute(self, job, fresh, mode, deadline_ms, priority, tenant, max_wait_ms):
+        with self._lock:
+            job["status"] = "running"
+            job["started_at"] = time.time()
+            job["progress"]["stage"] = "extraction"
+
+        def on_event(event):
+            with self._lock:
+                progress = job["progress"]
+                if event["event"] == "waiting":
+                    # Initial analysis still running; generation starts on its own once it completes.
+                    progress["stage"] = "waiting_for_analysis"
+                    progress["analysis_status"] = event["status"]
+                elif event["event"] == "extraction":
+                    progress["stage"] = "generating"
+                    progress["total"] = event["total"]
+                    job["emails"] = [None] * event["total"]
+                elif event["event"] == "gap_analysis":
+                    progress["gap_analyses_done"] += 1
+                elif event["event"] == "email":
+                    progress["emails_done"] += 1
+                    job["emails"][event["index"]] = event["email"]
+
+        try:
+            # Nobody holds a connection open for a job: waiting for the
+            # initial analysis does not eat into its deadline.
+            result = await run_email_generation_pipeline_async(job["analysis_id"], on_event=on_event, fresh=fresh, mode=mode, deadline_ms=deadline_ms, priority=priority,
+                                                               tenant=tenant, max_wait_ms=max_wait_ms, wait_in_deadline=False)
+        except Exception as e:
+            log.warning("Generation job failed", extra={"job_id": job["job_id"], "analysis_id": job["analysis_id"], "error": str(e)})
+            with self._lock:
+                job["status"] = "failed"
+                job["error"] = str(e)
+                job["progress"]["stage"] = "failed"
+                job["finished_at"] = time.time()
+            return
+
+        with self._lock:
+            job["status"] = "completed"
+            job["result"] = result
+            # Keep one slot per opportunity; items cut off by the deadline stay None.
+            emails = iter(result["emails"])
+            job["emails"] = [next(emails) if item["status"] == "completed" else None for item in result["items"]]
+            job["progress"]["stage"] = "done"
+            job["finished_at"] = time.time()
+        log.info("Generation finished", extra={"job_id": job["job_id"], "analysis_id": job["analysis_id"], "emails": len(result["emails"])})
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items() if job["finished_at"] and job["finished_at"] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return counts
+
+
+job_manager = JobManager(
+    concurrency=config.job_concurrency,
+    max_pending=config.job_max_pending,
+    retention_seconds=config.job_retention_seconds,
+)
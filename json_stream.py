@@ -0,0 +1,159 @@
+import codecs
+import json
+import re
+
+# Incremental, field-selective JSON reader for large artifacts.
+#
+# select_fields() walks the top-level object of a JSON document as it arrives
+# in chunks and only materialises the values of the requested keys; every
+# other value is skipped without being decoded or kept in memory. Peak memory
+# is therefore bounded by the chunk size plus the size of the selected values,
+# not by the size of the document.
+
+# Inside a skipped container: a complete string, a bracket, or a lone quote
+# whose string continues into the next chunk.
+_CONTAINER_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]|"')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[,}\]\s]')
+_WHITESPACE = " \t\n\r"
+
+
+class _Reader:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        # While capturing, text from `mark` onwards is part of the value being
+        # materialised; it is moved into `captured` before the buffer is trimmed.
+        self.mark = None
+        self.captured = []
+
+    def fill(self):
+        for chunk in self._chunks:
+            if isinstance(chunk, bytes):
+                chunk = self._decoder.decode(chunk)
+            if not chunk:
+                continue
+            if self.mark is not None:
+                self.captured.append(self.buf[self.mark:self.pos])
+                self.mark = 0
+            self.buf = self.buf[self.pos:] + chunk
+            self.pos = 0
+            return True
+        return False
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos}, got {self.buf[self.pos]!r}")
+        self.pos += 1
+
+    def skip_string(self):
+        # Assumes buf[pos] is the opening quote.
+        self.pos += 1
+        while True:
+            match = _STRING_SPECIAL.search(self.buf, self.pos)
+            if match is None:
+                self.pos = len(self.buf)
+            elif match.group() == '"':
+                self.pos = match.end()
+                return
+            elif match.end() < len(self.buf):
+                self.pos = match.end() + 1
+                continue
+            else:
+                # Backslash at the end of the buffer: the escaped char is in the next chunk.
+                self.pos = match.start()
+            if not self.fill():
+                raise ValueError("Unterminated string in JSON document")
+
+    def skip_value(self):
+        char = self.peek()
+        if char == '"':
+            self.skip_string()
+        elif char in "{[":
+            depth = 0
+            while True:
+                match = _CONTAINER_TOKEN.search(self.buf, self.pos)
+                if match is None:
+                    self.pos = len(self.buf)
+                    if not self.fill():
+                        raise ValueError("Unterminated container in JSON document")
+                    continue
+                token = match.group()
+                if token == '"':
+                    self.pos = match.start()
+                    self.skip_string()
+                    continue
+                self.pos = match.end()
+                if token[0] == '"':
+                    continue
+                depth += 1 if token in "{[" else -1
+                if depth == 0:
+                    return
+        else:
+            while True:
+                match = _SCALAR_END.search(self.buf, self.pos)
+                if match is not None:
+                    self.pos = match.start()
+                    return
+                self.pos = len(self.buf)
+                if not self.fill():
+                    return
+
+    def read_key(self):
+        start = self.pos
+        self.mark = start
+        self.captured = []
+        self.skip_string()
+        raw = "".join(self.captured) + self.buf[self.mark:self.pos]
+        self.mark = None
+        return json.loads(raw)
+
+    def capture_value(self):
+        self.peek()
+        self.mark = self.pos
+        self.captured = []
+        self.skip_value()
+        raw = "".join(self.captured) + self.buf[self.mark:self.pos]
+        self.mark = None
+        self.captured = []
+        return json.loads(raw)
+
+
+def select_fields(chunks, keys):
+    # `chunks` is any iterable of str/bytes (e.g. response.iter_content());
+    # returns {key: value} for the requested top-level keys that are present.
+    keys = set(keys)
+    reader = _Reader(chunks)
+    selected = {}
+
+    reader.expect("{")
+    if reader.peek() == "}":
+        return selected
+
+    while True:
+        if reader.peek() != '"':
+            raise ValueError(f"Expected object key at offset {reader.pos}")
+        key = reader.read_key()
+        reader.expect(":")
+        if key in keys:
+            selected[key] = reader.capture_value()
+        else:
+            reader.skip_value()
+
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == "}":
+            return selected
+        if separator != ",":
+            raise ValueError(f"Expected ',' or '}}' at offset {reader.pos - 1}")
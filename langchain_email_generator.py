@@ -156,136 +156,343 @@
 #-------------------------- New Code ------------------------------------- 
 
 import asyncio
-import json
-import os
-from langchain_openai import ChatOpenAI
-from langchain.schema import SystemMessage, HumanMessage
-from dotenv import load_dotenv
-from langchain_gap_analyser import run_full_pipeline
-
-load_dotenv()
-
-async def generate_email_and_subject_async(data):
-    MODEL_NAME = os.getenv("OPENROUTER_MODEL", "x-ai/grok-4-fast")
-    BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").strip()
-    API_KEY = os.getenv("OPENROUTER_API_KEY")
-
-    if not API_KEY:
-        raise ValueError("OPENROUTER_API_KEY not set in environment variables")
-
-    llm = ChatOpenAI(
-        model=MODEL_NAME,
-        base_url=BASE_URL,
-        api_key=API_KEY,
-        temperature=0.4,
-    )
-
-    SYSTEM_PROMPT = """
-                        You are an expert copywriter and sales strategist generating highly personalized cold emails for Consultadd, 
-                        a custom AI solutions company for SMBs and enterprises. Your company has the USP of rapidly deploying 
-                        tailor-made solutions for unique challenges of a company.
-
-                        Your emails must be crafted to appeal respectfully and relevantly to individuals at specific companies, taking into account their role, department, industry, and business needs while positioning Consultadd as their ideal AI transformation partner.
-                        While you are getting inputs to use a particular gap, follow the guidelines below while drafting the first email
-                        Keep the email concise with a character limit of 100 words or 250 characters max. Ensures that message is impactful, making it personalised to the person and the company he is working for.
-                        Avoid jargon and buzzwords and use simplified language.
-                        Begin with a personalized opening referencing company news, recent activity, or an industry challenge relevant to the prospect.
-                        After the opening, briefly address a potential gap very quickly, also touching upon a probable solution without giving away much information but generating curiosity to know further.
-                        Whenever mentioning Consultadd, clearly communicate the brand's central value proposition: helping companies with tailor made custom AI solutions that unlock efficiency, rapidly automate what matters, and fit their specific stage in the AI journey.
-                        Close with a clear, low-pressure CTA inviting a short meeting or a discovery call. However, it should drive curiosity. Don't make it an open ended question around whether they are interested, because you don't want no for an answer.
-                        Maintain an empowering, consultative, and approachable tone throughout.
-
-
-                        EMAIL GUIDELINES:
-                            - Keep email concise: 100 words or 250 characters max
-                            - Avoid jargon and buzzwords, use simplified language
-                            - Begin with personalized opening referencing company or industry challenge
-                            - Briefly address a potential gap and hint at solution without revealing too much (generate curiosity)
-                            - Clearly communicate Consultadd's value: tailor-made custom AI solutions that unlock efficiency, 
-                            rapidly automate what matters, and fit their specific stage in the AI journey
-                            - Close with clear, low-pressure CTA inviting short meeting or discovery call (drive curiosity, avoid open-ended questions)
-                            - Maintain empowering, consultative, and approachable tone
+import copy
+import logging
+import queue
+import time
+from config import config
+from dedup import DEDUP_ENABLED, collapse_duplicates
+from inital_analysis_data_extractor import bounded_timeout, main_extractor
+from langchain_gap_analyser import SYSTEM_PROMPT as GAP_SYSTEM_PROMPT, process_opportunity, process_opportunity_batch
+from llm_client import count_prompt_tokens, get_llm_async, invoke_llm, run_async, submit_async
+from prompt_budget import StaticPrompt, build_messages
+from readiness import readiness_watcher, resolve_max_wait_ms
+from scheduler import SchedulerQueueFull, current_schedule, scheduling
+from singleflight import SingleFlight
+from stage_store import stage_store
+from structured_output import InvalidOutput, invoke_structured, parse_items, parse_stats, validator
+from telemetry import generations, log_context, opportunities_collapsed, span
+
+log = logging.getLogger(__name__)
+
+# Concurrent generations for the same analysis_id share one extraction and,
+# when nobody needs per-stage events, one whole pipeline run.
+pipeline_flight = SingleFlight()
+extraction_flight = SingleFlight()
+
+# "two_stage": gap analysis call, then an email call per opportunity.
+# "fused": one call per opportunity returns gap analysis and email together.
+# "batched": two-stage, but GENERATION_BATCH_SIZE opportunities share each call.
+GENERATION_MODES = ("two_stage", "fused", "batched")
+GENERATION_MODE = config.generation_mode
+GENERATION_BATCH_SIZE = config.generation_batch_size
+
+# End-to-end budget for one generation. Extraction must finish within the
+# first DEADLINE_EXTRACTION_SHARE of it and gap analyses by the end of the
+# next DEADLINE_GAP_SHARE; emails get whatever is left. Anything still running
+# at the deadline is cancelled and reported per item instead of holding up
+# the emails that did finish.
+REQUEST_DEADLINE_MS = config.request_deadline_ms
+DEADLINE_EXTRACTION_SHARE = config.deadline_extraction_share
+DEADLINE_GAP_SHARE = config.deadline_gap_share
+
+
+# Subject of the placeholder email used when the model's answer is unusable;
+# such emails count as failed for regeneration.
+FALLBACK_SUBJECT = "Quick AI Insight for You"
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class StageResultsNotFound(Exception):
+    pass
+
+SYSTEM_PROMPT = """
+                    You are an expert copywriter and sales strategist generating highly personalized cold emails for Consultadd, 
+                    a custom AI solutions company for SMBs and enterprises. Your company has the USP of rapidly deploying 
+                    tailor-made solutions for unique challenges of a company.
+
+                    Your emails must be crafted to appeal respectfully and relevantly to individuals at specific companies, taking into account their role, department, industry, and business needs while positioning Consultadd as their ideal AI transformation partner.
+                    While you are getting inputs to use a particular gap, follow the guidelines below while drafting the first email
+                    Keep the email concise with a character limit of 100 words or 250 characters max. Ensures that message is impactful, making it personalised to the person and the company he is working for.
+                    Avoid jargon and buzzwords and use simplified language.
+                    Begin with a personalized opening referencing company news, recent activity, or an industry challenge relevant to the prospect.
+                    After the opening, briefly address a potential gap very quickly, also touching upon a probable solution without giving away much information but generating curiosity to know further.
+                    Whenever mentioning Consultadd, clearly communicate the brand's central value proposition: helping companies with tailor made custom AI solutions that unlock efficiency, rapidly automate what matters, and fit their specific stage in the AI journey.
+                    Close with a clear, low-pressure CTA inviting a short meeting or a discovery call. However, it should drive curiosity. Don't make it an open ended question around whether they are interested, because you don't want no for an answer.
+                    Maintain an empowering, consultative, and approachable tone throughout.
+
+
+                    EMAIL GUIDELINES:
+                        - Keep email concise: 100 words or 250 characters max
+                        - Avoid jargon and buzzwords, use simplified language
+                        - Begin with personalized opening referencing company or industry challenge
+                        - Briefly address a potential gap and hint at solution without revealing too much (generate curiosity)
+                        - Clearly communicate Consultadd's value: tailor-made custom AI solutions that unlock efficiency, 
+                        rapidly automate what matters, and fit their specific stage in the AI journey
+                        - Close with clear, low-pressure CTA inviting short meeting or discovery call (drive curiosity, avoid open-ended questions)
+                        - Maintain empowering, consultative, and approachable tone
+
+                    SPAM-FREE REQUIREMENTS:
+                        - Avoid spammy keywords tied to scams or aggressive sales tactics
+                        - Use max 1 exclamation mark if needed
+                        - No excessive punctuation or ALL CAPS
+                        - No overuse of links or suspicious URLs
+                        - Use short paragraphs with clear structure
+                        - Focus on value/benefits, not feature dumps
+                        - Conversational, professional, human-like tone
+                        - Include email signature at end
+                        - Avoid excessive numeric values
+                        - Don't keyword-stuff or repeat phrases
+                        - IMPORTANT: Do NOT add any email signature, sender name, role, or contact information. End the email right after the CTA.
+
+                        
+                    SUBJECT LINE GUIDELINES:
+                        - Create catchy, curiosity-driven subject line (6-8 words max)
+                        - Generate a Marketing Hook
+                        - Personalize with company name when possible
+                        - Avoid spam triggers (FREE, ACT NOW, !!!, etc.)
+                        - Make it relevant to their specific pain point
+                        
+                    Output must be in JSON format with keys: "subject_line" and "email_body"
+            """
+
+EMAIL_SYSTEM = StaticPrompt(SYSTEM_PROMPT)
+
+EMAIL_USER_TEMPLATE = StaticPrompt("""
+    Generate a personalized cold email for the following context:
     
-                        SPAM-FREE REQUIREMENTS:
-                            - Avoid spammy keywords tied to scams or aggressive sales tactics
-                            - Use max 1 exclamation mark if needed
-                            - No excessive punctuation or ALL CAPS
-                            - No overuse of links or suspicious URLs
-                            - Use short paragraphs with clear structure
-                            - Focus on value/benefits, not feature dumps
-                            - Conversational, professional, human-like tone
-                            - Include email signature at end
-                            - Avoid excessive numeric values
-                            - Don't keyword-stuff or repeat phrases
-                            - IMPORTANT: Do NOT add any email signature, sender name, role, or contact information. End the email right after the CTA.
+    COMPANY INFORMATION:
+    Company Name: {company_name}
+    
+    AI SOLUTION OPPORTUNITY:
+    Solution: {ai_solution}
+    
+    GAP ANALYSIS:
+    {gap_analysis}
+    
+    KEY PAIN POINTS:
+    {pain_points}
 
-                            
-                        SUBJECT LINE GUIDELINES:
-                            - Create catchy, curiosity-driven subject line (6-8 words max)
-                            - Generate a Marketing Hook
-                            - Personalize with company name when possible
-                            - Avoid spam triggers (FREE, ACT NOW, !!!, etc.)
-                            - Make it relevant to their specific pain point
-                            
-                        Output must be in JSON format with keys: "subject_line" and "email_body"
-                """
-                   
-    async def generate_for_gap(gap_item):
-        company_name = data.get("company", "")
-        ai_solution = gap_item.get("ai_solution", "")
-        gap_analysis = gap_item.get("gap_analysis", "")
-        pain_points = gap_item.get("pain_points", [])
-
-        user_prompt = f"""
-        Generate a personalized cold email for the following context:
-        
-        COMPANY INFORMATION:
-        Company Name: {company_name}
-        
-        AI SOLUTION OPPORTUNITY:
-        Solution: {ai_solution}
-        
-        GAP ANALYSIS:
-        {gap_analysis}
-        
-        KEY PAIN POINTS:
-        {chr(15).join(f"- {pp}" for pp in pain_points[:2])}
+    Generate:
+    1. A catchy, personalized subject line (6-8 words, no spam triggers)
+    2. A concise email body (max 100 words/250 characters) following all guidelines
     
-        Generate:
-        1. A catchy, personalized subject line (6-8 words, no spam triggers)
-        2. A concise email body (max 100 words/250 characters) following all guidelines
-        
-        The email should:
-        - Reference {company_name} specifically
-        - Touch on their {gap_analysis} gap/challenge without being too detailed
-        - Hint at how Consultadd's custom AI solutions can help
-        - End with a curiosity-driven CTA (not an open-ended question)
-        - Add a Hook into an email which will make recipent reply
-        
-        Output JSON format:
-        {{
-            "subject_line": "...",
-            "email_body": "..."
-        }}
-        """     
-        messages = [
-            SystemMessage(content=SYSTEM_PROMPT),
-            HumanMessage(content=user_prompt.strip())
+    The email should:
+    - Reference {company_name} specifically
+    - Touch on their {gap_analysis} gap/challenge without being too detailed
+    - Hint at how Consultadd's custom AI solutions can help
+    - End with a curiosity-driven CTA (not an open-ended question)
+    - Add a Hook into an email which will make recipent reply
+    
+    Output JSON format:
+    {{
+        "subject_line": "...",
+        "email_body": "..."
+    }}
+    """, template=True)
+
+EMAIL_BATCH_TEMPLATE = StaticPrompt("""
+    Generate one personalized cold email for EACH item below.
+
+    COMPANY INFORMATION:
+    Company Name: {company_name}
+
+{items}
+
+    For every item generate:
+    1. A catchy, personalized subject line (6-8 words, no spam triggers)
+    2. A concise email body (max 100 words/250 characters) following all guidelines
+
+    Each email should:
+    - Reference {company_name} specifically
+    - Touch on that item's gap/challenge without being too detailed
+    - Hint at how Consultadd's custom AI solutions can help
+    - End with a curiosity-driven CTA (not an open-ended question)
+    - Add a Hook into an email which will make recipent reply
+
+    Output JSON format, with exactly one entry per item and its index:
+    {{
+        "items": [
+            {{"index": 0, "subject_line": "...", "email_body": "..."}}
         ]
+    }}
+    """, template=True)
+
+EMAIL_ITEM_TEMPLATE = StaticPrompt("""
+    ### Item {index}
+    Solution: {ai_solution}
+    Gap analysis: {gap_analysis}
+    Key pain points: {pain_points}
+    """, template=True)
+
+def gap_solution(gap_item):
+    # The gap stage answers with "ai solution" (see its output format);
+    # "ai_solution" is accepted too.
+    return gap_item.get("ai solution") or gap_item.get("ai_solution") or ""
+
+def build_email_messages(company_name, gap_item):
+    pain_points = gap_item.get("pain_points", [])
+    return build_messages("email", EMAIL_SYSTEM, EMAIL_USER_TEMPLATE, {
+        "company_name": company_name,
+        "ai_solution": gap_solution(gap_item),
+        "gap_analysis": gap_item.get("gap_analysis", ""),
+        "pain_points": "\n".join(f"- {pp}" for pp in pain_points[:2])
+    })
+
+def build_email_batch_messages(company_name, gap_items):
+    items = [
+        {
+            "index": index,
+            "ai_solution": gap_solution(gap_item),
+            "gap_analysis": gap_item.get("gap_analysis", ""),
+            "pain_points": "; ".join(str(pp) for pp in gap_item.get("pain_points", [])[:2])
+        }
+        for index, gap_item in enumerate(gap_items)
+    ]
+    return build_messages("email_batch", EMAIL_SYSTEM, EMAIL_BATCH_TEMPLATE, {"company_name": company_name}, items, EMAIL_ITEM_TEMPLATE)
+
+async def generate_for_gap(llm, company_name, gap_item, fresh=False):
+    messages = build_email_messages(company_name, gap_item)
+
+    try:
+        parsed = await invoke_structured(llm, messages, "email", fresh=fresh)
+        parsed["email_body"] = parsed["email_body"].replace("\n", " ").strip()
+    except SchedulerQueueFull:
+        # Shed load, not a bad answer: see process_opportunity.
+        raise
+    except Exception as e:
+        # Never the raw answer: it is usually JSON debris, not an email.
+        log.warning("Email generation failed, using fallback: %s", e)
+        if not isinstance(e, InvalidOutput):
+            parse_stats.record("email", "fallback")
+        parsed = {
+            "subject_line": FALLBACK_SUBJECT,
+            "email_body": "Unable to generate email."
+        }
+    return parsed
+
+async def generate_for_gap_batch(llm, company_name, gap_items, fresh=False):
+    # Same contract as process_opportunity_batch: one call for the batch,
+    # individual calls only for the items the batched answer left out.
+    messages = build_email_batch_messages(company_name, gap_items)
+    info = {
+        "calls": 1,
+        "retried": 0,
+        "prompt_tokens": count_prompt_tokens(messages),
+        "unbatched_prompt_tokens": sum(count_prompt_tokens(build_email_messages(company_name, gap_item)) for gap_item in gap_items)
+    }
 
-        try:
-            response = await llm.ainvoke(messages)
-            parsed = json.loads(response.content)
-            parsed["email_body"] = parsed["email_body"].replace("\n", " ").strip()
-        except Exception as e:
-            print(f"Email generation failed: {e}")
-            parsed = {
-                "subject_line": "Quick AI Insight for You",
-                "email_body": response.content.replace("\n", " ").strip() if 'response' in locals() else "Unable to generate email."
-            }
-        return parsed
-
-    tasks = [generate_for_gap(item) for item in data.get("ai_gap_analysis", [])]
+    repaired = False
+    try:
+        response = await invoke_llm(llm, messages, fresh=fresh, validate=validator("email_batch"), stage="email_batch")
+        found, repaired = parse_items(response.content, len(gap_items), "email_batch")
+        for email in found.values():
+            email["email_body"] = email["email_body"].replace("\n", " ").strip()
+    except SchedulerQueueFull:
+        raise
+    except Exception as e:
+        log.warning("Batched email generation failed: %s", e)
+        found = {}
+
+    missing = [index for index in range(len(gap_items)) if index not in found]
+    parse_stats.record("email_batch", "repaired" if repaired else "ok", len(found))
+    parse_stats.record("email_batch", "missing", len(missing))
+    retried = await asyncio.gather(*[generate_for_gap(llm, company_name, gap_items[index], fresh=fresh) for index in missing])
+    for index, email in zip(missing, retried):
+        found[index] = email
+        info["calls"] += 1
+        info["retried"] += 1
+        info["prompt_tokens"] += count_prompt_tokens(build_email_messages(company_name, gap_items[index]))
+
+    return [found[index] for index in range(len(gap_items))], info
+
+FUSED_SYSTEM_PROMPT = GAP_SYSTEM_PROMPT + SYSTEM_PROMPT.replace(
+    'Output must be in JSON format with keys: "subject_line" and "email_body"',
+    'Output must be a single JSON object with keys: "gap_analysis", "pain_points", "subject_line" and "email_body"'
+)
+
+FUSED_SYSTEM = StaticPrompt(FUSED_SYSTEM_PROMPT)
+
+FUSED_USER_TEMPLATE = StaticPrompt("""
+    Company: {company_name}
+    AI Solution: {solution}
+    Why Need of AI Solution: {why}
+
+    Generate, in one response:
+    1. A short 'gap_analysis' (what is missing today or challenge faced)
+    2. Specific 'pain_points' that this AI solution helps to solve. Provide only 2-3 pain points it should be consise and can act as eye opener
+    3. A catchy, personalized 'subject_line' (6-8 words, no spam triggers)
+    4. A concise 'email_body' (max 100 words/250 characters) following all guidelines, built on the gap analysis and pain points above
+
+    The email should:
+    - Reference {company_name} specifically
+    - Touch on the gap/challenge without being too detailed
+    - Hint at how Consultadd's custom AI solutions can help
+    - End with a curiosity-driven CTA (not an open-ended question)
+    - Add a Hook into an email which will make recipent reply
+
+    Output JSON format:
+    {{
+    "gap_analysis": "...",
+    "pain_points": ["...", "..."],
+    "subject_line": "...",
+    "email_body": "..."
+    }}
+    """, template=True)
+
+def resolve_mode(mode):
+    mode = mode or GENERATION_MODE
+    if mode not in GENERATION_MODES:
+        raise ValueError(f"mode must be one of: {', '.join(GENERATION_MODES)}")
+    return mode
+
+def resolve_deadline_ms(deadline_ms):
+    if deadline_ms is None:
+        return REQUEST_DEADLINE_MS
+    try:
+        deadline_ms = int(deadline_ms)
+    except (TypeError, ValueError):
+        raise ValueError("deadline_ms must be a positive integer")
+    if deadline_ms <= 0:
+        raise ValueError("deadline_ms must be a positive integer")
+    return deadline_ms
+
+async def generate_fused(llm, company_name, opp, fresh=False):
+    messages = build_messages("fused", FUSED_SYSTEM, FUSED_USER_TEMPLATE, {
+        "company_name": company_name,
+        "solution": opp["solution"],
+        "why": opp["why"]
+    })
+
+    try:
+        parsed = await invoke_structured(llm, messages, "fused", fresh=fresh)
+        gap_item = {
+            "ai solution": opp.get("solution"),
+            "gap_analysis": parsed["gap_analysis"],
+            "pain_points": parsed["pain_points"]
+        }
+        email = {
+            "subject_line": parsed["subject_line"],
+            "email_body": parsed["email_body"].replace("\n", " ").strip()
+        }
+    except SchedulerQueueFull:
+        raise
+    except Exception as e:
+        # Fall back to the two-stage path for this opportunity only.
+        log.warning("Fused generation failed, using two-stage: %s", e)
+        if not isinstance(e, InvalidOutput):
+            parse_stats.record("fused", "fallback")
+        gap_item = await process_opportunity(llm, company_name, opp, fresh=fresh)
+        email = await generate_for_gap(llm, company_name, gap_item, fresh=fresh)
+    return gap_item, email
+
+async def generate_email_and_subject_async(data, fresh=False):
+    llm = await get_llm_async()
+
+    tasks = [generate_for_gap(llm, data.get("company", ""), item, fresh=fresh) for item in data.get("ai_gap_analysis", [])]
     emails_output = await asyncio.gather(*tasks)
 
     return {
@@ -293,12 +500,326 @@ async def generate_email_and_subject_async(data):
         "emails": emails_output
     }
 
-def generate_email_and_subject(data):
-    return asyncio.run(generate_email_and_subject_async(data))
+def generate_email_and_subject(data, fresh=False):
+    return run_async(generate_email_and_subject_async(data, fresh=fresh))
+
+async def run_email_generation_pipeline_async(analysis_id, on_event=None, fresh=False, mode=None, deadline_ms=None, priority=None, tenant=None, max_wait_ms=None,
+                                              wait_in_deadline=True):
+    mode = resolve_mode(mode)
+    deadline_ms = resolve_deadline_ms(deadline_ms)
+    max_wait_ms = resolve_max_wait_ms(max_wait_ms)
+    started = asyncio.get_running_loop().time()
+    # Every log line and span below (including the extractor thread and the
+    # per-item tasks) carries the analysis_id and mode, and every LLM call is
+    # scheduled under `priority`, sharing fairly with other tenants (by
+    # default each analysis_id is its own tenant). Only callers of the same
+    # priority class share a generation, so an interactive request never ends
+    # up waiting on a batch run's queue position.
+    with log_context(analysis_id=analysis_id, mode=mode), scheduling(priority, tenant or analysis_id), span("pipeline"):
+        # An initial analysis that is still running is waited for, up to
+        # max_wait_ms. With wait_in_deadline (callers holding a connection
+        # open) the wait is part of the extraction share of the deadline;
+        # background jobs wait first and then get the whole budget.
+        def waiting(status_data):
+            if on_event:
+                on_event({"event": "waiting", "status": status_data.get("overall_status") or status_data.get("status")})
+
+        limit = deadline_ms / 1000 * DEADLINE_EXTRACTION_SHARE if wait_in_deadline else None
+        with span("readiness_wait"):
+            status_data = await readiness_watcher.wait_ready(analysis_id, max_wait=max_wait_ms / 1000, on_pending=waiting, limit=limit)
+        if not wait_in_deadline:
+            started = asyncio.get_running_loop().time()
+        if on_event is None:
+            key = (analysis_id, fresh, mode, deadline_ms, current_schedule()[0])
+            result = await pipeline_flight.do(key, lambda: _run_pipeline(analysis_id, None, fresh, mode, deadline_ms, status_data, started))
+            return copy.deepcopy(result)
+        return await _run_pipeline(analysis_id, on_event, fresh, mode, deadline_ms, status_data, started)
+
+async def _run_pipeline(analysis_id, on_event, fresh, mode, deadline_ms, status_data=None, started=None):
+    def emit(event, **payload):
+        if on_event:
+            on_event({"event": event, **payload})
+
+    # Deadlines count from `started` (when the caller's request began).
+    loop = asyncio.get_running_loop()
+    started = loop.time() if started is None else started
+    budget = deadline_ms / 1000
+    extraction_deadline = started + budget * DEADLINE_EXTRACTION_SHARE
+    gap_deadline = started + budget * (DEADLINE_EXTRACTION_SHARE + DEADLINE_GAP_SHARE)
+    final_deadline = started + budget
+
+    def remaining(deadline):
+        return max(0.0, deadline - loop.time())
+
+    # main_extractor does blocking HTTP; keep it off the shared event loop.
+    # Its own request timeouts are capped by the extraction budget too, so the
+    # worker thread does not outlive the request by much.
+    timeout = bounded_timeout(remaining(extraction_deadline))
+    try:
+        with span("extraction"):
+            data = await asyncio.wait_for(
+                extraction_flight.do(analysis_id, lambda: asyncio.to_thread(main_extractor, analysis_id, timeout, status_data)),
+                remaining(extraction_deadline)
+            )
+    except asyncio.TimeoutError:
+        generations.inc(mode=mode, outcome="extraction_timeout")
+        raise DeadlineExceeded(f"Initial analysis for {analysis_id} was not fetched within the {deadline_ms} ms deadline")
+    data = copy.deepcopy(data)
+    company_name = data.get("company", "")
+    opportunities = data.get("ai_opportunities", [])
+    # Near-identical hypotheses would cost a gap and an email call each and
+    # give reps look-alike drafts; only one per cluster goes to the LLM.
+    collapsed = []
+    if DEDUP_ENABLED:
+        opportunities, collapsed = collapse_duplicates(opportunities)
+        if collapsed:
+            opportunities_collapsed.inc(len(collapsed))
+            log.info("Collapsed near-duplicate opportunities", extra={"collapsed": len(collapsed), "kept": len(opportunities)})
+    emit("extraction", company=company_name, total=len(opportunities), collapsed=collapsed)
+
+    llm = await get_llm_async()
+
+    # index -> (gap_item, email) for finished opportunities, index -> gap_item
+    # as soon as a gap analysis is done, and the stage each unfinished one is
+    # in, for the per-item status.
+    results = {}
+    gaps = {}
+    stages = {index: "gap_analysis" for index in range(len(opportunities))}
+
+    # Each opportunity flows gap -> email on its own, so one slow gap
+    # analysis only delays its own email instead of the whole batch.
+    async def pipeline_opportunity(index, opp):
+        if mode == "fused":
+            stages[index] = "fused"
+            gap_item, email = await generate_fused(llm, company_name, opp, fresh=fresh)
+            gaps[index] = gap_item
+            emit("gap_analysis", index=index, gap_analysis=gap_item)
+        else:
+            gap_item = await asyncio.wait_for(
+                process_opportunity(llm, company_name, opp, fresh=fresh),
+                remaining(gap_deadline)
+            )
+            gaps[index] = gap_item
+            stages[index] = "email"
+            emit("gap_analysis", index=index, gap_analysis=gap_item)
+            email = await generate_for_gap(llm, company_name, gap_item, fresh=fresh)
+        results[index] = (gap_item, email)
+        emit("email", index=index, email=email)
+
+    # Batched mode: each chunk of GENERATION_BATCH_SIZE opportunities makes
+    # one gap call and then one email call, chunks running side by side.
+    batch_info = []
+
+    async def pipeline_batch(start, opps):
+        gap_items, gap_info = await asyncio.wait_for(
+            process_opportunity_batch(llm, company_name, opps, fresh=fresh),
+            remaining(gap_deadline)
+        )
+        batch_info.append(gap_info)
+        for offset, gap_item in enumerate(gap_items):
+            gaps[start + offset] = gap_item
+            stages[start + offset] = "email"
+            emit("gap_analysis", index=start + offset, gap_analysis=gap_item)
+        emails, email_info = await generate_for_gap_batch(llm, company_name, gap_items, fresh=fresh)
+        batch_info.append(email_info)
+        for offset, email in enumerate(emails):
+            results[start + offset] = (gap_items[offset], email)
+            emit("email", index=start + offset, email=email)
+
+    batch_started = time.perf_counter()
+    item_tasks = {}
+    if mode == "batched":
+        size = max(1, GENERATION_BATCH_SIZE)
+        for start in range(0, len(opportunities), size):
+            task = asyncio.ensure_future(pipeline_batch(start, opportunities[start:start + size]))
+            for index in range(start, min(start + size, len(opportunities))):
+                item_tasks[index] = task
+    else:
+        for index, opp in enumerate(opportunities):
+            item_tasks[index] = asyncio.ensure_future(pipeline_opportunity(index, opp))
+
+    tasks = set(item_tasks.values())
+    pending = set(tasks)
+    if tasks:
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=remaining(final_deadline), return_when=asyncio.FIRST_EXCEPTION)
+                if not done or any(not task.cancelled() and isinstance(task.exception(), SchedulerQueueFull) for task in done):
+                    # Deadline, or load shed: no point finishing the rest.
+                    break
+        finally:
+            # Also reached when the caller itself is cancelled (e.g. a closed
+            # stream): nothing should keep spending tokens after that.
+            for task in tasks:
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    items = []
+    errors = []
+    for index in range(len(opportunities)):
+        task = item_tasks[index]
+        if index in results:
+            items.append({"index": index, "status": "completed"})
+        elif task in pending or task.cancelled() or isinstance(task.exception(), asyncio.TimeoutError):
+            items.append({"index": index, "status": "timed_out", "stage": stages[index]})
+        else:
+            errors.append(task.exception())
+            items.append({"index": index, "status": "failed", "stage": stages[index], "error": str(task.exception())})
+
+    shed = [error for error in errors if isinstance(error, SchedulerQueueFull)]
+    if shed:
+        # The scheduler turned calls away: the whole generation is rejected
+        # (503) rather than stored with holes the caller would have to retry.
+        generations.inc(mode=mode, outcome="shed")
+        raise shed[0]
+
+    if errors and not results:
+        # Nothing usable came back and it was not for lack of time (bad key,
+        # provider down): surface the error as before.
+        generations.inc(mode=mode, outcome="failed")
+        raise errors[0]
+
+    completed = [results[index] for index in sorted(results)]
+    data["ai_gap_analysis"] = [gap_item for gap_item, _ in completed]
+    result = {
+        "company": company_name,
+        "emails": [email for _, email in completed],
+        "items": items,
+        "deadline_ms": deadline_ms,
+        "deadline_exceeded": any(item["status"] == "timed_out" for item in items),
+        "collapsed": collapsed
+    }
+    generations.inc(mode=mode, outcome="partial" if result["deadline_exceeded"] else "completed")
+    if result["deadline_exceeded"]:
+        log.warning("Deadline hit, returning partial results", extra={
+            "deadline_ms": deadline_ms, "emails_completed": len(completed), "opportunities": len(opportunities)
+        })
+
+    # Keep every stage's output so single emails can be regenerated later
+    # without redoing extraction or the other opportunities. The SQLite
+    # write runs on a worker thread so its commit does not stall the loop.
+    extraction = {key: value for key, value in data.items() if key != "ai_gap_analysis"}
+    await asyncio.to_thread(stage_store.save, analysis_id, {
+        "company": company_name,
+        "mode": mode,
+        "extraction": extraction,
+        "collapsed": collapsed,
+        "items": [
+            {
+                **item,
+                "opportunity": opportunities[item["index"]],
+                "gap_analysis": gaps.get(item["index"]),
+                "email": results[item["index"]][1] if item["index"] in results else None
+            }
+            for item in items
+        ]
+    })
+
+    if mode == "batched":
+        prompt_tokens = sum(info["prompt_tokens"] for info in batch_info)
+        unbatched_prompt_tokens = sum(info["unbatched_prompt_tokens"] for info in batch_info)
+        result["batch_stats"] = {
+            "batch_size": GENERATION_BATCH_SIZE,
+            "llm_calls": sum(info["calls"] for info in batch_info),
+            "unbatched_llm_calls": 2 * len(opportunities),
+            "individual_retries": sum(info["retried"] for info in batch_info),
+            "prompt_tokens": prompt_tokens,
+            "unbatched_prompt_tokens": unbatched_prompt_tokens,
+            "prompt_tokens_saved": unbatched_prompt_tokens - prompt_tokens,
+            "elapsed_ms": round((time.perf_counter() - batch_started) * 1000)
+        }
+        log.info("Batched run finished", extra=result["batch_stats"])
+    return result
+
+def failed_indices(record):
+    # Items that timed out, failed, or only got the fallback email.
+    return [
+        index for index, item in enumerate(record["items"])
+        if item["email"] is None or item["email"].get("subject_line") == FALLBACK_SUBJECT
+    ]
+
+def stored_result(record):
+    # Same shape as a pipeline result, rebuilt from a stage_store record.
+    stage_keys = ("opportunity", "gap_analysis", "email")
+    return {
+        "company": record["company"],
+        "emails": [item["email"] for item in record["items"] if item["status"] == "completed"],
+        "items": [{key: value for key, value in item.items() if key not in stage_keys} for item in record["items"]],
+        "collapsed": record.get("collapsed", [])
+    }
+
+async def regenerate_emails_async(analysis_id, indices=None, failed_only=False, priority=None, tenant=None):
+    # Regenerates the emails at `indices` (or, with failed_only, every item
+    # failed_indices reports) from the stored stage results: one email call
+    # per item, plus a gap call only where the gap analysis never finished.
+    record = await asyncio.to_thread(stage_store.get, analysis_id)
+    if record is None:
+        raise StageResultsNotFound(f"No stored results for {analysis_id}; run a full generation first")
+
+    if failed_only:
+        indices = failed_indices(record)
+    # Indices come straight from request JSON: a bare number, a string or
+    # true (a bool is an int to isinstance) must be a 400, not a 500 or item 1.
+    if indices is not None and not isinstance(indices, (list, tuple)):
+        raise ValueError("indices must be a list of integers")
+    for index in indices or []:
+        if isinstance(index, bool) or not isinstance(index, int) or not 0 <= index < len(record["items"]):
+            raise ValueError(f"index must be an integer between 0 and {len(record['items']) - 1}")
+    indices = sorted(set(indices or []))
+
+    llm = await get_llm_async()
+    company_name = record["company"]
+
+    async def regenerate(index):
+        item = record["items"][index]
+        gap_item = item["gap_analysis"]
+        if gap_item is None:
+            gap_item = await process_opportunity(llm, company_name, item["opportunity"])
+        # fresh: the point is a different draft, not the cached one.
+        email = await generate_for_gap(llm, company_name, gap_item, fresh=True)
+        return index, {"index": index, "status": "completed", "opportunity": item["opportunity"], "gap_analysis": gap_item, "email": email}
+
+    with log_context(analysis_id=analysis_id), scheduling(priority, tenant or analysis_id), span("regenerate"):
+        updates = dict(await asyncio.gather(*[regenerate(index) for index in indices]))
+    if updates:
+        record = await asyncio.to_thread(stage_store.update_items, analysis_id, updates) or record
+
+    result = stored_result(record)
+    result["regenerated"] = indices
+    return result
+
+def regenerate_emails(analysis_id, indices=None, failed_only=False, priority=None, tenant=None):
+    return run_async(regenerate_emails_async(analysis_id, indices=indices, failed_only=failed_only, priority=priority, tenant=tenant))
 
-def run_email_generation_pipeline(analysis_id):
-    enriched_data = run_full_pipeline(analysis_id)
-    result = generate_email_and_subject(enriched_data)
-    print(result)
+def run_email_generation_pipeline(analysis_id, fresh=False, on_event=None, mode=None, deadline_ms=None, priority=None, tenant=None, max_wait_ms=None,
+                                  wait_in_deadline=True):
+    result = run_async(run_email_generation_pipeline_async(analysis_id, on_event=on_event, fresh=fresh, mode=mode, deadline_ms=deadline_ms, priority=priority, tenant=tenant,
+                                                           max_wait_ms=max_wait_ms, wait_in_deadline=wait_in_deadline))
+    log.info("Generation finished", extra={"analysis_id": analysis_id, "emails": len(result["emails"])})
     return result
 
+def iter_email_generation_events(analysis_id, fresh=False, mode=None, deadline_ms=None, priority=None, tenant=None, max_wait_ms=None):
+    # Runs the pipeline on the shared event loop and yields its stage events
+    # as they happen, finishing with a "done" (or "error") event.
+    events = queue.Queue()
+
+    def finished(future):
+        if future.cancelled():
+            return
+        try:
+            events.put({"event": "done", "result": future.result()})
+        except Exception as e:
+            events.put({"event": "error", "error": str(e)})
+
+    future = submit_async(run_email_generation_pipeline_async(analysis_id, on_event=events.put, fresh=fresh, mode=mode, deadline_ms=deadline_ms, priority=priority, tenant=tenant, max_wait_ms=max_wait_ms))
+    future.add_done_callback(finished)
+
+    try:
+        while True:
+            event = events.get()
+            yield event
+            if event["event"] in ("done", "error"):
+                break
+    finally:
+        # Client went away mid-stream: stop paying for the remaining calls.
+        future.cancel()
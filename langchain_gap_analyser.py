@@ -84,86 +84,153 @@
 
 #------------------------------ New Code --------------------------------------# 
 
+
 # langchain_gap_analyzer.py
 import asyncio
-import json
-import os
-from langchain_openai import ChatOpenAI
-from langchain.schema import SystemMessage, HumanMessage
-from dotenv import load_dotenv
+import logging
 from inital_analysis_data_extractor import main_extractor
-
-load_dotenv()
-
-async def generate_gap_analysis_async(data):
-    MODEL_NAME = os.getenv("OPENROUTER_MODEL", "x-ai/grok-4-fast")
-    BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").strip()  # ⚠️ strip whitespace!
-    API_KEY = os.getenv("OPENROUTER_API_KEY")
-
-    if not API_KEY:
-        raise ValueError("OPENROUTER_API_KEY not set in environment variables")
-
-    llm = ChatOpenAI(
-        model=MODEL_NAME,
-        base_url=BASE_URL,  # Use base_url (not openai_api_base in newer versions)
-        api_key=API_KEY,
-        temperature=0.4,
-    )
-
-    SYSTEM_PROMPT = """
-                        You are an expert in AI transformation for all the industries.
-                        Generate concise and relevant 'gap analysis' and 'pain points' for each AI solution.
-                        Each output must be in JSON format and directly relate to the provided solution and company context.
-                        Keep it short, professional, and insightful. It should have a hook so that can helpful for sales executive to pitch the painpoints
-                        Provide only 2-3 pain points it should be consise and can act as eye opener
-                    """
-
-    async def process_opportunity(opp):
-        user_prompt = f"""
-        Company: {data.get('company')}
-        AI Solution: {opp["solution"]}
-        Why Need of AI Solution: {opp['why']}
-
-        Generate:
-        1. A short 'gap_analysis' (what is missing today or challenge faced)
-        2. Specific 'pain_points' that this AI solution helps to solve. Provide only 2-3 pain points it should be consise and can act as eye opener
-
-        Output JSON format:
-        {{
-        "ai solution": "...",
-        "gap_analysis": "...",
-        "pain_points": ["...", "..."]
-        }}
-        """
-
-        messages = [
-            SystemMessage(content=SYSTEM_PROMPT),
-            HumanMessage(content=user_prompt.strip())
-        ]
-
-        try:
-            response = await llm.ainvoke(messages)
-            parsed = json.loads(response.content)
-        except Exception as e:
-            print(f"LLM call failed: {e}")
-            parsed = {
-                "ai solution": opp.get("solution"),
-                "gap_analysis": getattr(response, 'content', 'N/A').strip(),
-                "pain_points": []
-            }
-        return parsed
-
-    tasks = [process_opportunity(opp) for opp in data.get("ai_opportunities", [])]
+from llm_client import count_prompt_tokens, get_llm_async, invoke_llm, run_async
+from prompt_budget import StaticPrompt, build_messages
+from scheduler import SchedulerQueueFull
+from structured_output import InvalidOutput, invoke_structured, parse_items, parse_stats, validator
+
+log = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = """
+                    You are an expert in AI transformation for all the industries.
+                    Generate concise and relevant 'gap analysis' and 'pain points' for each AI solution.
+                    Each output must be in JSON format and directly relate to the provided solution and company context.
+                    Keep it short, professional, and insightful. It should have a hook so that can helpful for sales executive to pitch the painpoints
+                    Provide only 2-3 pain points it should be consise and can act as eye opener
+                """
+
+GAP_SYSTEM = StaticPrompt(SYSTEM_PROMPT)
+
+GAP_USER_TEMPLATE = StaticPrompt("""
+    Company: {company_name}
+    AI Solution: {solution}
+    Why Need of AI Solution: {why}
+
+    Generate:
+    1. A short 'gap_analysis' (what is missing today or challenge faced)
+    2. Specific 'pain_points' that this AI solution helps to solve. Provide only 2-3 pain points it should be consise and can act as eye opener
+
+    Output JSON format:
+    {{
+    "ai solution": "...",
+    "gap_analysis": "...",
+    "pain_points": ["...", "..."]
+    }}
+    """, template=True)
+
+GAP_BATCH_TEMPLATE = StaticPrompt("""
+    Company: {company_name}
+
+    For EACH item below generate:
+    1. A short 'gap_analysis' (what is missing today or challenge faced)
+    2. Specific 'pain_points' that this AI solution helps to solve. Provide only 2-3 pain points it should be consise and can act as eye opener
+
+{items}
+
+    Output JSON format, with exactly one entry per item and its index:
+    {{
+    "items": [
+        {{"index": 0, "ai solution": "...", "gap_analysis": "...", "pain_points": ["...", "..."]}}
+    ]
+    }}
+    """, template=True)
+
+GAP_ITEM_TEMPLATE = StaticPrompt("""
+    ### Item {index}
+    AI Solution: {solution}
+    Why Need of AI Solution: {why}
+    """, template=True)
+
+def build_gap_messages(company_name, opp):
+    return build_messages("gap", GAP_SYSTEM, GAP_USER_TEMPLATE, {
+        "company_name": company_name,
+        "solution": opp["solution"],
+        "why": opp["why"]
+    })
+
+def build_gap_batch_messages(company_name, opps):
+    items = [
+        {"index": index, "solution": opp["solution"], "why": opp["why"]}
+        for index, opp in enumerate(opps)
+    ]
+    return build_messages("gap_batch", GAP_SYSTEM, GAP_BATCH_TEMPLATE, {"company_name": company_name}, items, GAP_ITEM_TEMPLATE)
+
+async def process_opportunity(llm, company_name, opp, fresh=False):
+    messages = build_gap_messages(company_name, opp)
+
+    try:
+        parsed = await invoke_structured(llm, messages, "gap", fresh=fresh)
+        parsed.setdefault("ai solution", opp.get("solution"))
+    except SchedulerQueueFull:
+        # Shed load, not a bad answer: the request fails with 503 instead of
+        # returning placeholders.
+        raise
+    except Exception as e:
+        log.warning("Gap analysis failed, using fallback: %s", e)
+        if not isinstance(e, InvalidOutput):
+            parse_stats.record("gap", "fallback")
+        # The email stage can still work from the hypothesis itself.
+        parsed = {
+            "ai solution": opp.get("solution"),
+            "gap_analysis": opp.get("why") or "N/A",
+            "pain_points": []
+        }
+    return parsed
+
+async def process_opportunity_batch(llm, company_name, opps, fresh=False):
+    # One call for the whole batch; only items missing from (or malformed in)
+    # the answer are re-requested one by one. Returns (results, batch_info).
+    messages = build_gap_batch_messages(company_name, opps)
+    info = {
+        "calls": 1,
+        "retried": 0,
+        "prompt_tokens": count_prompt_tokens(messages),
+        "unbatched_prompt_tokens": sum(count_prompt_tokens(build_gap_messages(company_name, opp)) for opp in opps)
+    }
+
+    repaired = False
+    try:
+        response = await invoke_llm(llm, messages, fresh=fresh, validate=validator("gap_batch"), stage="gap_batch")
+        found, repaired = parse_items(response.content, len(opps), "gap_batch")
+        for index, parsed in found.items():
+            parsed.setdefault("ai solution", opps[index].get("solution"))
+    except SchedulerQueueFull:
+        raise
+    except Exception as e:
+        log.warning("Batched gap analysis failed: %s", e)
+        found = {}
+
+    missing = [index for index in range(len(opps)) if index not in found]
+    parse_stats.record("gap_batch", "repaired" if repaired else "ok", len(found))
+    parse_stats.record("gap_batch", "missing", len(missing))
+    retried = await asyncio.gather(*[process_opportunity(llm, company_name, opps[index], fresh=fresh) for index in missing])
+    for index, parsed in zip(missing, retried):
+        found[index] = parsed
+        info["calls"] += 1
+        info["retried"] += 1
+        info["prompt_tokens"] += count_prompt_tokens(build_gap_messages(company_name, opps[index]))
+
+    return [found[index] for index in range(len(opps))], info
+
+async def generate_gap_analysis_async(data, fresh=False):
+    llm = await get_llm_async()
+
+    tasks = [process_opportunity(llm, data.get("company"), opp, fresh=fresh) for opp in data.get("ai_opportunities", [])]
     results = await asyncio.gather(*tasks)
 
     data["ai_gap_analysis"] = results
     return data
 
-def generate_gap_analysis(data):
-    return asyncio.run(generate_gap_analysis_async(data))
+def generate_gap_analysis(data, fresh=False):
+    return run_async(generate_gap_analysis_async(data, fresh=fresh))
 
-def run_full_pipeline(analysis_id):
+def run_full_pipeline(analysis_id, fresh=False):
     output = main_extractor(analysis_id)
-    enriched_output = generate_gap_analysis(output)
-    print(enriched_output)
+    enriched_output = generate_gap_analysis(output, fresh=fresh)
+    log.debug("Gap analysis finished", extra={"analysis_id": analysis_id, "gap_analyses": len(enriched_output["ai_gap_analysis"])})
     return enriched_output
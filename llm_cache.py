@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import config
+
+
+class LLMCache:
+    # Content-addressed cache for LLM completions: the key is a hash of
+    # (model, temperature, system prompt, user prompt), so identical prompts
+    # share one entry no matter which request or analysis produced them.
+    # An in-memory LRU sits in front of a SQLite file; both honour the TTL,
+    # and the disk store is trimmed to `max_disk_entries` least recently used.
+    # On the shared event loop use aget/aset: memory hits are answered inline
+    # and only the SQLite work goes to a worker thread, under its own lock so
+    # a slow commit never holds up a memory lookup.
+    def __init__(self, path, ttl_seconds=86400, max_memory_entries=1024, max_disk_entries=20000, enabled=True):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.enabled = enabled
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._writes_since_trim = 0
+
+    @staticmethod
+    def make_key(model, temperature, system_prompt, user_prompt):
+        raw = json.dumps([model, temperature, system_prompt, user_prompt], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            # WAL with synchronous=NORMAL: a commit appends to the log instead
+            # of fsyncing the database; a crash can lose the last few entries,
+            # which is fine for a cache.
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, content TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+            self._db.commit()
+        return self._db
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        content = self._get_memory(key)
+        if content is None:
+            content = self._get_disk(key)
+        return content
+
+    async def aget(self, key):
+        if not self.enabled:
+            return None
+        content = self._get_memory(key)
+        if content is None:
+            content = await asyncio.to_thread(self._get_disk, key)
+        return content
+
+    def set(self, key, content):
+        if not self.enabled:
+            return
+        now = self._set_memory(key, content)
+        self._set_disk(key, content, now)
+
+    async def aset(self, key, content):
+        if not self.enabled:
+            return
+        now = self._set_memory(key, content)
+        await asyncio.to_thread(self._set_disk, key, content, now)
+
+    def _get_memory(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                content, created_at = entry
+                if now - created_at < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return content
+                del self._memory[key]
+        return None
+
+    def _get_disk(self, key):
+        now = time.time()
+        with self._db_lock:
+            db = self._connection()
+            row = db.execute("SELECT content, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] < self.ttl_seconds:
+                db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                db.commit()
+        with self._lock:
+            if row is not None and now - row[1] < self.ttl_seconds:
+                self._remember(key, row[0], row[1])
+                self.disk_hits += 1
+                return row[0]
+            self.misses += 1
+            return None
+
+    def _set_memory(self, key, content):
+        now = time.time()
+        with self._lock:
+            self._remember(key, content, now)
+        return now
+
+    def _set_disk(self, key, content, now):
+        with self._db_lock:
+            db = self._connection()
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, content, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, content, now, now)
+            )
+            db.commit()
+            self.writes += 1
+
+            self._writes_since_trim += 1
+            if self._writes_since_trim >= 100:
+                self._writes_since_trim = 0
+                self._trim_disk(now)
+
+    def _remember(self, key, content, created_at):
+        self._memory[key] = (content, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _trim_disk(self, now):
+        # Called with _db_lock held.
+        db = self._connection()
+        expired = db.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+        overflow = db.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        ).rowcount
+        db.commit()
+        with self._lock:
+            self.evictions += expired + overflow
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "memory_entries": len(self._memory),
+        }
+
+
+cache = LLMCache(
+    path=config.llm_cache_path,
+    ttl_seconds=config.llm_cache_ttl_seconds,
+    max_memory_entries=config.llm_cache_memory_entries,
+    max_disk_entries=config.llm_cache_disk_entries,
+    enabled=config.llm_cache_enabled,
+)
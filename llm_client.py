@@ -0,0 +1,326 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from config import config
+from hedging import hedger
+from llm_cache import cache
+from prompt_budget import count_tokens, load_tokenizer, prompt_stats
+from rate_limiter import limiter
+from scheduler import current_schedule
+from singleflight import SingleFlight
+from telemetry import llm_requests, llm_tokens, span
+
+log = logging.getLogger(__name__)
+
+# One ChatOpenAI per (model, base_url, temperature) for the whole process, so
+# the underlying HTTP connection pool to OpenRouter is reused across requests
+# and stages instead of being rebuilt (with fresh TLS handshakes) every time.
+_clients = {}
+_clients_lock = threading.Lock()
+
+# All async LLM work runs on a single long-lived event loop living in a daemon
+# thread. The pooled async connections are bound to the loop that opened them,
+# so sharing clients only works if the loop is shared too.
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+# Identical prompts already in flight (double-clicks, teammates opening the
+# same account) share one provider call - within one priority class, so an
+# interactive call never waits behind a batch call's queue position.
+llm_flight = SingleFlight()
+
+# Every prompt asks for a JSON object, so with LLM_JSON_MODE calls also send
+# response_format=json_object. OpenRouter forwards it to providers that
+# support it; a model whose provider rejects it is remembered and asked
+# without it from then on.
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+_json_mode_unsupported = set()
+# Provider error text naming the JSON mode parameter.
+JSON_MODE_ERROR_MARKERS = ("response_format", "json_object", "json mode", "json_mode")
+
+
+def get_llm(model=None, base_url=None, temperature=0.4):
+    MODEL_NAME = model or config.openrouter_model
+    BASE_URL = (base_url or config.openrouter_base_url).strip()
+    key = (MODEL_NAME, BASE_URL, temperature)
+
+    with _clients_lock:
+        llm = _clients.get(key)
+        if llm is None:
+            API_KEY = config.openrouter_api_key
+            if not API_KEY:
+                raise ValueError("OPENROUTER_API_KEY not set in environment variables")
+
+            # langchain_openai (and openai under it) is most of this service's
+            # import time, so it is loaded with the first client, not at import.
+            # So is the tokenizer, which may have to download its encoding:
+            # every prompt is built after a get_llm, and get_llm_async runs
+            # this off the shared loop.
+            from langchain_openai import ChatOpenAI
+            load_tokenizer()
+            llm = ChatOpenAI(
+                model=MODEL_NAME,
+                base_url=BASE_URL,
+                api_key=API_KEY,
+                temperature=temperature,
+                # Retries (and 429 backoff) are owned by rate_limiter.limiter.
+                max_retries=0,
+                # Backstop for a single stuck call; request deadlines are
+                # enforced by the pipeline on top of this.
+                timeout=config.llm_timeout_seconds,
+            )
+            _clients[key] = llm
+        return llm
+
+
+async def get_llm_async(model=None, base_url=None, temperature=0.4):
+    # get_llm for coroutines on the shared loop: building the first client
+    # imports langchain_openai (a couple of seconds), which would stall every
+    # in-flight request if done on the loop itself.
+    key = ((model or config.openrouter_model), (base_url or config.openrouter_base_url).strip(), temperature)
+    llm = _clients.get(key)
+    if llm is not None:
+        return llm
+    return await asyncio.to_thread(get_llm, model, base_url, temperature)
+
+
+def count_prompt_tokens(messages):
+    # Local estimate of the prompt size (tiktoken, or chars/4 without it).
+    return sum(count_tokens(message.content) for message in messages)
+
+
+def estimate_tokens(messages):
+    # Prompt estimate plus the expected completion, for rate limiting.
+    return count_prompt_tokens(messages) + config.llm_expected_completion_tokens
+
+
+def usage_tokens(response):
+    usage = getattr(response, "usage_metadata", None) or {}
+    return usage.get("total_tokens")
+
+
+def response_tokens(messages, response):
+    # (prompt, completion) tokens as reported by the provider, falling back
+    # to the chars/4 estimate when it does not send usage.
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens")
+    completion_tokens = usage.get("output_tokens")
+    if prompt_tokens is None:
+        prompt_tokens = count_prompt_tokens(messages)
+    if completion_tokens is None:
+        completion_tokens = len(response.content) // 4
+    return prompt_tokens, completion_tokens
+
+
+def is_json_object(content):
+    try:
+        return isinstance(json.loads(content), dict)
+    except (TypeError, ValueError):
+        return False
+
+
+async def invoke_llm(llm, messages, fresh=False, validate=is_json_object, stage="llm"):
+    # Every OpenRouter call goes through here so the process-wide limiter
+    # and the response cache see all of them, whichever module or request
+    # they come from. `fresh` skips the cache lookup (the new answer still
+    # replaces the cached one); only answers passing `validate` are stored,
+    # so a malformed reply is never replayed.
+    system_prompt = "\n".join(m.content for m in messages if m.type == "system")
+    user_prompt = "\n".join(m.content for m in messages if m.type != "system")
+    key = cache.make_key(llm.model_name, llm.temperature, system_prompt, user_prompt)
+
+    if not fresh:
+        cached = await cache.aget(key)
+        if cached is not None:
+            from langchain_core.messages import AIMessage
+            llm_requests.inc(stage=stage, source="cache")
+            return AIMessage(content=cached)
+
+    async def call():
+        # `stage` (gap, email, fused, ...) labels the span and token counters.
+        with span(f"llm_{stage}", model=llm.model_name) as fields:
+            response = await invoke_hedged(llm, messages, validate)
+            prompt_tokens, completion_tokens = response_tokens(messages, response)
+            fields.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        llm_requests.inc(stage=stage, source="provider")
+        prompt_stats.record(messages)
+        llm_tokens.inc(prompt_tokens, stage=stage, type="prompt")
+        llm_tokens.inc(completion_tokens, stage=stage, type="completion")
+        if validate is None or validate(response.content):
+            await cache.aset(key, response.content)
+        return response
+
+    return await llm_flight.do((key, current_schedule()[0]), call)
+
+
+def rejects_json_mode(error):
+    # Only a 400 about response_format means the model lacks JSON mode;
+    # context-length and other bad requests must not turn it off for good.
+    if getattr(error, "status_code", None) != 400:
+        return False
+    detail = f"{error} {getattr(error, 'body', '')}".lower()
+    return any(marker in detail for marker in JSON_MODE_ERROR_MARKERS)
+
+
+async def _attempt(llm, messages):
+    model = llm.model_name
+    if config.llm_json_mode and model not in _json_mode_unsupported:
+        try:
+            return await limiter.run(lambda: llm.ainvoke(messages, response_format=JSON_RESPONSE_FORMAT),
+                                     estimate_tokens(messages), usage_tokens)
+        except Exception as e:
+            if not rejects_json_mode(e):
+                raise
+            log.warning("Model rejected JSON mode, continuing without it", extra={"model": model, "error": str(e)})
+            _json_mode_unsupported.add(model)
+    return await limiter.run(lambda: llm.ainvoke(messages), estimate_tokens(messages), usage_tokens)
+
+
+def runtime_stats():
+    # What this module keeps alive for the whole process: one client per
+    # (model, base_url, temperature) and the shared loop with its tasks.
+    loop = _loop
+    running = loop is not None and loop.is_running()
+    return {
+        "clients": len(_clients),
+        "loop_running": running,
+        "loop_tasks": len(asyncio.all_tasks(loop)) if running else 0,
+    }
+
+
+def json_mode_stats():
+    return {"enabled": config.llm_json_mode, "unsupported_models": sorted(_json_mode_unsupported)}
+
+
+async def invoke_hedged(llm, messages, validate=is_json_object):
+    # If the call outlives the hedge deadline (a high percentile of recent
+    # latencies for this model), fire a duplicate - to HEDGE_FALLBACK_MODEL
+    # when configured - and keep whichever returns valid output first; the
+    # other attempt is cancelled.
+    model = llm.model_name
+    hedger.calls += 1
+    deadline = hedger.deadline(model)
+    start = time.perf_counter()
+    primary = asyncio.ensure_future(_attempt(llm, messages))
+
+    if deadline is None:
+        response = await primary
+        hedger.record(model, time.perf_counter() - start)
+        return response
+
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=deadline)
+    except asyncio.CancelledError:
+        # asyncio.wait leaves its tasks running; a cancelled caller must not.
+        primary.cancel()
+        raise
+    if done:
+        response = primary.result()
+        hedger.record(model, time.perf_counter() - start)
+        return response
+
+    hedger.hedged += 1
+    hedge_llm = get_llm(model=hedger.fallback_model, temperature=llm.temperature) if hedger.fallback_model else llm
+    hedge_start = time.perf_counter()
+    hedge = asyncio.ensure_future(_attempt(hedge_llm, messages))
+
+    pending = {primary, hedge}
+    fallback_response = None
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                response = task.result()
+                if validate is not None and not validate(response.content):
+                    # Invalid output only wins if nothing better arrives.
+                    fallback_response = fallback_response or response
+                    continue
+
+                if task is hedge:
+                    hedger.record(hedge_llm.model_name, time.perf_counter() - hedge_start)
+                    hedger.record_hedge_win(model, deadline, time.perf_counter() - start)
+                else:
+                    hedger.record(model, time.perf_counter() - start)
+                    hedger.primary_wins += 1
+                return response
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if fallback_response is not None:
+        return fallback_response
+    raise error
+
+
+def get_event_loop():
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop_pid is not None and _loop_pid != os.getpid():
+            # Forked worker (e.g. gunicorn --preload after a warm-up in the
+            # master): the loop's thread did not survive the fork, and the
+            # clients' connections belong to the parent.
+            _loop = None
+            with _clients_lock:
+                _clients.clear()
+        if _loop is None or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True)
+            thread.start()
+            _loop = loop
+            _loop_pid = os.getpid()
+        return _loop
+
+
+def submit_async(coro):
+    # Schedules coro on the shared loop and returns a concurrent.futures.Future.
+    loop = get_event_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("run_async/submit_async cannot be called from the shared event loop; await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop)
+
+
+def run_async(coro):
+    return submit_async(coro).result()
+
+
+async def _open_connection(llm):
+    # Any HTTP answer leaves a pooled (TLS) connection behind; GET /key is
+    # OpenRouter's cheapest authenticated endpoint, and an error status from
+    # another OpenAI-compatible provider is just as good.
+    import httpx
+    import openai
+    try:
+        await llm.root_async_client.get("/key", cast_to=httpx.Response)
+    except openai.APIStatusError:
+        pass
+
+
+def warm_up(connect=True):
+    # Optional startup hook (WARM_UP=true in app.py, or gunicorn's
+    # post_worker_init): loads langchain/openai, builds the default client
+    # and, with `connect`, opens its provider connection on the shared loop,
+    # so the first request does not pay for any of it. Failures are logged,
+    # not raised - a cold first request is slower, not broken.
+    start = time.perf_counter()
+    try:
+        llm = get_llm()
+        if connect:
+            run_async(_open_connection(llm))
+    except Exception as e:
+        log.warning("LLM warm-up failed: %s", e)
+        return False
+    log.info("LLM warm-up finished", extra={"elapsed_ms": round((time.perf_counter() - start) * 1000), "connect": connect})
+    return True
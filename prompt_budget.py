@@ -0,0 +1,240 @@
+import logging
+import re
+import string
+import threading
+from bisect import bisect_right
+
+from config import config
+from telemetry import prompt_tokens
+
+log = logging.getLogger(__name__)
+
+# Input-token budget per LLM call (system + user prompt). Batched calls get
+# PROMPT_BATCH_ITEM_TOKENS more for every item after the first. When the
+# variable fields would overflow it, the longest ones are cut back first,
+# never below PROMPT_MIN_FIELD_TOKENS each.
+PROMPT_TOKEN_BUDGET = config.prompt_token_budget
+PROMPT_BATCH_ITEM_TOKENS = config.prompt_batch_item_tokens
+PROMPT_MIN_FIELD_TOKENS = config.prompt_min_field_tokens
+# tiktoken encoding used for counting, or "chars" for chars/4. tiktoken
+# downloads an encoding file it has not cached yet (with no timeout), so the
+# encoding is loaded on first use, which get_llm does on a worker thread;
+# offline hosts should pre-fill TIKTOKEN_CACHE_DIR or choose "chars". If
+# loading fails, counting falls back to chars/4 with a warning.
+PROMPT_TOKENIZER = config.prompt_tokenizer
+
+TRUNCATION_MARK = " …"
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+_formatter = string.Formatter()
+
+
+def load_tokenizer():
+    # Loads the encoding now rather than in the first count_tokens call.
+    _get_encoding()
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                if PROMPT_TOKENIZER != "chars":
+                    try:
+                        import tiktoken
+                        _encoding = tiktoken.get_encoding(PROMPT_TOKENIZER)
+                    except Exception as e:
+                        log.warning("Could not load tokenizer %r, prompt budgets are counted as chars/4 "
+                                    "(set PROMPT_TOKENIZER=chars to choose that): %s", PROMPT_TOKENIZER, e)
+                        _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens):
+    # First `max_tokens` tokens of text, cut back to a word boundary and
+    # marked, so the model can tell the field was shortened.
+    encoding = _get_encoding()
+    if encoding is None:
+        head = text[:max_tokens * 4]
+    else:
+        head = encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    if " " in head[len(head) // 2:]:
+        head = head[:head.rindex(" ")]
+    return head.rstrip() + TRUNCATION_MARK
+
+
+def compact_prompt(text):
+    # Drops the source-code indentation and runs of blank lines the prompts
+    # carry from being written as indented triple-quoted strings. Bullet
+    # structure survives because every line keeps its own leading "- ".
+    lines = [line.strip() for line in text.strip().splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines))
+
+
+class StaticPrompt:
+    # A system prompt, or with template=True a user prompt template with
+    # str.format fields. Compacted at import, so the builders only fill in
+    # the per-call fields, and measured once on first use (after the
+    # tokenizer is loaded). `tokens` is the compacted size and `raw_tokens`
+    # the size of the original indented text, both with every field empty.
+    def __init__(self, text, template=False):
+        self.raw = text
+        self.text = compact_prompt(text)
+        self.template = template
+        self.fields = {}
+        if template:
+            for _, name, _, _ in _formatter.parse(self.text):
+                if name:
+                    self.fields[name] = self.fields.get(name, 0) + 1
+        self._sizes = None
+        self._message = None
+
+    def _measure(self):
+        if self._sizes is None:
+            empty = {name: "" for name in self.fields}
+            text, raw = (self.text.format(**empty), self.raw.format(**empty)) if self.template else (self.text, self.raw)
+            self._sizes = (count_tokens(text), count_tokens(raw))
+        return self._sizes
+
+    @property
+    def tokens(self):
+        return self._measure()[0]
+
+    @property
+    def raw_tokens(self):
+        return self._measure()[1]
+
+    @property
+    def message(self):
+        # Built on first use: the langchain message classes are not needed
+        # (or imported) until the first prompt is sent.
+        if self._message is None:
+            from langchain_core.messages import SystemMessage
+            self._message = SystemMessage(content=self.text)
+        return self._message
+
+
+class PromptMessages(list):
+    # The [system, user] messages for one call, plus what compaction did:
+    # the prompt size the old unbounded f-strings would have produced
+    # (tokens_before), the size actually built (tokens_after) and whether any
+    # field had to be trimmed. invoke_llm reports these for calls it sends.
+    def __init__(self, messages, stage, tokens_before, tokens_after, trimmed):
+        super().__init__(messages)
+        self.stage = stage
+        self.tokens_before = tokens_before
+        self.tokens_after = tokens_after
+        self.trimmed = trimmed
+
+
+def fit_fields(fields, available, weights=None):
+    # Trims string fields so sum(tokens * weight) fits in `available`: finds
+    # the largest per-field cap that fits and cuts every longer field down to
+    # it ("water filling"), so short fields are never touched and the result
+    # depends only on the inputs. Returns (fields, tokens before, tokens after).
+    weights = weights or {}
+    tokens = {key: count_tokens(value) for key, value in fields.items()}
+    before = sum(count * weights.get(key, 1) for key, count in tokens.items())
+    if before <= available:
+        return fields, before, before
+
+    def cost(limit):
+        return sum(min(count, limit) * weights.get(key, 1) for key, count in tokens.items())
+
+    # The largest field size that still fits, then the cap grows linearly
+    # from there with every field still longer than it.
+    sizes = sorted(set(tokens.values()))
+    position = bisect_right([cost(size) for size in sizes], available)
+    low = sizes[position - 1] if position else 0
+    step_weight = sum(weights.get(key, 1) for key, count in tokens.items() if count > low)
+    cap = max(PROMPT_MIN_FIELD_TOKENS, low + max(0, available - cost(low)) // step_weight)
+
+    fitted = {key: truncate_tokens(value, cap) if tokens[key] > cap else value for key, value in fields.items()}
+    after = sum(min(count, cap) * weights.get(key, 1) for key, count in tokens.items())
+    return fitted, before, after
+
+
+def build_messages(stage, system, user, fields, items=None, item_template=None, budget=None):
+    # Fills `user` (a StaticPrompt template) with `fields` inside the token
+    # budget and returns PromptMessages. For batched prompts, `items` is a
+    # list of per-item field dicts rendered through `item_template` into the
+    # {items} field; their string values share the budget with `fields`.
+    from langchain_core.messages import HumanMessage
+    items = items or []
+    if budget is None:
+        budget = PROMPT_TOKEN_BUDGET + PROMPT_BATCH_ITEM_TOKENS * max(0, len(items) - 1)
+
+    flat = {}
+    weights = {}
+    for name, value in fields.items():
+        if isinstance(value, str):
+            flat[(None, name)] = value
+            weights[(None, name)] = user.fields.get(name, 1)
+    for index, item in enumerate(items):
+        for name, value in item.items():
+            if isinstance(value, str):
+                flat[(index, name)] = value
+
+    static_tokens = system.tokens + user.tokens + len(items) * (item_template.tokens if item_template else 0)
+    raw_static_tokens = system.raw_tokens + user.raw_tokens + len(items) * (item_template.raw_tokens if item_template else 0)
+    fitted, fields_before, fields_after = fit_fields(flat, budget - static_tokens, weights)
+
+    values = {**fields, **{name: fitted[(None, name)] for (index, name) in flat if index is None}}
+    if items:
+        rendered = []
+        for index, item in enumerate(items):
+            rendered.append(item_template.text.format(**{
+                name: fitted.get((index, name), value) for name, value in item.items()
+            }))
+        values["items"] = "\n\n".join(rendered)
+
+    messages = PromptMessages(
+        [system.message, HumanMessage(content=user.text.format(**values))],
+        stage=stage,
+        tokens_before=raw_static_tokens + fields_before,
+        tokens_after=static_tokens + fields_after,
+        trimmed=fields_after < fields_before
+    )
+    return messages
+
+
+class PromptStats:
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, messages):
+        before = getattr(messages, "tokens_before", None)
+        if before is None:
+            return
+        stage = messages.stage
+        prompt_tokens.inc(before, stage=stage, phase="before_compaction")
+        prompt_tokens.inc(messages.tokens_after, stage=stage, phase="after_compaction")
+        with self._lock:
+            entry = self._stats.setdefault(stage, {"calls": 0, "trimmed_calls": 0, "tokens_before": 0, "tokens_after": 0})
+            entry["calls"] += 1
+            entry["trimmed_calls"] += int(messages.trimmed)
+            entry["tokens_before"] += before
+            entry["tokens_after"] += messages.tokens_after
+
+    def stats(self):
+        with self._lock:
+            stats = {stage: dict(entry) for stage, entry in self._stats.items()}
+        for entry in stats.values():
+            entry["saved_ratio"] = round(1 - entry["tokens_after"] / entry["tokens_before"], 3) if entry["tokens_before"] else 0.0
+        # Not loaded from here: /stats must not trigger a download.
+        stats["tokenizer"] = ("chars/4" if _encoding is None else PROMPT_TOKENIZER) if _encoding_loaded else "not loaded"
+        return stats
+
+
+prompt_stats = PromptStats()
@@ -0,0 +1,183 @@
+import asyncio
+import random
+import time
+
+from config import config
+from scheduler import scheduler as default_scheduler
+
+
+class TokenBucket:
+    # Refills continuously at `rate_per_minute`, holding at most one minute of
+    # budget, so short bursts are allowed but the sustained rate is capped.
+    def __init__(self, rate_per_minute):
+        self.rate_per_minute = float(rate_per_minute)
+        self.tokens = self.rate_per_minute
+        self.updated = time.monotonic()
+
+    def set_rate(self, rate_per_minute):
+        self._refill()
+        self.rate_per_minute = float(rate_per_minute)
+        self.tokens = min(self.tokens, self.rate_per_minute)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate_per_minute, self.tokens + (now - self.updated) * self.rate_per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount):
+        self._refill()
+        # A single call bigger than the whole bucket only has to wait for a full one.
+        amount = min(amount, self.rate_per_minute)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60 / self.rate_per_minute
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= amount
+
+
+class AdaptiveRateLimiter:
+    # Process-wide gate in front of every OpenRouter call: the scheduler caps
+    # in-flight requests and decides which waiting call (by priority class
+    # and tenant) goes next, token buckets cap requests/min and tokens/min, and
+    # the per-minute limits shrink on 429s (multiplicative decrease) and grow
+    # back on successes (additive increase) up to the configured ceiling.
+    def __init__(self, scheduler, requests_per_minute, tokens_per_minute, max_retries=4,
+                 min_fraction=0.1, decrease_factor=0.7, increase_fraction=0.02):
+        self.scheduler = scheduler
+        self.max_rpm = requests_per_minute
+        self.max_tpm = tokens_per_minute
+        self.max_retries = max_retries
+        self.min_fraction = min_fraction
+        self.decrease_factor = decrease_factor
+        self.increase_fraction = increase_fraction
+
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.blocked_until = 0.0
+
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+
+        self._bucket_lock = None
+
+    async def _wait_for_budget(self, estimated_tokens):
+        # Created lazily so it binds to the shared event loop that uses it.
+        if self._bucket_lock is None:
+            self._bucket_lock = asyncio.Lock()
+        async with self._bucket_lock:
+            while True:
+                delay = max(
+                    self.blocked_until - time.monotonic(),
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(estimated_tokens),
+                )
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            self.requests.take(1)
+            self.tokens.take(estimated_tokens)
+
+    def record_success(self, estimated_tokens, actual_tokens=None):
+        if actual_tokens is not None:
+            # Settle the estimate against what the provider actually billed.
+            self.tokens.take(actual_tokens - estimated_tokens)
+        self.requests.set_rate(min(self.max_rpm, self.requests.rate_per_minute + self.max_rpm * self.increase_fraction))
+        self.tokens.set_rate(min(self.max_tpm, self.tokens.rate_per_minute + self.max_tpm * self.increase_fraction))
+
+    def record_rate_limited(self, retry_after):
+        self.rate_limited += 1
+        self.requests.set_rate(max(self.max_rpm * self.min_fraction, self.requests.rate_per_minute * self.decrease_factor))
+        self.tokens.set_rate(max(self.max_tpm * self.min_fraction, self.tokens.rate_per_minute * self.decrease_factor))
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    async def run(self, call, estimated_tokens, usage_tokens=None):
+        # `call` is a zero-arg coroutine factory so it can be retried;
+        # `usage_tokens(result)` returns the billed token count, if known.
+        attempt = 0
+        while True:
+            # The slot is taken before the budget so that, when the buckets
+            # are the bottleneck, they too are drained in scheduler order.
+            async with self.scheduler.slot():
+                await self._wait_for_budget(estimated_tokens)
+                self.in_flight += 1
+                self.calls += 1
+                try:
+                    result = await call()
+                except Exception as e:
+                    if not isinstance(e, retryable_errors()):
+                        raise
+                    error = e
+                else:
+                    self.record_success(estimated_tokens, usage_tokens(result) if usage_tokens else None)
+                    return result
+                finally:
+                    self.in_flight -= 1
+
+            delay = retry_after_seconds(error)
+            if delay is None:
+                delay = backoff_seconds(attempt)
+            # openai.RateLimitError (HTTP 429)
+            if getattr(error, "status_code", None) == 429:
+                self.record_rate_limited(delay)
+
+            if attempt >= self.max_retries:
+                self.failures += 1
+                raise error
+
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            "max_concurrency": self.scheduler.max_concurrency,
+            "in_flight": self.in_flight,
+            "requests_per_minute": round(self.requests.rate_per_minute, 1),
+            "tokens_per_minute": round(self.tokens.rate_per_minute, 1),
+            "calls": self.calls,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "failures": self.failures,
+        }
+
+
+def retryable_errors():
+    # (RateLimitError, APIConnectionError, InternalServerError). openai is
+    # imported here, not at module level: by the time a call fails the client
+    # has loaded it anyway, and importing it up front costs about a second
+    # of startup.
+    import openai
+    return (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # HTTP-date form of Retry-After; fall back to exponential backoff.
+        return None
+    return None
+
+
+def backoff_seconds(attempt, base=1.0, cap=60.0):
+    return min(cap, base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+limiter = AdaptiveRateLimiter(
+    scheduler=default_scheduler,
+    requests_per_minute=config.llm_requests_per_minute,
+    tokens_per_minute=config.llm_tokens_per_minute,
+    max_retries=config.llm_max_retries,
+)
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from config import config
+from inital_analysis_data_extractor import AnalysisFailed, AnalysisNotReady, bounded_timeout, check_inital_analysis_status
+from rate_limiter import backoff_seconds
+from telemetry import readiness_polls, readiness_wait
+
+log = logging.getLogger(__name__)
+
+# How long a generation waits for a still-running initial analysis before
+# giving up with AnalysisNotReady (0: check once, do not wait). Pending
+# analyses are re-polled with exponential backoff and jitter, from
+# READINESS_POLL_BASE_SECONDS up to READINESS_POLL_MAX_SECONDS apart, at most
+# READINESS_POLL_CONCURRENCY status requests at a time.
+READINESS_MAX_WAIT_SECONDS = config.readiness_max_wait_seconds
+READINESS_POLL_BASE_SECONDS = config.readiness_poll_base_seconds
+READINESS_POLL_MAX_SECONDS = config.readiness_poll_max_seconds
+READINESS_POLL_CONCURRENCY = config.readiness_poll_concurrency
+
+# A completed status is reused for this long, so the waits done by bulk runs
+# ahead of the pipeline, and by the pipeline itself, cost one status request.
+READY_TTL_SECONDS = 30
+READY_CACHE_ENTRIES = 1024
+
+# Client errors that will not go away by asking again.
+PERMANENT_HTTP_STATUSES = range(400, 500)
+RETRYABLE_HTTP_STATUSES = (408, 429)
+
+
+def resolve_max_wait_ms(max_wait_ms):
+    if max_wait_ms is None:
+        return round(READINESS_MAX_WAIT_SECONDS * 1000)
+    try:
+        max_wait_ms = int(max_wait_ms)
+    except (TypeError, ValueError):
+        raise ValueError("max_wait_ms must be a non-negative integer")
+    if max_wait_ms < 0:
+        raise ValueError("max_wait_ms must be a non-negative integer")
+    return max_wait_ms
+
+
+def _is_permanent(error):
+    if isinstance(error, (AnalysisFailed, ValueError)):
+        return True
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    return status in PERMANENT_HTTP_STATUSES and status not in RETRYABLE_HTTP_STATUSES
+
+
+class ReadinessWatcher:
+    # Waits for initial analyses to complete instead of failing generations
+    # that arrive too early. Every waiter for an analysis_id shares one
+    # pending entry, and one poller task polls all pending analyses that are
+    # due, READINESS_POLL_CONCURRENCY at a time over the extractor's pooled
+    # session, each on its own backoff schedule. The poller exits when nothing
+    # is pending. Must only be used from the shared event loop.
+    def __init__(self, poll_base=READINESS_POLL_BASE_SECONDS, poll_max=READINESS_POLL_MAX_SECONDS,
+                 concurrency=READINESS_POLL_CONCURRENCY, max_wait=READINESS_MAX_WAIT_SECONDS):
+        self.poll_base = poll_base
+        self.poll_max = poll_max
+        self.concurrency = concurrency
+        self.max_wait = max_wait
+
+        # analysis_id -> {"future", "waiters", "attempt", "next_poll",
+        # "polling", "checked", "status", "listeners"}
+        self._pending = {}
+        # analysis_id -> (expires, status_data), oldest first
+        self._ready = OrderedDict()
+        self._poller = None
+        self._polls = set()
+        self._wakeup = None
+        self._semaphore = None
+        self.polls = {"ready": 0, "pending": 0, "failed": 0, "error": 0}
+        self.waits = {"ready": 0, "waited": 0, "timed_out": 0, "failed": 0}
+
+    def _ready_status(self, analysis_id):
+        entry = self._ready.get(analysis_id)
+        if entry is None:
+            return None
+        expires, status_data = entry
+        if expires < time.monotonic():
+            del self._ready[analysis_id]
+            return None
+        return status_data
+
+    def _remember_ready(self, analysis_id, status_data):
+        self._ready[analysis_id] = (time.monotonic() + READY_TTL_SECONDS, status_data)
+        self._ready.move_to_end(analysis_id)
+        while len(self._ready) > READY_CACHE_ENTRIES:
+            self._ready.popitem(last=False)
+
+    async def wait_ready(self, analysis_id, max_wait=None, on_pending=None, limit=None):
+        # Status data of the completed analysis. Raises AnalysisNotReady if it
+        # has not completed within `max_wait` seconds (default
+        # READINESS_MAX_WAIT_SECONDS) and AnalysisFailed, or the status
+        # request's own error, if it never will. `on_pending(status_data)` is
+        # called for every poll that finds the analysis still running.
+        # `limit` caps the whole call, first status check included (by
+        # default max_wait, but at least one status request's timeout, so
+        # max_wait=0 still checks once).
+        status_data = self._ready_status(analysis_id)
+        if status_data is not None:
+            self.waits["ready"] += 1
+            return status_data
+
+        max_wait = self.max_wait if max_wait is None else max_wait
+        limit = max(max_wait, self.poll_max) if limit is None else limit
+        max_wait = min(max_wait, limit)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        entry = self._pending.get(analysis_id)
+        if entry is None:
+            entry = {
+                "future": loop.create_future(), "waiters": 0, "attempt": 0, "next_poll": start,
+                "polling": False, "checked": asyncio.Event(), "status": None, "listeners": [],
+            }
+            self._pending[analysis_id] = entry
+            self._ensure_poller()
+        elif on_pending and entry["status"] is not None:
+            on_pending(entry["status"])
+        if on_pending:
+            entry["listeners"].append(on_pending)
+
+        entry["waiters"] += 1
+        outcome = "failed"
+        try:
+            # The first status is waited for even with max_wait=0, but only
+            # within `limit`.
+            await asyncio.wait_for(entry["checked"].wait(), max(0.0, limit - (loop.time() - start)))
+            remaining = max(0.0, max_wait - (loop.time() - start))
+            if not entry["future"].done() and remaining <= 0:
+                raise asyncio.TimeoutError
+            status_data = await asyncio.wait_for(asyncio.shield(entry["future"]), remaining)
+            outcome = "waited" if entry["attempt"] > 1 else "ready"
+            return status_data
+        except asyncio.TimeoutError:
+            outcome = "timed_out"
+            raise AnalysisNotReady(
+                f"Initial analysis for {analysis_id} did not complete within {max_wait:g} s "
+                f"({(entry['status'] or {}).get('overall_status')})"
+            )
+        finally:
+            self.waits[outcome] += 1
+            readiness_wait.observe(loop.time() - start, outcome=outcome)
+            if on_pending in entry["listeners"]:
+                entry["listeners"].remove(on_pending)
+            entry["waiters"] -= 1
+            if entry["waiters"] == 0 and self._pending.get(analysis_id) is entry and not entry["future"].done():
+                # Nobody is waiting for this analysis any more: stop polling it.
+                del self._pending[analysis_id]
+                entry["future"].cancel()
+                self._wakeup.set()
+
+    def _ensure_poller(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.ensure_future(self._run())
+        else:
+            self._wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            now = loop.time()
+            idle = [(entry["next_poll"], analysis_id) for analysis_id, entry in self._pending.items() if not entry["polling"]]
+            for next_poll, analysis_id in idle:
+                if next_poll <= now:
+                    self._start_poll(analysis_id)
+            upcoming = [next_poll for next_poll, _ in idle if next_poll > now]
+            self._wakeup.clear()
+            try:
+                # Until the next poll is due, or a poll finishes or a new
+                # analysis is added.
+                await asyncio.wait_for(self._wakeup.wait(), min(upcoming) - now if upcoming else None)
+            except asyncio.TimeoutError:
+                pass
+
+    def _start_poll(self, analysis_id):
+        entry = self._pending[analysis_id]
+        entry["polling"] = True
+        task = asyncio.ensure_future(self._poll(analysis_id, entry))
+        self._polls.add(task)
+        task.add_done_callback(self._polls.discard)
+
+    async def _poll(self, analysis_id, entry):
+        error = None
+        ready = False
+        status_data = None
+        try:
+            async with self._semaphore:
+                if self._pending.get(analysis_id) is not entry:
+                    return
+                timeout = bounded_timeout(self.poll_max)
+                ready, status_data = await asyncio.to_thread(check_inital_analysis_status, analysis_id, timeout)
+        except Exception as e:
+            # Whatever went wrong (a status body that is not an object, say),
+            # the waiters get an answer and the next poll a backoff.
+            error = e
+        finally:
+            entry["polling"] = False
+            entry["attempt"] += 1
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+        if self._pending.get(analysis_id) is not entry:
+            # Every waiter left while the request was in flight.
+            return
+        future = entry["future"]
+        try:
+            if error is not None and _is_permanent(error):
+                outcome = "failed"
+                del self._pending[analysis_id]
+                future.set_exception(error)
+            elif ready:
+                outcome = "ready"
+                del self._pending[analysis_id]
+                self._remember_ready(analysis_id, status_data)
+                future.set_result(status_data)
+            else:
+                delay = backoff_seconds(entry["attempt"] - 1, base=self.poll_base, cap=self.poll_max)
+                entry["next_poll"] = asyncio.get_running_loop().time() + delay
+                if error is None:
+                    outcome = "pending"
+                    entry["status"] = status_data
+                    for listener in list(entry["listeners"]):
+                        try:
+                            listener(status_data)
+                        except Exception:
+                            log.exception("Readiness listener failed", extra={"analysis_id": analysis_id})
+                else:
+                    outcome = "error"
+                    log.warning("Status check failed, will retry", extra={"analysis_id": analysis_id, "error": repr(error)})
+            self.polls[outcome] += 1
+            readiness_polls.inc(outcome=outcome)
+        finally:
+            entry["checked"].set()
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "polling": sum(1 for entry in self._pending.values() if entry["polling"]),
+            "waiters": sum(entry["waiters"] for entry in self._pending.values()),
+            "ready_cached": len(self._ready),
+            "polls": dict(self.polls),
+            "waits": dict(self.waits),
+        }
+
+
+readiness_watcher = ReadinessWatcher()
@@ -0,0 +1,175 @@
+import asyncio
+import contextvars
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from config import config
+from telemetry import scheduler_rejected, scheduler_wait
+
+# Highest priority first. A batch call only gets a slot when no interactive
+# call is waiting for one.
+PRIORITIES = ("interactive", "batch")
+DEFAULT_PRIORITY = config.scheduler_default_priority
+# Calls allowed to wait per priority class; beyond that SchedulerQueueFull.
+SCHEDULER_MAX_QUEUE = config.scheduler_max_queue
+
+_schedule = contextvars.ContextVar("schedule", default={})
+
+
+class SchedulerQueueFull(Exception):
+    pass
+
+
+def parse_weights(spec):
+    # "acme=3,globex=1" -> {"acme": 3.0, "globex": 1.0}
+    weights = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            tenant, weight = part.split("=", 1)
+            weights[tenant.strip()] = float(weight)
+    return weights
+
+
+def resolve_priority(priority, default=DEFAULT_PRIORITY):
+    priority = priority or default
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of: {', '.join(PRIORITIES)}")
+    return priority
+
+
+@contextmanager
+def scheduling(priority=None, tenant=None):
+    # Priority class and tenant for every LLM call made inside the block,
+    # including from tasks it starts; unset values keep the outer ones.
+    fields = {key: value for key, value in (("priority", priority), ("tenant", tenant)) if value}
+    token = _schedule.set({**_schedule.get(), **fields})
+    try:
+        yield
+    finally:
+        _schedule.reset(token)
+
+
+def current_schedule():
+    schedule = _schedule.get()
+    return schedule.get("priority", DEFAULT_PRIORITY), schedule.get("tenant", "default")
+
+
+class PriorityScheduler:
+    # Hands out the `max_concurrency` provider slots. Waiting calls are served
+    # strictly by priority class; within a class, tenants share slots in
+    # proportion to their weight (start-time fair queuing: each grant advances
+    # the tenant's virtual time by 1/weight and the tenant furthest behind is
+    # served next), FIFO per tenant. A tenant that was idle rejoins at the
+    # class's current virtual time, so it cannot bank credit while away.
+    # Must only be used from the shared event loop.
+    def __init__(self, max_concurrency, max_queue=SCHEDULER_MAX_QUEUE, weights=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.weights = weights or {}
+
+        self.in_use = 0
+        # priority -> {tenant: deque of futures}, tenant -> virtual time
+        self._queues = {priority: {} for priority in PRIORITIES}
+        self._vtime = {priority: {} for priority in PRIORITIES}
+        self._clock = {priority: 0.0 for priority in PRIORITIES}
+        self._queued = {priority: 0 for priority in PRIORITIES}
+        self.granted = {priority: 0 for priority in PRIORITIES}
+        self.rejected = {priority: 0 for priority in PRIORITIES}
+
+    def _waiting(self):
+        return any(self._queued.values())
+
+    def _grant(self, priority, tenant):
+        self.in_use += 1
+        self.granted[priority] += 1
+        vtime = max(self._vtime[priority].get(tenant, 0.0), self._clock[priority])
+        self._clock[priority] = vtime
+        self._vtime[priority][tenant] = vtime + 1 / self.weights.get(tenant, 1.0)
+        if len(self._vtime[priority]) > 1024:
+            # Most tenants are analysis_ids that never come back.
+            for idle in [t for t, v in self._vtime[priority].items() if v <= self._clock[priority] and t not in self._queues[priority]]:
+                del self._vtime[priority][idle]
+
+    def _dispatch(self):
+        while self.in_use < self.max_concurrency and self._waiting():
+            priority = next(p for p in PRIORITIES if self._queued[p])
+            queues = self._queues[priority]
+            tenant = min(queues, key=lambda t: (max(self._vtime[priority].get(t, 0.0), self._clock[priority]), t))
+            waiter = queues[tenant].popleft()
+            self._queued[priority] -= 1
+            if not queues[tenant]:
+                del queues[tenant]
+                self._forget_idle(priority, tenant)
+            if waiter.done():
+                continue
+            self._grant(priority, tenant)
+            waiter.set_result(None)
+
+    def _forget_idle(self, priority, tenant):
+        # Idle tenants only matter while ahead of the class clock.
+        if self._vtime[priority].get(tenant, 0.0) <= self._clock[priority]:
+            self._vtime[priority].pop(tenant, None)
+
+    async def acquire(self, priority, tenant):
+        if self.in_use < self.max_concurrency and not self._waiting():
+            self._grant(priority, tenant)
+            scheduler_wait.observe(0.0, priority=priority)
+            return
+
+        if self._queued[priority] >= self.max_queue:
+            self.rejected[priority] += 1
+            scheduler_rejected.inc(priority=priority)
+            raise SchedulerQueueFull(f"Too many queued {priority} LLM calls ({self._queued[priority]}), try again later")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(tenant, deque()).append(waiter)
+        self._queued[priority] += 1
+        start = time.monotonic()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted in the same tick we were cancelled: pass it on.
+                self.release()
+            else:
+                queue = self._queues[priority].get(tenant)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    self._queued[priority] -= 1
+                    if not queue:
+                        del self._queues[priority][tenant]
+                        self._forget_idle(priority, tenant)
+            raise
+        finally:
+            scheduler_wait.observe(time.monotonic() - start, priority=priority)
+
+    def release(self):
+        self.in_use -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self):
+        # One provider slot for the current priority/tenant (see scheduling).
+        priority, tenant = current_schedule()
+        await self.acquire(priority, tenant)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_use": self.in_use,
+            "queued": dict(self._queued),
+            "tenants_waiting": {priority: len(queues) for priority, queues in self._queues.items()},
+            "granted": dict(self.granted),
+            "rejected": dict(self.rejected),
+        }
+
+
+scheduler = PriorityScheduler(
+    max_concurrency=config.llm_max_concurrency,
+    weights=parse_weights(config.scheduler_tenant_weights),
+)
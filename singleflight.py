@@ -0,0 +1,54 @@
+import asyncio
+
+
+class SingleFlight:
+    # Coalesces concurrent calls for the same key onto one in-flight task:
+    # the first caller starts the work, later callers await the same task and
+    # all of them receive its result (or exception). Must only be used from
+    # the shared event loop, which makes the bookkeeping lock-free.
+    def __init__(self):
+        self._in_flight = {}
+        self._waiters = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            self._waiters[task] = 0
+            task.add_done_callback(lambda done: self._forget(key, done))
+
+        self._waiters[task] += 1
+        try:
+            # Shielded so that one caller going away (e.g. a closed SSE stream
+            # or an expired deadline) does not cancel the work the other
+            # callers are waiting on.
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # ...but once the last caller is gone, nobody wants the result.
+            if self._waiters.get(task) == 1:
+                task.cancel()
+            raise
+        finally:
+            if task in self._waiters:
+                self._waiters[task] -= 1
+
+    def _forget(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        self._waiters.pop(task, None)
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every caller went away.
+            task.exception()
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
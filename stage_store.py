@@ -0,0 +1,109 @@
+import json
+import sqlite3
+import threading
+import time
+
+from config import config
+
+
+class StageStore:
+    # Per-analysis_id record of the last generation's stage outputs: the
+    # extractor output plus, per opportunity, its gap analysis, email and
+    # status. Single emails can then be regenerated without re-running
+    # extraction or the other opportunities. Records older than `ttl_seconds`
+    # are treated as missing and trimmed on write. Every method does SQLite
+    # I/O; coroutines call them through asyncio.to_thread.
+    def __init__(self, path, ttl_seconds=7 * 86400, enabled=True):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+
+        self.reads = 0
+        self.misses = 0
+        self.writes = 0
+
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes_since_trim = 0
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            # WAL with synchronous=NORMAL: commits do not fsync the database.
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS stage_results ("
+                "analysis_id TEXT PRIMARY KEY, record TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def get(self, analysis_id):
+        if not self.enabled:
+            return None
+        with self._lock:
+            self.reads += 1
+            row = self._connection().execute(
+                "SELECT record, updated_at FROM stage_results WHERE analysis_id = ?", (analysis_id,)
+            ).fetchone()
+        if row is None or time.time() - row[1] >= self.ttl_seconds:
+            self.misses += 1
+            return None
+        return json.loads(row[0])
+
+    def save(self, analysis_id, record):
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "INSERT OR REPLACE INTO stage_results (analysis_id, record, updated_at) VALUES (?, ?, ?)",
+                (analysis_id, json.dumps(record), now)
+            )
+            db.commit()
+            self.writes += 1
+
+            self._writes_since_trim += 1
+            if self._writes_since_trim >= 100:
+                self._writes_since_trim = 0
+                db.execute("DELETE FROM stage_results WHERE updated_at < ?", (now - self.ttl_seconds,))
+                db.commit()
+
+    def update_items(self, analysis_id, items):
+        # Replaces the given {index: item} entries in place, leaving the other
+        # opportunities untouched, so concurrent single-email regenerations of
+        # one analysis do not overwrite each other. Returns the new record.
+        if not self.enabled:
+            return None
+        with self._lock:
+            db = self._connection()
+            row = db.execute("SELECT record FROM stage_results WHERE analysis_id = ?", (analysis_id,)).fetchone()
+            if row is None:
+                return None
+            record = json.loads(row[0])
+            for index, item in items.items():
+                record["items"][index] = item
+            db.execute(
+                "UPDATE stage_results SET record = ?, updated_at = ? WHERE analysis_id = ?",
+                (json.dumps(record), time.time(), analysis_id)
+            )
+            db.commit()
+            self.writes += 1
+            return record
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "reads": self.reads,
+            "misses": self.misses,
+            "writes": self.writes,
+        }
+
+
+stage_store = StageStore(
+    path=config.stage_store_path,
+    ttl_seconds=config.stage_store_ttl_seconds,
+    enabled=config.stage_store_enabled,
+)
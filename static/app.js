@@ -3,6 +3,146 @@ document.addEventListener("DOMContentLoaded", function() {
   const inputSection = document.getElementById("input-section");
   const emailsSection = document.getElementById("emails-section");
   const loader = document.getElementById("loader");
+  const loaderText = document.getElementById("loader-text");
+
+  const FALLBACK_SUBJECT = "Quick AI Insight for You";
+
+  function renderEmail(emailBox, email, onRegenerate) {
+    emailBox.innerHTML = "";
+
+    // Regenerate just this email from the stored gap analysis
+    if (onRegenerate) {
+      const regenerateBtn = document.createElement("button");
+      regenerateBtn.textContent = "↻";
+      regenerateBtn.title = "Regenerate this email";
+      regenerateBtn.className = "absolute top-3 right-12 text-lg regenerate-btn";
+      regenerateBtn.addEventListener("click", onRegenerate);
+      emailBox.appendChild(regenerateBtn);
+    }
+
+    // Copy button
+    const copyBtn = document.createElement("button");
+    copyBtn.textContent = "📋";
+    copyBtn.className = "absolute top-3 right-3 text-lg copy-btn";
+    copyBtn.addEventListener("click", () => {
+      navigator.clipboard.writeText(email.email_body);
+      alert("Copied to clipboard!");
+    });
+    emailBox.appendChild(copyBtn);
+
+    // Subject
+    const subject = document.createElement("h2");
+    subject.className = "text-lg font-bold mb-2";
+    subject.textContent = email.subject_line;
+    emailBox.appendChild(subject);
+
+    // Body (with paragraphs)
+    const body = document.createElement("p");
+    body.className = "text-gray-700 whitespace-pre-line";
+    body.textContent = email.email_body;
+    emailBox.appendChild(body);
+  }
+
+  function createPlaceholder(index) {
+    const emailBox = document.createElement("div");
+    emailBox.className = "bg-gray-100 p-4 rounded-2xl shadow-neumorphism relative mb-4";
+
+    const status = document.createElement("p");
+    status.className = "text-gray-500 italic";
+    status.textContent = `Analyzing opportunity ${index + 1}...`;
+    emailBox.appendChild(status);
+
+    emailsSection.appendChild(emailBox);
+    return emailBox;
+  }
+
+  function renderUnfinished(emailBox, item) {
+    emailBox.innerHTML = "";
+    const status = document.createElement("p");
+    status.className = "text-gray-500 italic";
+    status.textContent = item.status === "timed_out"
+      ? `Opportunity ${item.index + 1} did not finish in time.`
+      : `Opportunity ${item.index + 1} failed: ${item.error}`;
+    emailBox.appendChild(status);
+  }
+
+  function setSlotStatus(emailBox, text) {
+    emailBox.innerHTML = "";
+    const status = document.createElement("p");
+    status.className = "text-gray-500 italic";
+    status.textContent = text;
+    emailBox.appendChild(status);
+  }
+
+  // Maps a result's "emails" (completed items only) back to opportunity indices.
+  function emailsByIndex(result) {
+    const emails = {};
+    let next = 0;
+    result.items.forEach(item => {
+      if (item.status === "completed") emails[item.index] = result.emails[next++];
+    });
+    return emails;
+  }
+
+  function failedIndices(result) {
+    const emails = emailsByIndex(result);
+    return result.items
+      .filter(item => !emails[item.index] || emails[item.index].subject_line === FALLBACK_SUBJECT)
+      .map(item => item.index);
+  }
+
+  async function regenerate(analysisId, body) {
+    const response = await fetch("/generate-email/regenerate", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ analysis_id: analysisId, ...body })
+    });
+    const result = await response.json();
+    if (!response.ok) throw new Error(result.error);
+    return result;
+  }
+
+  function appendNewAnalysisButton() {
+    const newAnalysisBtn = document.createElement("button");
+    newAnalysisBtn.textContent = "Start New Analysis";
+    newAnalysisBtn.className = "mt-4 bg-gray-400 text-white py-2 px-4 rounded-lg hover:bg-gray-500";
+    newAnalysisBtn.addEventListener("click", () => {
+      emailsSection.classList.add("hidden");
+      emailsSection.innerHTML = "";
+      inputSection.classList.remove("hidden");
+      document.getElementById("analysis-id").value = "";
+    });
+    emailsSection.appendChild(newAnalysisBtn);
+  }
+
+  const POLL_INTERVAL_MS = 1000;
+
+  function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+  }
+
+  // Submits a generation job and polls it until it finishes, calling
+  // onUpdate with every snapshot so emails can be rendered as they land.
+  async function runJob(analysisId, onUpdate) {
+    const response = await fetch("/jobs", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ analysis_id: analysisId })
+    });
+    if (!response.ok) throw new Error("Failed to start generation job");
+
+    let job = await response.json();
+    while (true) {
+      onUpdate(job);
+      if (job.status === "completed") return job;
+      if (job.status === "failed") throw new Error(job.error);
+
+      await sleep(POLL_INTERVAL_MS);
+      const poll = await fetch(`/jobs/${job.job_id}`);
+      if (!poll.ok) throw new Error("Failed to fetch job status");
+      job = await poll.json();
+    }
+  }
 
   generateBtn.addEventListener("click", async () => {
     const analysisId = document.getElementById("analysis-id").value.trim();
@@ -14,68 +154,85 @@ document.addEventListener("DOMContentLoaded", function() {
     // Disable button and show loader
     generateBtn.disabled = true;
     generateBtn.textContent = "Generating...";
+    loaderText.textContent = "Fetching initial analysis...";
     loader.classList.remove("hidden");
 
-    try {
-      const response = await fetch("/generate-email", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ analysis_id: analysisId })
-      });
-
-      if (!response.ok) throw new Error("Failed to fetch");
+    let placeholders = null;
+    const rendered = new Set();
+    let retryBtn = null;
 
-      const data = await response.json();
+    const showEmail = (index, email) => {
+      renderEmail(placeholders[index], email, () => redo({ index }, [index]));
+    };
 
-      // Hide input section, show emails
-      inputSection.classList.add("hidden");
-      emailsSection.innerHTML = "";
-      emailsSection.classList.remove("hidden");
-
-      data.emails.forEach(email => {
-        const emailBox = document.createElement("div");
-        emailBox.className = "bg-gray-100 p-4 rounded-2xl shadow-neumorphism relative mb-4";
-
-        // Copy button
-        const copyBtn = document.createElement("button");
-        copyBtn.textContent = "📋";
-        copyBtn.className = "absolute top-3 right-3 text-lg copy-btn";
-        copyBtn.addEventListener("click", () => {
-          navigator.clipboard.writeText(email.email_body);
-          alert("Copied to clipboard!");
-        });
-        emailBox.appendChild(copyBtn);
+    // Regenerates some emails in place and refreshes the "retry failed" button.
+    async function redo(body, indices) {
+      indices.forEach(index => setSlotStatus(placeholders[index], `Regenerating email ${index + 1}...`));
+      try {
+        const result = await regenerate(analysisId, body);
+        const emails = emailsByIndex(result);
+        result.regenerated.forEach(index => showEmail(index, emails[index]));
+        updateRetryButton(result);
+      } catch (err) {
+        alert("Error regenerating email. Check console for details.");
+        console.error(err);
+      }
+    }
 
-        // Subject
-        const subject = document.createElement("h2");
-        subject.className = "text-lg font-bold mb-2";
-        subject.textContent = email.subject_line;
-        emailBox.appendChild(subject);
+    function updateRetryButton(result) {
+      const failed = failedIndices(result);
+      if (failed.length === 0) {
+        if (retryBtn) retryBtn.remove();
+        retryBtn = null;
+        return;
+      }
+      if (!retryBtn) {
+        retryBtn = document.createElement("button");
+        retryBtn.className = "mt-4 mr-2 bg-blue-500 text-white py-2 px-4 rounded-lg hover:bg-blue-600";
+        emailsSection.appendChild(retryBtn);
+      }
+      retryBtn.textContent = `Retry ${failed.length} failed email${failed.length === 1 ? "" : "s"}`;
+      retryBtn.onclick = () => redo({ failed_only: true }, failed);
+    }
 
-        // Body (with paragraphs)
-        const body = document.createElement("p");
-        body.className = "text-gray-700 whitespace-pre-line";
-        body.textContent = email.email_body;
-        emailBox.appendChild(body);
+    try {
+      const job = await runJob(analysisId, job => {
+        const progress = job.progress;
+        if (progress.stage === "waiting_for_analysis") {
+          loaderText.textContent = "Initial analysis is still running, emails will be generated when it completes...";
+        }
+        if (progress.total === null) return;
 
-        emailsSection.appendChild(emailBox);
-      });
+        if (placeholders === null) {
+          // Hide input section, show one slot per opportunity
+          inputSection.classList.add("hidden");
+          emailsSection.innerHTML = "";
+          emailsSection.classList.remove("hidden");
+          placeholders = [];
+          for (let i = 0; i < progress.total; i++) {
+            placeholders.push(createPlaceholder(i));
+          }
+        }
 
-      // New Analysis button
-      const newAnalysisBtn = document.createElement("button");
-      newAnalysisBtn.textContent = "Start New Analysis";
-      newAnalysisBtn.className = "mt-4 bg-gray-400 text-white py-2 px-4 rounded-lg hover:bg-gray-500";
-      newAnalysisBtn.addEventListener("click", () => {
-        emailsSection.classList.add("hidden");
-        emailsSection.innerHTML = "";
-        inputSection.classList.remove("hidden");
-        document.getElementById("analysis-id").value = "";
+        job.emails.forEach((email, index) => {
+          if (email && !rendered.has(index)) {
+            showEmail(index, email);
+            rendered.add(index);
+          }
+        });
       });
-      emailsSection.appendChild(newAnalysisBtn);
+      if (placeholders !== null) {
+        job.result.items.forEach(item => {
+          if (item.status !== "completed") renderUnfinished(placeholders[item.index], item);
+        });
+        updateRetryButton(job.result);
+      }
+      appendNewAnalysisButton();
 
     } catch (err) {
       alert("Error generating emails. Check console for details.");
       console.error(err);
+      if (!emailsSection.classList.contains("hidden")) appendNewAnalysisButton();
     } finally {
       generateBtn.disabled = false;
       generateBtn.textContent = "Generate";
@@ -0,0 +1,276 @@
+import json
+import logging
+import re
+import threading
+
+from config import config
+from llm_client import invoke_llm
+from telemetry import parse_events
+
+log = logging.getLogger(__name__)
+
+# An answer that is still unusable after local repair is re-asked up to
+# LLM_PARSE_RETRIES times. Re-asks across the process are limited by a retry
+# budget: every first-attempt answer adds LLM_PARSE_RETRY_RATIO of a retry,
+# up to LLM_PARSE_RETRY_BURST, so a model that starts answering garbage
+# cannot double the provider traffic.
+PARSE_RETRIES = config.llm_parse_retries
+PARSE_RETRY_RATIO = config.llm_parse_retry_ratio
+PARSE_RETRY_BURST = config.llm_parse_retry_burst
+
+# Keys each stage's answer must have, and their type. Batched stages use the
+# same schema for every entry of their "items" list.
+SCHEMAS = {
+    "gap": {"gap_analysis": str, "pain_points": list},
+    "email": {"subject_line": str, "email_body": str},
+    "fused": {"gap_analysis": str, "pain_points": list, "subject_line": str, "email_body": str},
+}
+SCHEMAS["gap_batch"] = SCHEMAS["gap"]
+SCHEMAS["email_batch"] = SCHEMAS["email"]
+
+REPAIR_PROMPT = (
+    "Your previous answer could not be used ({error}). Answer again with only a JSON object "
+    "with the keys {keys}, no markdown and no text around it."
+)
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_OPENERS = {"{": "}", "[": "]"}
+# Candidate start positions tried when looking for an embedded object.
+_MAX_STARTS = 4
+
+
+class InvalidOutput(ValueError):
+    pass
+
+
+def _balanced(text, start):
+    # The object or array starting at text[start], up to its matching
+    # bracket (ignoring brackets inside strings), or None if it never closes.
+    stack = []
+    in_string = False
+    escaped = False
+    for position in range(start, len(text)):
+        char = text[position]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in _OPENERS:
+            stack.append(_OPENERS[char])
+        elif char in "}]":
+            if not stack or stack.pop() != char:
+                return None
+            if not stack:
+                return text[start:position + 1]
+    return None
+
+
+def _candidates(content):
+    texts = _FENCE.findall(content) + [content]
+    for text in texts:
+        yield text.strip()
+        starts = [match.start() for match in re.finditer(r"[{\[]", text)][:_MAX_STARTS]
+        for start in starts:
+            candidate = _balanced(text, start)
+            if candidate is not None:
+                yield candidate
+
+
+def extract_json(content):
+    # (value, repaired) for the JSON value in a model answer. Plain JSON is
+    # the fast path; otherwise markdown fences and any text around the value
+    # are stripped, the first balanced object is located and trailing commas
+    # are dropped. Raises InvalidOutput when nothing parses.
+    if not isinstance(content, str):
+        raise InvalidOutput("answer is not text")
+    try:
+        return json.loads(content), False
+    except ValueError:
+        pass
+    for candidate in _candidates(content):
+        for variant in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+            try:
+                return json.loads(variant), True
+            except ValueError:
+                continue
+    raise InvalidOutput("no JSON object in answer" if "{" not in content else "malformed or truncated JSON")
+
+
+def check(value, schema):
+    # (item, repaired): `value` checked against `schema`, with harmless
+    # mismatches fixed (a single pain point given as a string, numbers where
+    # text was asked for). Raises InvalidOutput for anything missing or empty.
+    if not isinstance(value, dict):
+        raise InvalidOutput("answer is not a JSON object")
+    item = dict(value)
+    repaired = False
+    for key, kind in schema.items():
+        field = item.get(key)
+        if kind is list:
+            if isinstance(field, str) and field.strip():
+                field = [field]
+                repaired = True
+            if not isinstance(field, list) or not field:
+                raise InvalidOutput(f'"{key}" must be a non-empty list')
+            item[key] = [str(entry) for entry in field]
+        else:
+            if isinstance(field, (int, float)) and not isinstance(field, bool):
+                field = str(field)
+                repaired = True
+            if not isinstance(field, str) or not field.strip():
+                raise InvalidOutput(f'"{key}" must be non-empty text')
+            item[key] = field
+    return item, repaired
+
+
+def parse_answer(content, stage):
+    # The checked answer of a single-item stage; see extract_json and check.
+    value, extracted = extract_json(content)
+    item, coerced = check(value, SCHEMAS[stage])
+    return item, extracted or coerced
+
+
+def parse_items(content, count, stage):
+    # ({index: item}, repaired) for the well-formed entries of a batched
+    # answer; anything malformed, out of range or missing is absent.
+    try:
+        value, repaired = extract_json(content)
+    except InvalidOutput:
+        return {}, False
+    items = value.get("items") if isinstance(value, dict) else value
+    if not isinstance(items, list):
+        return {}, False
+
+    found = {}
+    for entry in items:
+        if not isinstance(entry, dict):
+            continue
+        index = entry.get("index")
+        if not isinstance(index, int) or not 0 <= index < count or index in found:
+            continue
+        try:
+            item, coerced = check(entry, SCHEMAS[stage])
+        except InvalidOutput:
+            continue
+        item.pop("index", None)
+        found[index] = item
+        repaired = repaired or coerced
+    return found, repaired
+
+
+def validator(stage):
+    # invoke_llm's `validate` for a stage: only answers this module can use
+    # are cached, or win a hedged race.
+    def validate(content):
+        try:
+            if stage.endswith("_batch"):
+                value, _ = extract_json(content)
+                return isinstance(value, (dict, list))
+            parse_answer(content, stage)
+            return True
+        except InvalidOutput:
+            return False
+    return validate
+
+
+class RetryBudget:
+    def __init__(self, ratio=PARSE_RETRY_RATIO, burst=PARSE_RETRY_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self._balance = float(burst)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self.burst, self._balance + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+    def balance(self):
+        with self._lock:
+            return round(self._balance, 2)
+
+
+class ParseStats:
+    # Per stage: answers parsed on the first attempt as-is ("ok") or after
+    # local repair ("repaired" - each one a re-ask or fallback saved), and for
+    # the rest, re-asks made, re-asks that worked and fallbacks used.
+    OUTCOMES = ("ok", "repaired", "retries", "retry_ok", "budget_exhausted", "fallback", "missing")
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, outcome, amount=1):
+        if not amount:
+            return
+        parse_events.inc(amount, stage=stage, outcome=outcome)
+        with self._lock:
+            entry = self._stats.setdefault(stage, dict.fromkeys(self.OUTCOMES, 0))
+            entry[outcome] += amount
+
+    def stats(self):
+        with self._lock:
+            stats = {stage: dict(entry) for stage, entry in self._stats.items()}
+        for entry in stats.values():
+            answers = entry["ok"] + entry["repaired"] + entry["fallback"] + entry["retry_ok"] + entry["missing"]
+            entry["parse_success_rate"] = round((entry["ok"] + entry["repaired"]) / answers, 3) if answers else 1.0
+            entry["retries_saved"] = entry["repaired"]
+        stats["retry_budget"] = retry_budget.balance()
+        return stats
+
+
+retry_budget = RetryBudget()
+parse_stats = ParseStats()
+
+
+def repair_messages(messages, answer, stage, error):
+    # The conversation so far plus the unusable answer, so the correction
+    # turn refers to something the model can see.
+    from langchain_core.messages import AIMessage, HumanMessage
+    keys = ", ".join(f'"{key}"' for key in SCHEMAS[stage])
+    return [*messages, AIMessage(content=answer), HumanMessage(content=REPAIR_PROMPT.format(error=error, keys=keys))]
+
+
+async def invoke_structured(llm, messages, stage, fresh=False):
+    # invoke_llm for a single-item stage, returning the checked answer. An
+    # answer local repair cannot fix is re-asked (just that call, within the
+    # retry budget); InvalidOutput is raised if none of the attempts is
+    # usable, for the caller's fallback.
+    validate = validator(stage)
+    response = await invoke_llm(llm, messages, fresh=fresh, validate=validate, stage=stage)
+    retry_budget.deposit()
+    try:
+        item, repaired = parse_answer(response.content, stage)
+        parse_stats.record(stage, "repaired" if repaired else "ok")
+        return item
+    except InvalidOutput as e:
+        error = e
+
+    for _ in range(PARSE_RETRIES):
+        if not retry_budget.withdraw():
+            parse_stats.record(stage, "budget_exhausted")
+            break
+        parse_stats.record(stage, "retries")
+        log.info("Re-asking for unusable answer", extra={"stage": stage, "error": str(error)})
+        response = await invoke_llm(llm, repair_messages(messages, response.content, stage, error), fresh=fresh, validate=validate, stage=stage)
+        try:
+            item, _ = parse_answer(response.content, stage)
+            parse_stats.record(stage, "retry_ok")
+            return item
+        except InvalidOutput as e:
+            error = e
+
+    parse_stats.record(stage, "fallback")
+    raise error
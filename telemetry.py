@@ -0,0 +1,228 @@
+import contextvars
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from config import config
+
+log = logging.getLogger(__name__)
+
+# Fields attached to every log line and span emitted while handling one
+# generation (analysis_id, mode, ...). Context variables follow the work into
+# asyncio tasks and asyncio.to_thread workers.
+_log_context = contextvars.ContextVar("log_context", default={})
+
+# Latency buckets in seconds, from cache hits up to slow LLM calls.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# LogRecord attributes that are not user-supplied `extra` fields.
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label key -> [per-bucket counts, sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text):
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, gauges=None):
+        # Prometheus text exposition format. `gauges` is {prefix: stats dict}
+        # for the existing /stats snapshots; their numeric leaves are exported
+        # as gauges named prefix_key.
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, stats in (gauges or {}).items():
+            for name, value in _flatten(prefix, stats):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _flatten(prefix, stats):
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+registry = Registry()
+
+span_duration = registry.histogram("span_duration_seconds", "Duration of instrumented pipeline stages.")
+llm_requests = registry.counter("llm_requests_total", "LLM requests by stage and where the answer came from.")
+llm_tokens = registry.counter("llm_tokens_total", "Prompt and completion tokens sent to and received from the provider.")
+parse_events = registry.counter("llm_parse_events_total", "Outcome of parsing LLM answers: ok, repaired locally, re-asked, fallback or missing batch items.")
+generations = registry.counter("generations_total", "Finished generations by mode and outcome.")
+opportunities_collapsed = registry.counter("opportunities_collapsed_total", "Near-duplicate opportunities folded into another before any LLM call.")
+prompt_tokens = registry.counter("prompt_tokens_total", "Prompt tokens of LLM calls sent, as the unbounded prompt would have been and as actually built.")
+scheduler_wait = registry.histogram("scheduler_wait_seconds", "Time LLM calls waited for a provider slot, by priority class.")
+scheduler_rejected = registry.counter("scheduler_rejected_total", "LLM calls refused because their priority class queue was full.")
+readiness_polls = registry.counter("readiness_polls_total", "Initial analysis status polls by outcome: ready, pending, failed or error.")
+readiness_wait = registry.histogram("readiness_wait_seconds", "Time generations waited for their initial analysis to complete, by outcome.",
+                                    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600))
+
+
+@contextmanager
+def span(name, **fields):
+    # Times a stage into span_duration_seconds{span=...,status=...} and logs it
+    # at DEBUG. The yielded dict can be filled in with extra fields (token
+    # counts, sizes) before the block ends.
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield fields
+    except BaseException as e:
+        status = "cancelled" if type(e).__name__ == "CancelledError" else "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        span_duration.observe(elapsed, span=name, status=status)
+        log.debug("span %s", name, extra={"span": name, "status": status, "duration_ms": round(elapsed * 1000, 1), **fields})
+
+
+@contextmanager
+def log_context(**fields):
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class _ContextFilter(logging.Filter):
+    def filter(self, record):
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RESERVED_ATTRS)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class KeyValueFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        fields = " ".join(f"{key}={value}" for key, value in vars(record).items() if key not in _RESERVED_ATTRS)
+        return f"{line} {fields}" if fields else line
+
+
+def configure_logging(level=None, fmt=None):
+    # LOG_LEVEL (default INFO) and LOG_FORMAT ("text" or "json"). Called by
+    # the entry points (app.py, bulk CLI), not at import time.
+    level = (level or config.log_level).upper()
+    fmt = (fmt or config.log_format).lower()
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.addFilter(_ContextFilter())
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(KeyValueFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    # httpx logs every request at INFO; keep the HTTP clients for DEBUG runs.
+    if root.getEffectiveLevel() > logging.DEBUG:
+        for name in ("httpx", "httpcore", "openai", "urllib3"):
+            logging.getLogger(name).setLevel(logging.WARNING)